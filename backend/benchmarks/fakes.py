@@ -0,0 +1,95 @@
+"""
+Deterministic stand-ins for the external services used during ingestion and chat.
+
+Everything here is seeded from the input text, so two runs over the same
+corpus produce the same vectors, OCR output and replies.
+"""
+import time
+import base64
+import hashlib
+from types import SimpleNamespace
+
+import numpy as np
+import pymupdf
+
+
+def _seed(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+# ---------------------- EMBEDDINGS ----------------------
+# Subclasses of the real fastembed classes (so isinstance checks keep
+# working) that skip model download and ONNX inference entirely.
+
+def install_fake_embedders(colbert_tokens: int = 4):
+    import fastembed
+    from fastembed.sparse.sparse_embedding_base import SparseEmbedding
+
+    class FakeTextEmbedding(fastembed.TextEmbedding):
+        def __init__(self, model_name=None, *args, **kwargs):
+            self.model_name = model_name
+
+        def embed(self, documents, batch_size=256, parallel=None, **kwargs):
+            for text in ([documents] if isinstance(documents, str) else documents):
+                vector = np.random.default_rng(_seed(text)).standard_normal(384).astype(np.float32)
+                yield vector / np.linalg.norm(vector)
+
+        def query_embed(self, query, **kwargs):
+            yield from self.embed(query)
+
+    class FakeSparseTextEmbedding(fastembed.SparseTextEmbedding):
+        def __init__(self, model_name=None, *args, **kwargs):
+            self.model_name = model_name
+
+        def embed(self, documents, batch_size=256, parallel=None, **kwargs):
+            for text in ([documents] if isinstance(documents, str) else documents):
+                indices = sorted({_seed(word) % (2 ** 31) for word in text.lower().split()})
+                yield SparseEmbedding(
+                    values=np.ones(len(indices), dtype=np.float32),
+                    indices=np.array(indices, dtype=np.int64),
+                )
+
+        def query_embed(self, query, **kwargs):
+            yield from self.embed(query)
+
+    class FakeLateInteractionTextEmbedding(fastembed.LateInteractionTextEmbedding):
+        def __init__(self, model_name=None, *args, **kwargs):
+            self.model_name = model_name
+
+        def embed(self, documents, batch_size=256, parallel=None, **kwargs):
+            for text in ([documents] if isinstance(documents, str) else documents):
+                vectors = np.random.default_rng(_seed(text)).standard_normal((colbert_tokens, 128)).astype(np.float32)
+                yield vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+        def query_embed(self, query, **kwargs):
+            yield from self.embed(query)
+
+    fastembed.TextEmbedding = FakeTextEmbedding
+    fastembed.SparseTextEmbedding = FakeSparseTextEmbedding
+    fastembed.LateInteractionTextEmbedding = FakeLateInteractionTextEmbedding
+
+
+# ---------------------- MISTRAL OCR ----------------------
+class FakeMistral:
+    """Answers `client.ocr.process` with the PDF's text layer, one markdown string per page."""
+
+    def __init__(self, latency_s: float = 0.0):
+        self.ocr = self
+        self.latency_s = latency_s
+
+    def process(self, model, document, include_image_base64=False, **kwargs):
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        encoded = document["document_url"].split("base64,", 1)[1]
+        with pymupdf.open(stream=base64.b64decode(encoded), filetype="pdf") as doc:
+            pages = [
+                SimpleNamespace(index=idx, markdown=page.get_text().strip())
+                for idx, page in enumerate(doc)
+            ]
+        return SimpleNamespace(pages=pages)
+
+
+# ---------------------- LLM ----------------------
+async def fake_openai_reply(model, history, structured_context):
+    """Stand-in for `agenerate_openai_reply`: a fixed-size answer, no network."""
+    return f"Answer based on {structured_context.count('File:')} retrieved chunks."
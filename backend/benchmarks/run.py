@@ -0,0 +1,337 @@
+"""
+Offline benchmark: ingestion throughput and query latency at several corpus sizes.
+
+Runs the real routers, `utils.chunking` and `utils.qdrant_setup` against
+Qdrant's local in-memory mode, with deterministic stand-ins for Mistral OCR,
+the LLM and (unless `--real-embeddings`) the fastembed models. Each corpus
+size runs in its own subprocess, so peak RSS and module-level state are
+per size.
+
+Usage (from backend/):
+    python -m benchmarks.run --sizes 1000,100000,1000000
+    python -m benchmarks.run --sizes 1000 --compare benchmarks/results/<previous>.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import zipfile
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+DEFAULT_SIZES = "1000,100000,1000000"
+PROFILES = ("fast", "hybrid", "precise")
+
+# Synthetic vocabulary: pronounceable pseudo-words, so BM25 sees a realistic term distribution
+_SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "xe", "zu", "pra", "sto", "gle", "dri", "fen"]
+
+
+def build_vocabulary(size: int = 5000, seed: int = 7):
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ---------------------- CORPUS ----------------------
+def write_corpus(archive_path: Path, n_chunks: int, pages_per_pdf: int, words_per_page: int, vocabulary):
+    """
+    Write a ZIP of PDFs with `n_chunks` pages in total. Sessions are created
+    with page-level chunking, so every page becomes exactly one chunk.
+    """
+    import pymupdf
+
+    rng = random.Random(n_chunks)
+    n_files = (n_chunks + pages_per_pdf - 1) // pages_per_pdf
+    with zipfile.ZipFile(archive_path, "w", compression=zipfile.ZIP_STORED) as archive:
+        remaining = n_chunks
+        for file_idx in range(n_files):
+            pages = min(pages_per_pdf, remaining)
+            remaining -= pages
+            with pymupdf.open() as doc:
+                for page_idx in range(pages):
+                    page = doc.new_page()
+                    words = [f"doc{file_idx}p{page_idx}"] + rng.choices(vocabulary, k=words_per_page)
+                    page.insert_textbox(page.rect + (36, 36, -36, -36), " ".join(words), fontsize=9)
+                archive.writestr(f"doc_{file_idx:06d}.pdf", doc.tobytes())
+    return n_files
+
+
+# ---------------------- SINGLE SIZE (child process) ----------------------
+def configure_environment(workdir: Path, args):
+    # Forced, so a developer's .env never points the benchmark at a real Qdrant or real APIs
+    os.environ.update({
+        "QDRANT_URL": ":memory:",
+        "COLLECTION_NAME": "benchmark",
+        "DATA_FOLDER": str(workdir / "data") + os.sep,
+        "DOC_CACHE_ENABLED": "false",
+        "EMBEDDING_CACHE_ENABLED": "false",
+        "MISTRAL_API_KEY": "benchmark",
+        "OPENAI_API_KEY": "benchmark",
+    })
+    os.environ.setdefault("DENSE_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+    os.environ.setdefault("BM25_EMBEDDING_MODEL", "Qdrant/bm25")
+    os.environ.setdefault("LATE_INTERACTION_EMBEDDING_MODEL", "colbert-ir/colbertv2.0")
+    if not args.with_query_caches:
+        # Every query is distinct anyway; this also keeps cache bookkeeping out of the numbers
+        os.environ["QUERY_EMBEDDING_CACHE_SIZE"] = "0"
+        os.environ["RETRIEVAL_CACHE_SIZE"] = "0"
+    if args.ocr_all:
+        # The synthetic PDFs all have a text layer; force them through the (fake) OCR path
+        os.environ["TEXT_LAYER_ENABLED"] = "false"
+
+
+def stage_totals():
+    """Per-stage count and total seconds from the `utils.metrics` histograms."""
+    from utils.metrics import STAGE_SECONDS
+
+    totals = {}
+    for metric in STAGE_SECONDS.collect():
+        for sample in metric.samples:
+            if sample.name.endswith("_count") or sample.name.endswith("_sum"):
+                key = f"{sample.labels['pipeline']}.{sample.labels['stage']}"
+                field = "count" if sample.name.endswith("_count") else "seconds"
+                totals.setdefault(key, {})[field] = sample.value
+    return totals
+
+
+def percentiles(latencies_ms):
+    import numpy as np
+
+    values = np.asarray(latencies_ms)
+    return {
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "mean_ms": float(values.mean()),
+    }
+
+
+def run_single(n_chunks: int, workdir: Path, args) -> dict:
+    configure_environment(workdir, args)
+    sys.path.insert(0, str(BACKEND_DIR))
+    os.chdir(BACKEND_DIR)
+
+    from benchmarks import fakes
+    if not args.real_embeddings:
+        fakes.install_fake_embedders(colbert_tokens=args.colbert_tokens)
+
+    from fastapi.testclient import TestClient
+    import utils.pdf_ocr as pdf_ocr
+    import routers.chat_router as chat_router
+    from main import app
+
+    pdf_ocr.client = fakes.FakeMistral(latency_s=args.ocr_latency_ms / 1000)
+    chat_router.agenerate_openai_reply = fakes.fake_openai_reply
+
+    vocabulary = build_vocabulary()
+    archive_path = workdir / f"corpus_{n_chunks}.zip"
+    generate_start = time.perf_counter()
+    n_files = write_corpus(archive_path, n_chunks, args.pages_per_pdf, args.words_per_page, vocabulary)
+    generate_seconds = time.perf_counter() - generate_start
+
+    client = TestClient(app)
+
+    # Ingestion: the same synchronous request the frontend makes
+    ingest_start = time.perf_counter()
+    with open(archive_path, "rb") as f:
+        response = client.post(
+            "/api/sessions",
+            files={"archive": (archive_path.name, f, "application/zip")},
+            data={"session_name": f"benchmark-{n_chunks}"},
+        )
+    ingest_seconds = time.perf_counter() - ingest_start
+    response.raise_for_status()
+    session = response.json()
+    ingest_stages = stage_totals()
+
+    # Queries: distinct questions drawn from the corpus vocabulary
+    rng = random.Random(n_chunks + 1)
+    query = {}
+    for profile in PROFILES:
+        latencies = []
+        for i in range(args.warmup + args.queries):
+            question = " ".join(rng.choices(vocabulary, k=args.query_words))
+            start = time.perf_counter()
+            response = client.post("/api/chat/send", json={
+                "session_id": session["id"],
+                "messages": [{"role": "user", "content": question}],
+                "retrieval_profile": profile,
+                "top_k": args.top_k,
+            })
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            response.raise_for_status()
+            if i >= args.warmup:
+                latencies.append(elapsed_ms)
+        query[profile] = percentiles(latencies)
+
+    return {
+        "size": n_chunks,
+        "files": n_files,
+        "chunks": session.get("chunkCount"),
+        "failed_files": len(session.get("failedFiles") or []),
+        "corpus_seconds": generate_seconds,
+        "ingest_seconds": ingest_seconds,
+        "chunks_per_second": (session.get("chunkCount") or 0) / ingest_seconds if ingest_seconds else None,
+        "ingest_stages": ingest_stages,
+        "query": query,
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+
+# ---------------------- REPORTING ----------------------
+def print_table(results):
+    print(f"{'chunks':>10} {'ingest s':>10} {'chunks/s':>10} {'profile':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'peak RSS MiB':>13}")
+    for r in results:
+        rss = f"{r['peak_rss_bytes'] / 2 ** 20:.0f}" if r.get("peak_rss_bytes") else "-"
+        for i, (profile, q) in enumerate(r["query"].items()):
+            head = (f"{r['chunks']:>10} {r['ingest_seconds']:>10.1f} {r['chunks_per_second']:>10.0f}"
+                    if i == 0 else " " * 32)
+            print(f"{head} {profile:>8} {q['p50_ms']:>8.1f} {q['p95_ms']:>8.1f} {q['p99_ms']:>8.1f} {rss if i == 0 else '':>13}")
+
+
+def print_comparison(results, baseline_path):
+    """Relative change against a previous results file, for the sizes both runs cover."""
+    baseline = json.loads(Path(baseline_path).read_text())
+    previous = {r["size"]: r for r in baseline["results"]}
+    print(f"\nCompared with {baseline_path} (commit {baseline.get('commit')}):")
+
+    def delta(new, old):
+        return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+    for r in results:
+        old = previous.get(r["size"])
+        if old is None:
+            continue
+        print(f"  {r['size']} chunks: chunks/s {delta(r['chunks_per_second'], old['chunks_per_second'])}"
+              + (f", peak RSS {delta(r['peak_rss_bytes'], old['peak_rss_bytes'])}"
+                 if r.get("peak_rss_bytes") and old.get("peak_rss_bytes") else ""))
+        for profile, q in r["query"].items():
+            old_q = old["query"].get(profile)
+            if old_q:
+                print(f"    {profile:>8}: p50 {delta(q['p50_ms'], old_q['p50_ms'])}, "
+                      f"p95 {delta(q['p95_ms'], old_q['p95_ms'])}, p99 {delta(q['p99_ms'], old_q['p99_ms'])}")
+
+
+# ---------------------- ENTRY POINT ----------------------
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Ingestion throughput and query latency benchmark.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Comma-separated corpus sizes, in chunks")
+    parser.add_argument("--queries", type=int, default=200, help="Measured queries per retrieval profile")
+    parser.add_argument("--warmup", type=int, default=10, help="Unmeasured queries per profile")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--query-words", type=int, default=6)
+    parser.add_argument("--pages-per-pdf", type=int, default=100)
+    parser.add_argument("--words-per-page", type=int, default=80)
+    parser.add_argument("--colbert-tokens", type=int, default=4,
+                        help="Token vectors per chunk from the fake ColBERT model")
+    parser.add_argument("--ocr-latency-ms", type=float, default=0.0,
+                        help="Simulated latency of each OCR request")
+    parser.add_argument("--ocr-all", action="store_true",
+                        help="OCR every page instead of reading the PDFs' text layer")
+    parser.add_argument("--real-embeddings", action="store_true",
+                        help="Use the real fastembed models (downloads them on first run)")
+    parser.add_argument("--with-query-caches", action="store_true",
+                        help="Keep the query-embedding and retrieval caches enabled")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/<commit>-<time>.json)")
+    parser.add_argument("--compare", help="Previous results file to compare against")
+    parser.add_argument("--verbose", action="store_true", help="Show the backend's own log output")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def child_argv(args):
+    """Per-size options forwarded to the child process."""
+    argv = []
+    for name in ("queries", "warmup", "top_k", "query_words", "pages_per_pdf",
+                 "words_per_page", "colbert_tokens", "ocr_latency_ms"):
+        argv += ["--" + name.replace("_", "-"), str(getattr(args, name))]
+    for name in ("real_embeddings", "with_query_caches", "ocr_all"):
+        if getattr(args, name):
+            argv.append("--" + name.replace("_", "-"))
+    return argv
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.single is not None:
+        workdir = Path(tempfile.mkdtemp(prefix="optim-rag-bench-"))
+        try:
+            result = run_single(args.single, workdir, args)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        Path(args.result_file).write_text(json.dumps(result))
+        return
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    results = []
+    for size in sizes:
+        print(f"[BENCH] {size} chunks ...", flush=True)
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
+            result_file = tmp.name
+        try:
+            subprocess.run(
+                [sys.executable, "-m", "benchmarks.run", *child_argv(args),
+                 "--single", str(size), "--result-file", result_file],
+                cwd=BACKEND_DIR,
+                stdout=None if args.verbose else subprocess.DEVNULL,
+                check=True,
+            )
+            results.append(json.loads(Path(result_file).read_text()))
+        finally:
+            os.unlink(result_file)
+
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("single", "result_file", "compare", "output", "verbose")},
+        "results": results,
+    }
+
+    output = Path(args.output) if args.output else (
+        RESULTS_DIR / f"{report['commit'] or 'nogit'}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+
+    print_table(results)
+    print(f"\n[BENCH] Results written to {output}")
+    if args.compare:
+        print_comparison(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import os
+import json
+import asyncio
+from typing import List, Optional
+from dotenv import load_dotenv
+
+from models.schema import ChatMessage
+from chat_clients.openai_client import async_client
+from utils.context_builder import count_tokens
+from utils.disk_cache import content_hash
+from utils.metrics import timed
+from utils.ttl_cache import TTLCache
+
+load_dotenv()
+
+# Most recent user turns (with the replies in between) sent verbatim
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "4"))
+# User turns left out of the summary that trigger folding them in; until
+# then they are sent verbatim and the stored summary is reused unchanged
+HISTORY_SUMMARY_EVERY = int(os.getenv("HISTORY_SUMMARY_EVERY", "4"))
+# Token budget for the whole history: verbatim turns plus the summary
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "4000"))
+# Share of the budget set aside for the summary of older turns
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "500"))
+HISTORY_SUMMARY_MODEL = os.getenv("HISTORY_SUMMARY_MODEL", "gpt-5-mini")
+
+# Rolling summaries per conversation: {"covered": n, "hash": ..., "summary": ...}
+summary_cache = TTLCache(
+    int(os.getenv("HISTORY_SUMMARY_CACHE_SIZE", "1024")),
+    float(os.getenv("HISTORY_SUMMARY_CACHE_TTL", str(24 * 3600))),
+)
+
+SUMMARY_PROMPT = (
+    "Summarize the earlier part of a conversation between a user and an assistant that answers "
+    "questions about the user's documents. Keep the facts, names, numbers, decisions and open "
+    "questions needed to continue the conversation. Write plain prose, at most {words} words."
+)
+
+
+def conversation_key(session_id: str, messages: List[ChatMessage], conversation_id: Optional[str] = None) -> str:
+    """Cache key of a conversation: the client's id, else the session plus the opening message."""
+    if conversation_id:
+        return f"{session_id}:{conversation_id}"
+    first = messages[0].content if messages else ""
+    return f"{session_id}:{content_hash(first.encode('utf-8'))}"
+
+def _messages_hash(messages: List[ChatMessage]) -> str:
+    return content_hash(json.dumps([[m.role, m.content] for m in messages]).encode("utf-8"))
+
+def _messages_tokens(messages: List[ChatMessage]) -> int:
+    return sum(count_tokens(m.content) + 4 for m in messages)  # + per-message framing
+
+def recent_start(messages: List[ChatMessage], keep_turns: int) -> int:
+    """Index of the first message of the last `keep_turns` user turns."""
+    seen = 0
+    for idx in range(len(messages) - 1, -1, -1):
+        if messages[idx].role == "user":
+            seen += 1
+            if seen == keep_turns:
+                return idx
+    return 0
+
+def count_turns(messages: List[ChatMessage]) -> int:
+    return sum(1 for m in messages if m.role == "user")
+
+
+# ---------------------- SUMMARIES ----------------------
+async def summarize(previous_summary: Optional[str], messages: List[ChatMessage]) -> str:
+    """Fold `messages` into `previous_summary` with one LLM call."""
+    transcript = "\n".join(f"{m.role}: {m.content}" for m in messages)
+    input_messages = [{
+        "role": "developer",
+        "content": SUMMARY_PROMPT.format(words=max(50, HISTORY_SUMMARY_TOKENS * 3 // 4)),
+    }]
+    if previous_summary:
+        input_messages.append({"role": "developer", "content": f"Summary so far:\n{previous_summary}"})
+    input_messages.append({"role": "user", "content": f"Conversation to add to the summary:\n{transcript}"})
+
+    response = await async_client.responses.create(
+        model=HISTORY_SUMMARY_MODEL,
+        reasoning={"effort": "low"},
+        input=input_messages,
+    )
+    return response.output_text.strip()
+
+def stored_summary(key: str, messages: List[ChatMessage]) -> Optional[dict]:
+    """The cached summary of this conversation, if it covers a prefix of `messages`."""
+    entry = summary_cache.get(key)
+    if entry and entry["covered"] <= len(messages) and entry["hash"] == _messages_hash(messages[:entry["covered"]]):
+        return entry
+    return None
+
+async def rolling_summary(key: str, older: List[ChatMessage]) -> Optional[str]:
+    """
+    Summary of `older`, extending the cached summary of this conversation
+    when it covers a prefix of `older` (only the new messages are sent to
+    the LLM). Returns the last good summary, or None, if summarizing fails.
+    """
+    entry = stored_summary(key, older)
+    previous, covered = (entry["summary"], entry["covered"]) if entry else (None, 0)
+    if covered == len(older):
+        return previous
+
+    try:
+        with timed("chat", "history_summary"):
+            summary = await summarize(previous, older[covered:])
+    except Exception as e:
+        print(f"[HISTORY] Summarizing {len(older) - covered} messages failed: {e}")
+        return previous
+
+    summary_cache.set(key, {"covered": len(older), "hash": _messages_hash(older), "summary": summary})
+    print(f"[HISTORY] {key}: summarized {len(older) - covered} more messages ({len(older)} total)")
+    return summary
+
+
+# ---------------------- COMPACTION ----------------------
+def plan_history(messages: List[ChatMessage], key: str, keep_turns: int, token_budget: int):
+    """
+    Where to cut `messages` for `compact_history`: `(split, entry)`.
+
+    With a usable stored summary `entry` (None without one), `split` is the
+    number of messages it covers and everything after is sent verbatim.
+    Otherwise the summary must be refreshed to cover `messages[:split]`.
+    """
+    split = recent_start(messages, max(1, keep_turns))
+    verbatim_budget = token_budget - HISTORY_SUMMARY_TOKENS
+    while split < len(messages) - 1 and _messages_tokens(messages[split:]) > verbatim_budget:
+        split += 1
+    if split == 0:
+        return 0, None
+
+    # Keep the summary (and so the prompt prefix) unchanged while the turns
+    # it leaves out are few and still fit the budget
+    entry = stored_summary(key, messages[:split])
+    covered = entry["covered"] if entry else 0
+    if (count_turns(messages[covered:split]) < max(1, HISTORY_SUMMARY_EVERY)
+            and _messages_tokens(messages[covered:]) <= verbatim_budget):
+        return covered, entry
+    return split, None
+
+async def compact_history(messages: List[ChatMessage], key: str, keep_turns: int = None,
+                          token_budget: int = None) -> List[ChatMessage]:
+    """
+    History to send to the LLM: at least the last `keep_turns` user turns
+    verbatim, preceded by one developer message summarizing everything
+    before them.
+
+    Verbatim turns are trimmed further (oldest first, never the latest
+    message) until they fit `token_budget` minus the summary's share. The
+    summary goes right after the static system prompt and is only
+    refreshed (one call on the async client) once `HISTORY_SUMMARY_EVERY`
+    older turns have piled up outside it, or they no longer fit the budget;
+    until then the stored summary is reused and those turns stay verbatim,
+    so the prompt prefix stays cacheable provider-side.
+    """
+    keep_turns = HISTORY_KEEP_TURNS if keep_turns is None else keep_turns
+    token_budget = HISTORY_TOKEN_BUDGET if token_budget is None else token_budget
+
+    # Token counting is CPU work, keep it off the event loop
+    split, entry = await asyncio.to_thread(plan_history, messages, key, keep_turns, token_budget)
+    if split == 0:
+        return list(messages)
+
+    summary = entry["summary"] if entry else await rolling_summary(key, list(messages[:split]))
+    recent = list(messages[split:])
+    if not summary:
+        return recent  # older turns are dropped rather than blowing the budget
+    return [ChatMessage(role="developer", content=f"Summary of the earlier conversation:\n{summary}")] + recent
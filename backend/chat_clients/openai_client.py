@@ -1,27 +1,29 @@
-from openai import OpenAI
-from typing import List
+from openai import AsyncOpenAI
+from typing import AsyncIterator, List
 
 from models.schema import ChatMessage
 
-client = OpenAI()
+async_client = AsyncOpenAI()
 
-def generate_openai_reply(
-    model: str,
+class ReplyStreamError(RuntimeError):
+    """A streamed reply that failed, was cut off, or ended before completing."""
+
+SYSTEM_PROMPT = "You are a helpful assistant that uses context retrieved from documents to answer accurately."
+
+def build_input_messages(
     message_history: List[ChatMessage],
     structured_context: str,
-) -> str:
+) -> List[dict]:
     """
-    Combines chat history + retrieved context and queries OpenAI.
-    Returns assistant's text reply.
+    Builds the Responses API input: instructions, chat history and the
+    retrieved context as the latest block.
     """
-
-    # Build OpenAI input: history + context
     input_messages = []
 
     # Add developer/system role for instruction consistency
     input_messages.append({
         "role": "developer",
-        "content": "You are a helpful assistant that uses context retrieved from documents to answer accurately.",
+        "content": SYSTEM_PROMPT,
     })
 
     # Append prior conversation
@@ -37,12 +39,64 @@ def generate_openai_reply(
         "content": f"Retrieved context:\n{structured_context}"
     })
 
-    # Call OpenAI Responses API
-    response = client.responses.create(
+    return input_messages
+
+async def agenerate_openai_reply(
+    model: str,
+    message_history: List[ChatMessage],
+    structured_context: str,
+) -> str:
+    """
+    Combines chat history + retrieved context and queries OpenAI on the
+    async client, so waiting on the provider doesn't hold a worker thread.
+    Returns assistant's text reply.
+    """
+    input_messages = build_input_messages(message_history, structured_context)
+
+    response = await async_client.responses.create(
         model=model,
         reasoning={"effort": "low"},
         input=input_messages,
     )
 
-    # Extract and return plain text
     return response.output_text
+
+async def stream_openai_reply(
+    model: str,
+    message_history: List[ChatMessage],
+    structured_context: str,
+) -> AsyncIterator[str]:
+    """
+    Same prompt as `agenerate_openai_reply`, but streams the reply.
+    Yields text deltas as soon as the provider emits them.
+
+    Raises `ReplyStreamError` if the response fails, is incomplete (e.g.
+    cut off by the output limit), or the stream ends without
+    `response.completed`, so a partial reply is never mistaken for a
+    whole one.
+    """
+    input_messages = build_input_messages(message_history, structured_context)
+
+    stream = await async_client.responses.create(
+        model=model,
+        reasoning={"effort": "low"},
+        input=input_messages,
+        stream=True,
+    )
+
+    completed = False
+    async for event in stream:
+        if event.type == "response.output_text.delta":
+            yield event.delta
+        elif event.type == "response.completed":
+            completed = True
+        elif event.type == "response.failed":
+            error = event.response.error
+            raise ReplyStreamError(f"Response failed: {error.message if error else 'unknown error'}")
+        elif event.type == "response.incomplete":
+            details = event.response.incomplete_details
+            raise ReplyStreamError(f"Response incomplete: {details.reason if details else 'unknown reason'}")
+        elif event.type == "error":
+            raise ReplyStreamError(f"Stream error: {event.message}")
+    if not completed:
+        raise ReplyStreamError("Stream ended before the response completed")
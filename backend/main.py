@@ -1,10 +1,13 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 
 from routers.editor_router import router as editor_router
 from routers.session_router import router as session_router 
 from routers.chat_router import router as chat_router
+from routers.job_router import router as job_router
+from routers.system_router import router as system_router
+from utils.metrics import metrics_exposition, start_request_timings, server_timing_header
 
 app = FastAPI(title="Optim-RAG Backend")
 
@@ -17,9 +20,28 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def add_server_timing(request: Request, call_next):
+    # Stages timed while handling the request (see utils.metrics.timed).
+    # Streaming responses send headers before their body runs, so only
+    # stages finished by then are reported.
+    timings = start_request_timings()
+    response = await call_next(request)
+    if timings:
+        response.headers["Server-Timing"] = server_timing_header(timings)
+    return response
+
 app.include_router(session_router, prefix="/api", tags=["Sessions"])
 app.include_router(editor_router, prefix="/api", tags=["Editing"])
 app.include_router(chat_router, prefix="/api", tags=["Chat"])
+app.include_router(job_router, prefix="/api", tags=["Jobs"])
+app.include_router(system_router, prefix="/api", tags=["System"])
+
+# Prometheus scrape endpoint (stage latency histograms), served at the exact path
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    body, content_type = metrics_exposition()
+    return Response(content=body, media_type=content_type)
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
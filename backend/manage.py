@@ -0,0 +1,113 @@
+import time
+import argparse
+import statistics
+
+
+def backfill_sessions(args):
+    from utils.session_registry import backfill_registry, registry_collection
+
+    count = backfill_registry()
+    print(f"Backfilled {count} sessions into {registry_collection}")
+
+
+def measure_filtered_latency(session_ids, repeat):
+    """Median latency (ms) of the filtered queries the app runs, over sample sessions."""
+    from qdrant_client import models
+    from utils.qdrant_setup import client, collection_name, session_filter
+
+    def timed(fn):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - start) * 1000)
+        return statistics.median(samples)
+
+    results = {"count by group_id": [], "scroll by group_id": [], "scroll by chunk_hash": []}
+    for sid in session_ids:
+        points, _ = client.scroll(collection_name=collection_name, scroll_filter=session_filter(sid),
+                                  limit=1, with_payload=["chunk_hash"])
+        chunk_hash = points[0].payload.get("chunk_hash") if points else ""
+        hash_filter = models.Filter(must=[
+            models.FieldCondition(key="chunk_hash", match=models.MatchValue(value=chunk_hash)),
+        ])
+
+        results["count by group_id"].append(timed(
+            lambda: client.count(collection_name=collection_name, count_filter=session_filter(sid), exact=True)))
+        results["scroll by group_id"].append(timed(
+            lambda: client.scroll(collection_name=collection_name, scroll_filter=session_filter(sid), limit=100)))
+        results["scroll by chunk_hash"].append(timed(
+            lambda: client.scroll(collection_name=collection_name, scroll_filter=hash_filter, limit=1)))
+
+    return {query: statistics.median(values) if values else None for query, values in results.items()}
+
+
+def wait_for_green(timeout):
+    from qdrant_client import models
+    from utils.qdrant_setup import client, collection_name
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if client.get_collection(collection_name=collection_name).status == models.CollectionStatus.GREEN:
+            return True
+        time.sleep(1)
+    return False
+
+
+def migrate_indexes(args):
+    from utils.qdrant_setup import client, collection_name, ensure_payload_indexes, TENANT_HNSW_CONFIG
+    from utils.session_registry import list_session_records
+    from qdrant_client import models
+
+    sessions = [r["session_id"] for r in list_session_records()][:args.samples]
+    print(f"Measuring filtered queries on {len(sessions)} sample sessions ({args.repeat} runs each)")
+    before = measure_filtered_latency(sessions, args.repeat)
+
+    created = ensure_payload_indexes()
+    print(f"Created payload indexes: {', '.join(created) if created else 'none (already present)'}")
+
+    if args.tenant_hnsw:
+        print("Switching dense vectors to per-tenant HNSW (payload_m=16, m=0)")
+        client.update_collection(
+            collection_name=collection_name,
+            vectors_config={"all-MiniLM-L6-v2": models.VectorParamsDiff(hnsw_config=TENANT_HNSW_CONFIG)},
+        )
+
+    if not wait_for_green(args.timeout):
+        print(f"Collection not green after {args.timeout}s; measurements may still improve")
+    after = measure_filtered_latency(sessions, args.repeat)
+
+    print(f"{'query':<24}{'before ms':>12}{'after ms':>12}")
+    for query in before:
+        b, a = before[query], after[query]
+        fmt = lambda v: f"{v:12.2f}" if v is not None else f"{'-':>12}"
+        print(f"{query:<24}{fmt(b)}{fmt(a)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Optim-RAG maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    backfill = commands.add_parser(
+        "backfill-sessions",
+        help="Rebuild the session registry from the chunks already stored in Qdrant",
+    )
+    backfill.set_defaults(func=backfill_sessions)
+
+    migrate = commands.add_parser(
+        "migrate-indexes",
+        help="Add the group_id/chunk_hash/filename payload indexes to an existing collection",
+    )
+    migrate.add_argument("--samples", type=int, default=5, help="sessions to time filtered queries on")
+    migrate.add_argument("--repeat", type=int, default=5, help="runs per query when timing")
+    migrate.add_argument("--timeout", type=int, default=600, help="seconds to wait for re-indexing")
+    migrate.add_argument("--tenant-hnsw", action="store_true",
+                         help="also switch dense vectors to per-tenant HNSW graphs (triggers re-indexing)")
+    migrate.set_defaults(func=migrate_indexes)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import List, Optional, Literal
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional, Literal, Union
 
 class Chunk(BaseModel):
     chunk_id: str
@@ -12,6 +12,7 @@ class Chunk(BaseModel):
     status: Literal["unchanged", "modified", "new", "deleted"] = "new"
     lastEdited: Optional[str] = None
     originalHash: Optional[str] = None
+    point_id: Optional[Union[int, str]] = None
 
 
 class ChunkUpdateRequest(BaseModel):
@@ -19,14 +20,33 @@ class ChunkUpdateRequest(BaseModel):
     session_name: str
     documents: List[Chunk]
 
+class ChunkPatchRequest(BaseModel):
+    session_name: Optional[str] = None
+    chunks: List[Chunk]
+
+class ChunkPatchResult(BaseModel):
+    chunk_id: str
+    chunk_hash: str
+    result: Literal["created", "updated", "deleted", "unchanged", "not_found"]
+    point_id: Optional[Union[int, str]] = None
+    detail: Optional[str] = None
+
+class ChunkPatchResponse(BaseModel):
+    session_id: str
+    upserted: int
+    deleted: int
+    results: List[ChunkPatchResult]
+
 class ChunkResponse(BaseModel):
     session_id: str
     session_name: str
     chunks: List[Chunk]
+    next_cursor: Optional[str] = None
 
 class StatusResponse(BaseModel):
     status: str
     message: str
+    job_id: Optional[str] = None
 
 class SessionMeta(BaseModel):
     id: str
@@ -34,6 +54,11 @@ class SessionMeta(BaseModel):
     sessionName: str
     archiveName: Optional[str] = None
     archiveSize: Optional[int] = None
+    updatedAt: Optional[str] = None
+    chunkCount: Optional[int] = None
+    byteSize: Optional[int] = None
+    jobId: Optional[str] = None
+    failedFiles: Optional[List[str]] = None
 
 class DeleteSessionResponse(BaseModel):
     status: str
@@ -41,6 +66,7 @@ class DeleteSessionResponse(BaseModel):
 
 ChatRole = Literal["developer", "user", "assistant"]
 ChatModel = Literal["ollama-local", "gpt-5"]
+RetrievalProfile = Literal["fast", "hybrid", "precise"]
 
 # Request/Response models
 class ChatMessage(BaseModel):
@@ -51,8 +77,77 @@ class SendChatRequest(BaseModel):
     session_id: str
     messages: List[ChatMessage]
     model: Optional[ChatModel] = "gpt-5"
+    conversation_id: Optional[str] = None
+    retrieval_profile: RetrievalProfile = "precise"
+    top_k: int = Field(10, ge=1, le=100)
+    prefetch_multiplier: int = Field(2, ge=1, le=20)
+    hnsw_ef: Optional[int] = Field(None, ge=1, le=4096)
+    context_token_budget: Optional[int] = Field(None, ge=256, le=128000)
+    use_answer_cache: bool = False
 
 class SendChatResponse(BaseModel):
     session_id: str
     reply: ChatMessage
-    messages: List[ChatMessage]
\ No newline at end of file
+    messages: List[ChatMessage]
+    latency_ms: Optional[float] = None
+    cached: bool = False
+
+class ChatSource(BaseModel):
+    filename: str
+    page_number: Optional[int] = None
+    chunk_id: Optional[str] = None
+    chunk_hash: Optional[str] = None
+    score: Optional[float] = None
+
+JobState = Literal["queued", "running", "succeeded", "failed", "cancelled"]
+
+class JobProgress(BaseModel):
+    files_total: int = 0
+    files_done: int = 0
+    files_skipped: int = 0
+    pages_ocr: int = 0
+    pages_text_layer: int = 0
+    chunks_embedded: int = 0
+    chunks_upserted: int = 0
+
+class FileFailure(BaseModel):
+    file: str
+    error: str
+
+class DocumentPageStats(BaseModel):
+    """How the pages of one PDF were extracted."""
+    file: str
+    pages: int = 0
+    text_layer: int = 0
+    cached: int = 0
+    ocr: int = 0
+    failed: int = 0
+
+class JobStatusResponse(BaseModel):
+    id: str
+    kind: str
+    session_id: str
+    status: JobState
+    progress: JobProgress
+    failures: List[FileFailure] = []
+    documents: List[DocumentPageStats] = []
+    error: Optional[str] = None
+    createdAt: str
+    startedAt: Optional[str] = None
+    finishedAt: Optional[str] = None
+
+class MemoryCacheStats(BaseModel):
+    size: int
+    maxsize: int
+    ttl: float
+    hits: int
+    misses: int
+    hit_rate: float
+
+class CacheStatsResponse(BaseModel):
+    query_embeddings: MemoryCacheStats
+    retrieval: MemoryCacheStats
+    history_summaries: MemoryCacheStats
+    answers: MemoryCacheStats
+    documents: Dict[str, Any]
+    embeddings: Dict[str, Any]
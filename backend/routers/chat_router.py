@@ -1,17 +1,83 @@
+import json
+import time
 from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
 from models.schema import (
     ChatMessage,
-    SendChatRequest, 
+    ChatSource,
+    SendChatRequest,
     SendChatResponse,
-) 
-from chat_clients.openai_client import generate_openai_reply
-from utils.qdrant_setup import retrieve_from_store
+)
+from chat_clients.openai_client import agenerate_openai_reply, stream_openai_reply
+from chat_clients.history import compact_history, conversation_key
+from utils.qdrant_setup import aretrieve_from_store, embed_query, session_version
+from utils.metrics import timed
+from utils.context_builder import build_context, CONTEXT_TOKEN_BUDGET
+from utils.answer_cache import answer_cache, history_key
 
 router = APIRouter()
 
+def last_user_message(messages):
+    return next((m for m in reversed(messages) if m.role == "user"), None)
+
+def build_structured_context(retrieved_chunks, token_budget=None):
+    """Token-budgeted context block; returns `(context_text, chunks_used)`."""
+    return build_context(retrieved_chunks, token_budget)
+
+async def retrieve_for_request(req: SendChatRequest):
+    last_user = last_user_message(req.messages)
+    if not last_user:
+        return []
+    return await aretrieve_from_store(
+        last_user.content,
+        req.session_id,
+        n_points=req.top_k,
+        profile=req.retrieval_profile,
+        prefetch_multiplier=req.prefetch_multiplier,
+        hnsw_ef=req.hnsw_ef,
+    )
+
+async def history_for_request(req: SendChatRequest):
+    """Message history to send to the LLM, with older turns folded into a summary."""
+    return await compact_history(req.messages, conversation_key(req.session_id, req.messages, req.conversation_id))
+
+def answer_cache_args(req: SendChatRequest, retrieved_chunks, version: int):
+    """Answer-cache lookup arguments, or None if the request did not opt in."""
+    if not req.use_answer_cache:
+        return None
+    question_idx = next((i for i in range(len(req.messages) - 1, -1, -1) if req.messages[i].role == "user"), None)
+    if question_idx is None:
+        return None
+    return {
+        "session_id": req.session_id,
+        "version": version,
+        "model": req.model or "gpt-5",
+        # The same question answered from a differently built context is a different answer
+        "profile": req.retrieval_profile,
+        "token_budget": req.context_token_budget or CONTEXT_TOKEN_BUDGET,
+        "history": history_key(req.messages[:question_idx]),
+        # Same (cached) MiniLM embedding retrieval used for the dense search
+        "question_vector": embed_query("all-MiniLM-L6-v2", req.messages[question_idx].content),
+        "chunk_hashes": [chunk.get("chunk_hash") for chunk in retrieved_chunks],
+    }
+
+def lookup_answer(cache_args):
+    if cache_args is None:
+        return None
+    with timed("chat", "answer_cache"):
+        return answer_cache.lookup(**cache_args)
+
+def store_answer(req: SendChatRequest, cache_args, reply_text: str):
+    if cache_args is not None and reply_text:
+        answer_cache.store(**cache_args, question=last_user_message(req.messages).content, reply=reply_text)
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @router.post("/chat/send", response_model=SendChatResponse)
-def send_chat(req: SendChatRequest):
+async def send_chat(req: SendChatRequest):
     """
     Execute a retrieval-augmented chat query for a given session.
 
@@ -22,16 +88,40 @@ def send_chat(req: SendChatRequest):
     Args:
         req: A `SendChatRequest` containing:
             - `session_id`: The target session to query.
-            - `query`: The user’s natural-language question or message.
-            - (Optional) `top_k`: Number of chunks to retrieve.
-            - (Optional) `history`: Prior chat context (if multi-turn chat).
+            - `messages`: The conversation so far; the last user message is the query.
+              The last `HISTORY_KEEP_TURNS` user turns are sent verbatim;
+              older messages are replaced by a rolling summary, refreshed
+              every `HISTORY_SUMMARY_EVERY` turns.
+            - (Optional) `conversation_id`: Stable id of the conversation, used
+              to cache its summary (default: derived from the first message).
+            - (Optional) `model`: The LLM to answer with.
+            - (Optional) `retrieval_profile`: Latency/quality trade-off for retrieval:
+                - `fast`: dense vector search only.
+                - `hybrid`: dense + BM25 candidates fused with RRF, no reranking.
+                - `precise` (default): dense + BM25 candidates reranked with ColBERT.
+            - (Optional) `top_k`: Number of chunks to retrieve (default 10).
+            - (Optional) `prefetch_multiplier`: Candidates fetched per retriever,
+              as a multiple of `top_k`, before fusion/reranking (default 2).
+            - (Optional) `hnsw_ef`: HNSW search breadth for the dense search;
+              higher is more accurate and slower (default: collection setting).
+            - (Optional) `context_token_budget`: Maximum tokens of retrieved
+              context sent to the LLM (default `CONTEXT_TOKEN_BUDGET`).
+              Consecutive chunks are merged and near-duplicates dropped
+              before the budget is filled by relevance.
+            - (Optional) `use_answer_cache`: Reuse the reply to a similar
+              earlier question in this session (same model, retrieval profile,
+              context budget and prior turns, same retrieved chunks) instead
+              of calling the LLM.
 
     Returns:
         A `SendChatResponse` containing:
             - `answer`: The LLM-generated response based on retrieved context.
             - `sources`: Metadata for the retrieved chunks (document, score, etc.).
             - `session_id`: The session ID used for the query.
-            - (Optional) `latency_ms`: Time taken to generate the response.
+            - `cached`: Whether the reply came from the answer cache.
+            - `latency_ms`: Time taken to generate the response. A per-stage
+              breakdown is returned in the `Server-Timing` header and exported
+              on `/metrics`.
 
     Typical use case:
         This route enables a conversational interface on top of the session’s
@@ -42,39 +132,139 @@ def send_chat(req: SendChatRequest):
         ```json
         {
           "session_id": "1234-5678",
-          "query": "Summarize the discussion on oxidative phosphorylation.",
+          "messages": [
+            {"role": "user", "content": "Summarize the discussion on oxidative phosphorylation."}
+          ],
+          "retrieval_profile": "hybrid",
           "top_k": 3
         }
         ```
     """
+    start = time.perf_counter()
     session_id = req.session_id
     model = req.model or "gpt-5"  # default to OpenAI
 
-    # Get last user message
-    last_user = next((m for m in reversed(req.messages) if m.role == "user"), None)
-    retrieved_chunks = retrieve_from_store(last_user.content, session_id) if last_user else []
-
-    # Build structured context
-    if retrieved_chunks:
-        context_lines = ["Context Retrieved:"]
-        for idx, chunk in enumerate(retrieved_chunks, start=1):
-            filename = chunk.get("filename", "Unknown File")
-            page_num = chunk.get("page_number", "N/A")
-            content = chunk.get("page_content", "").strip()
-            if len(content) > 800:
-                content = content[:800] + "..."
-            context_lines.append(f"[{idx}] File: {filename} (Page {page_num})\n{content}\n")
-        structured_context = "\n".join(context_lines)
-    else:
-        structured_context = "(No relevant context found.)"
+    # Retrieve context for the last user message
+    version = session_version(session_id)
+    retrieved_chunks = await retrieve_for_request(req)
+
+    # Reuse an earlier answer when the caller opted in and nothing changed
+    cache_args = await run_in_threadpool(answer_cache_args, req, retrieved_chunks, version)
+    cached_reply = lookup_answer(cache_args)
+    if cached_reply is not None:
+        return SendChatResponse(
+            session_id=session_id,
+            reply=ChatMessage(role="assistant", content=cached_reply),
+            messages=req.messages,
+            latency_ms=(time.perf_counter() - start) * 1000,
+            cached=True,
+        )
+
+    # Build structured context (tokenizing is CPU work, keep it off the event loop)
+    with timed("chat", "context"):
+        structured_context, _ = await run_in_threadpool(
+            build_structured_context, retrieved_chunks, req.context_token_budget,
+        )
+
+    # Recent turns verbatim, older ones summarized
+    history = await history_for_request(req)
 
     # Generate OpenAI reply using message history + context
-    ai_reply_text = generate_openai_reply(model, req.messages, structured_context)
+    with timed("chat", "llm"):
+        ai_reply_text = await agenerate_openai_reply(model, history, structured_context)
 
     reply = ChatMessage(role="assistant", content=ai_reply_text)
+    store_answer(req, cache_args, ai_reply_text)
 
     return SendChatResponse(
         session_id=session_id,
         reply=reply,
-        messages=req.messages
-    )
\ No newline at end of file
+        messages=req.messages,
+        latency_ms=(time.perf_counter() - start) * 1000,
+    )
+
+@router.post("/chat/stream")
+async def stream_chat(req: SendChatRequest):
+    """
+    Streaming variant of `/chat/send` using Server-Sent Events.
+
+    Takes the same `SendChatRequest` body and emits, in order:
+        - `context`: sources of the chunks packed into the LLM context, sent
+          before generation starts.
+        - `token`: one event per text delta from the LLM (`{"delta": "..."}`);
+          a reply served from the answer cache arrives as a single token.
+        - `done`: the complete `SendChatResponse`, identical to `/chat/send`
+          (`latency_ms` covers the whole stream).
+        - `error`: sent instead of `done` if any step fails (retrieval,
+          context building or generation), possibly after `context`. A reply
+          the model failed or did not complete also ends in `error`, and is
+          never stored in the answer cache.
+
+    The LLM call goes through the async OpenAI client, so a single worker
+    can hold many open streams while waiting on the provider.
+    """
+    session_id = req.session_id
+    model = req.model or "gpt-5"  # default to OpenAI
+
+    async def event_stream():
+        start = time.perf_counter()
+        reply_parts = []
+        try:
+            version = session_version(session_id)
+            retrieved_chunks = await retrieve_for_request(req)
+            cache_args = await run_in_threadpool(answer_cache_args, req, retrieved_chunks, version)
+            cached_reply = lookup_answer(cache_args)
+
+            with timed("chat", "context"):
+                structured_context, used_chunks = await run_in_threadpool(
+                    build_structured_context, retrieved_chunks, req.context_token_budget,
+                )
+
+            sources = [
+                ChatSource(
+                    filename=chunk.get("filename", "Unknown File"),
+                    page_number=chunk.get("page_number"),
+                    chunk_id=chunk.get("chunk_id"),
+                    chunk_hash=chunk.get("chunk_hash"),
+                    score=chunk.get("score"),
+                ).model_dump()
+                for chunk in used_chunks
+            ]
+            yield sse_event("context", {"session_id": session_id, "sources": sources})
+
+            if cached_reply is not None:
+                yield sse_event("token", {"delta": cached_reply})
+                response = SendChatResponse(
+                    session_id=session_id,
+                    reply=ChatMessage(role="assistant", content=cached_reply),
+                    messages=req.messages,
+                    latency_ms=(time.perf_counter() - start) * 1000,
+                    cached=True,
+                )
+                yield sse_event("done", response.model_dump())
+                return
+
+            history = await history_for_request(req)
+            with timed("chat", "llm"):
+                async for delta in stream_openai_reply(model, history, structured_context):
+                    reply_parts.append(delta)
+                    yield sse_event("token", {"delta": delta})
+
+            reply = ChatMessage(role="assistant", content="".join(reply_parts))
+            store_answer(req, cache_args, reply.content)
+            response = SendChatResponse(
+                session_id=session_id,
+                reply=reply,
+                messages=req.messages,
+                latency_ms=(time.perf_counter() - start) * 1000,
+            )
+            yield sse_event("done", response.model_dump())
+        except Exception as e:
+            print(f"[CHAT STREAM] Request failed for session {session_id}: {e}")
+            yield sse_event("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,19 +1,36 @@
 import os
-import shutil
+import json
+import uuid
+import base64
+from functools import partial
 from dotenv import load_dotenv
 
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from qdrant_client import models
-from typing import List
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
 
-from models.schema import ChunkUpdateRequest, ChunkResponse, StatusResponse
-from utils.chunking import process_chunks, categorize_files
+from models.schema import (
+    ChunkPatchRequest,
+    ChunkPatchResponse,
+    ChunkResponse,
+    ChunkUpdateRequest,
+    StatusResponse,
+)
+from utils.chunking import categorize_files
+from utils.pipeline import ingest_pipeline
+from utils.jobs import job_manager, JobQueueFull
 from utils.qdrant_setup import (
+    apply_chunk_delta,
     client,
     collection_name,
+    iter_points,
     rag_pipeline_setup,
-    session_exists
+    session_filter,
+    SCROLL_PAGE_SIZE,
 )
+from utils.session_registry import apply_ingest_delta, get_session_record, session_exists
+from utils.uploads import UploadRejected, discard_dir, save_upload, upload_error
 
 load_dotenv()
 
@@ -21,32 +38,90 @@ router = APIRouter()
 
 DATA_FOLDER = os.getenv("DATA_FOLDER", "../data-source/")
 
+def encode_cursor(offset) -> Optional[str]:
+    if offset is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(offset).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: Optional[str]):
+    if not cursor:
+        return None
+    try:
+        offset = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        # Qdrant point ids: unsigned ints or uuid strings
+        if isinstance(offset, str):
+            uuid.UUID(offset)
+        elif not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+            raise ValueError(offset)
+        return offset
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @router.get("/chunks/{session_id}", response_model=ChunkResponse)
-def get_chunks(session_id: str):
+def get_chunks(
+    session_id: str,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+):
     """
     Retrieve all document chunks for a specific session.
 
     This endpoint returns the full list of stored text chunks (and their metadata)
     belonging to the provided `session_id`. Useful for debugging or inspecting
     what content was indexed for retrieval.
+
+    Pass `limit` to page through large sessions instead: the response then
+    holds at most `limit` chunks and a `next_cursor` to send back as `cursor`
+    for the following page (`null` on the last page).
+
+    Each chunk carries its `point_id`, which `PATCH /chunks/{session_id}`
+    uses to address it directly.
     """
     if not session_exists(session_id):
         raise HTTPException(status_code=404, detail="Session not found")
 
-    results, _ = client.scroll(
-        collection_name=collection_name,
-        scroll_filter=models.Filter(
-            must=[models.FieldCondition(
-                key="group_id",
-                match=models.MatchValue(value=session_id)
-            )]
-        ),
-        limit=10_000,
-        with_payload=True,
+    if limit is None and cursor is None:
+        points = list(iter_points(session_filter(session_id)))
+        next_offset = None
+    else:
+        points, next_offset = client.scroll(
+            collection_name=collection_name,
+            scroll_filter=session_filter(session_id),
+            limit=limit or SCROLL_PAGE_SIZE,
+            offset=decode_cursor(cursor),
+            with_payload=True,
+        )
+
+    chunks = [{**point.payload, "point_id": point.id} for point in points]
+    session_name = points[0].payload.get("session_name") if points else ""
+    return ChunkResponse(
+        session_id=session_id,
+        session_name=session_name,
+        chunks=chunks,
+        next_cursor=encode_cursor(next_offset),
     )
 
-    chunks = [point.payload for point in results]
-    return ChunkResponse(session_id=session_id, session_name=results[0].payload.get("session_name"), chunks=chunks)
+@router.get("/chunks/{session_id}/export")
+def export_chunks(session_id: str):
+    """
+    Stream every chunk of a session as newline-delimited JSON.
+
+    One chunk payload (with its `point_id`) per line. The session is paged through the vector store
+    (Qdrant) as the response is written, so memory use does not grow with
+    session size.
+    """
+    if not session_exists(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    def ndjson_lines():
+        for point in iter_points(session_filter(session_id)):
+            yield json.dumps({**point.payload, "point_id": point.id}) + "\n"
+
+    return StreamingResponse(
+        ndjson_lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{session_id}.ndjson"'},
+    )
 
 
 @router.post("/chunks/update", response_model=StatusResponse)
@@ -62,38 +137,131 @@ def update_chunks(request: ChunkUpdateRequest):
     for an existing session.
     """
     chunks_dict = [chunk.model_dump() for chunk in request.documents]
-    rag_pipeline_setup(request.session_id, request.session_name, chunks_dict)
+    summary = rag_pipeline_setup(request.session_id, request.session_name, chunks_dict)
+    apply_ingest_delta(request.session_id, request.session_name, summary)
     return StatusResponse(status="success", message="chunks updated")
 
 
+@router.patch("/chunks/{session_id}", response_model=ChunkPatchResponse)
+def patch_chunks(session_id: str, request: ChunkPatchRequest):
+    """
+    Apply only the chunks that changed in a session.
+
+    Send just the edited (`status="modified"`), added (`"new"`) and removed
+    (`"deleted"`) chunks. Edits and deletions are matched to their stored
+    points by `point_id` (as returned by `GET /chunks/{session_id}`), or by
+    their hash (`originalHash`, else `previous_hash` / `chunk_hash`) when no
+    `point_id` is given, so the cost of a request follows the size of the
+    edit rather than of the session. Only new and modified chunks are
+    embedded.
+
+    Returns one result per chunk: `created`, `updated`, `deleted`,
+    `unchanged`, or `not_found` if it matches no chunk of this session.
+    """
+    record = get_session_record(session_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    session_name = request.session_name or record.get("session_name")
+    chunks = [chunk.model_dump() for chunk in request.chunks]
+    summary, results = apply_chunk_delta(session_id, session_name, chunks)
+    apply_ingest_delta(session_id, session_name, summary)
+    return ChunkPatchResponse(
+        session_id=session_id,
+        upserted=summary["upserted"],
+        deleted=summary["deleted"],
+        results=results,
+    )
+
+
+def ingest_files(session_id: str, session_name: str, saved_files: List[str], upload_dir: Optional[str] = None,
+                 incremental: bool = False):
+    """
+    Chunk and embed already-saved files into an existing session through the
+    staged ingestion pipeline (`utils.pipeline`). Each file is deleted once
+    chunked, and `upload_dir` when ingestion ends.
+
+    With `incremental`, files unchanged since they were last ingested are
+    skipped and changed ones only re-embed their new or changed chunks.
+    If ingestion fails or is cancelled, the chunks it already stored are
+    removed, so the session registry still matches the collection.
+    Returns the names of the files that failed and of those skipped.
+    """
+    print(f"[UPLOAD] Processing files for session: {session_id}")
+    failures = []
+    try:
+        categorized = categorize_files(saved_files)
+        summary = ingest_pipeline(
+            session_id, session_name, categorized, failures=failures, cleanup=True, incremental=incremental,
+        )
+    finally:
+        if upload_dir:
+            discard_dir(upload_dir)
+    apply_ingest_delta(session_id, session_name, summary)
+    print(f"[UPLOAD] Session {session_id}: {summary['upserted']} chunks stored, {summary['deleted']} removed, "
+          f"{len(summary['skipped_files'])} unchanged files skipped")
+    return [f["file"] for f in failures], summary["skipped_files"]
+
 @router.post("/files/upload", response_model=StatusResponse)
 async def upload_files(
     session_id: str = Form(...),
     session_name: str = Form(...),
-    files: List[UploadFile] = File(...)
+    files: List[UploadFile] = File(...),
+    background: bool = Form(False),
+    incremental: bool = Form(False),
 ):
     """
     Upload and process new files for a session.
 
     The files are automatically chunked and embedded into the vector store (Qdrant).
     This replaces or extends existing session data depending on configuration.
+
+    With `background=true` the files are saved and queued as an ingestion
+    job; the returned `job_id` can be polled on `/jobs/{job_id}`.
+
+    With `incremental=true`, re-uploading files already in the session
+    updates them in place: a file whose content hash matches the one
+    recorded at its last ingestion is skipped, and for a changed file only
+    new or changed chunks are embedded while chunks no longer produced are
+    deleted. Otherwise every uploaded chunk is appended.
+
+    Files are streamed to disk in blocks; one over `UPLOAD_MAX_BYTES` fails
+    the request with 413.
     """
     if not files:
         raise HTTPException(status_code=400, detail="No files uploaded")
 
-    os.makedirs(DATA_FOLDER, exist_ok=True)
+    # Each request gets its own directory, so concurrent uploads of the same file name don't collide
+    upload_dir = os.path.join(DATA_FOLDER, "uploads", uuid.uuid4().hex)
 
-    saved_files = []
-    for file in files:
-        file_path = os.path.join(DATA_FOLDER, file.filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        saved_files.append(file_path)
+    # Blocking file I/O and ingestion run in worker threads, off the event loop
+    def save_files():
+        return [save_upload(file, upload_dir) for file in files]
+    try:
+        saved_files = await run_in_threadpool(save_files)
+    except UploadRejected as e:
+        discard_dir(upload_dir)
+        raise HTTPException(status_code=upload_error(e), detail=str(e))
 
-    print(f"[UPLOAD] Processing files for session: {session_id}")
-    categorized = categorize_files(saved_files)
-    output = process_chunks(categorized, chunk_size=None)
-    rag_pipeline_setup(session_id, session_name, output, True)
-    print(f"[UPLOAD] Session {session_id}: {len(output)} chunks stored")
+    if background:
+        try:
+            job = job_manager.submit(
+                "upload_files", session_id, ingest_files, session_id, session_name, saved_files, upload_dir,
+                incremental, cleanup=partial(discard_dir, upload_dir),
+            )
+        except JobQueueFull as e:
+            discard_dir(upload_dir)
+            raise HTTPException(status_code=503, detail=str(e))
+        return StatusResponse(status="queued", message="Files queued for processing", job_id=job.id)
+
+    failed_files, skipped_files = await run_in_threadpool(
+        ingest_files, session_id, session_name, saved_files, upload_dir, incremental,
+    )
+    message = "Files added"
+    if skipped_files:
+        message += f", unchanged: {', '.join(skipped_files)}"
+    if failed_files:
+        names = ", ".join(os.path.basename(f) for f in failed_files)
+        return StatusResponse(status="partial", message=f"{message}, failed to process: {names}")
 
-    return StatusResponse(status="success", message="Files added")
+    return StatusResponse(status="success", message=message)
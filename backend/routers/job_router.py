@@ -0,0 +1,52 @@
+from fastapi import APIRouter, HTTPException
+from typing import List, Optional
+
+from models.schema import JobStatusResponse
+from utils.jobs import job_manager
+
+router = APIRouter()
+
+@router.get("/jobs", response_model=List[JobStatusResponse])
+def list_jobs(session_id: Optional[str] = None):
+    """
+    List known ingestion jobs, optionally restricted to one session.
+
+    Finished jobs are kept for a bounded history (`INGEST_JOB_HISTORY`)
+    before being forgotten.
+    """
+    return [JobStatusResponse(**job.snapshot()) for job in job_manager.list(session_id)]
+
+@router.get("/jobs/{job_id}", response_model=JobStatusResponse)
+def get_job(job_id: str):
+    """
+    Retrieve status and progress of a background ingestion job.
+
+    Progress counters cover files processed, pages sent through OCR or read
+    from the PDF's own text layer, chunks embedded and chunks upserted into
+    the vector store (Qdrant). `documents` breaks pages down per PDF.
+
+    Raises:
+        HTTPException(404): If the job id is unknown.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JobStatusResponse(**job.snapshot())
+
+@router.delete("/jobs/{job_id}", response_model=JobStatusResponse)
+def cancel_job(job_id: str):
+    """
+    Request cancellation of a queued or running ingestion job.
+
+    Queued jobs never start. Running jobs stop at the next file or upsert
+    batch boundary; for a new session the partially stored chunks are
+    removed, for uploads into an existing session batches already written
+    are kept.
+
+    Raises:
+        HTTPException(404): If the job id is unknown.
+    """
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JobStatusResponse(**job.snapshot())
@@ -1,22 +1,33 @@
 import os
 import uuid
-import shutil
-import zipfile
+from functools import partial
 from datetime import datetime
 import datetime as dt
 from dotenv import load_dotenv
 
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from typing import List, Optional, Dict
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
 
 from models.schema import SessionMeta, DeleteSessionResponse
-from utils.chunking import process_chunks, categorize_files
-from utils.qdrant_setup import (
-    client,
-    collection_name,
-    rag_pipeline_setup,
+from utils.chunking import categorize_files
+from utils.pipeline import ingest_pipeline
+from utils.jobs import job_manager, JobQueueFull
+from utils.qdrant_setup import remove_data_from_store
+from utils.session_registry import (
+    delete_session_record,
+    get_session_record,
+    list_session_records,
+    register_session,
     session_exists,
-    remove_data_from_store
+)
+from utils.uploads import (
+    UploadRejected,
+    discard_dir,
+    discard_file,
+    extract_archive,
+    save_upload,
+    upload_error,
 )
 
 load_dotenv()
@@ -25,6 +36,18 @@ router = APIRouter()
 
 DATA_FOLDER = os.getenv("DATA_FOLDER", "../data-source/")
 
+def session_meta(record: dict) -> SessionMeta:
+    return SessionMeta(
+        id=record["session_id"],
+        createdAt=record.get("createdAt"),
+        sessionName=record.get("session_name") or "",
+        archiveName=record.get("archiveName"),
+        archiveSize=record.get("archiveSize"),
+        updatedAt=record.get("updatedAt"),
+        chunkCount=record.get("chunk_count"),
+        byteSize=record.get("byte_size"),
+    )
+
 @router.get("/sessions", response_model=List[SessionMeta])
 def list_sessions():
     """
@@ -37,31 +60,59 @@ def list_sessions():
         A list of `SessionMeta` objects containing ID, name, creation timestamp,
         and basic archive information for each session found.
     """
-    results, _ = client.scroll(
-        collection_name=collection_name,
-        limit=10_000,
-        with_payload=True,
-    )
+    return [session_meta(record) for record in list_session_records()]
 
-    # Collect unique sessions
-    sessions: Dict[str, SessionMeta] = {}
-    for point in results:
-        payload = point.payload or {}
-        sid = payload.get("group_id")
-        if sid and sid not in sessions:
-            sessions[sid] = SessionMeta(
-                id=sid,
-                createdAt=payload.get("createdAt", datetime.utcnow().isoformat()),
-                sessionName=payload.get("session_name"),
-                archiveName=payload.get("archiveName"),
-                archiveSize=payload.get("archiveSize"),
-            )
-    return list(sessions.values())
+def ingest_archive(session_id: str, session_name: str, archive_path: str, session_dir: str,
+                   archive_size: Optional[int] = None, created_at: Optional[str] = None):
+    """
+    Extract (if ZIP), chunk and embed an uploaded archive into a session.
+    The session is registered only once its chunks are stored.
+
+    ZIPs are extracted member by member within the `ARCHIVE_MAX_*` limits
+    and deleted once extracted. Files then go through the staged ingestion
+    pipeline (`utils.pipeline`); each is deleted as soon as it has been
+    chunked, and the session's upload directory once ingestion ends. If
+    ingestion fails or is cancelled, any chunks already stored are removed.
+    """
+    failures = []
+    registered = False
+    try:
+        # If ZIP → extract
+        if archive_path.lower().endswith(".zip"):
+            extracted_files = extract_archive(archive_path, os.path.join(session_dir, "files"))
+            discard_file(archive_path)
+        else:
+            # Treat as single doc
+            extracted_files = [archive_path]
+
+        # Categorize & chunk
+        categorized = categorize_files(extracted_files)
+        summary = ingest_pipeline(session_id, session_name, categorized, failures=failures, cleanup=True)
+
+        register_session(
+            session_id,
+            session_name,
+            archive_name=os.path.basename(archive_path),
+            archive_size=archive_size,
+            created_at=created_at,
+            chunk_count=summary["chunks_delta"],
+            byte_size=summary["bytes_delta"],
+            files=summary["files"],
+        )
+        registered = True
+    finally:
+        if not registered:
+            # Cancelled or failed: don't leave a half-built session's chunks behind
+            remove_data_from_store(session_id)
+        discard_dir(session_dir)
+
+    return [f["file"] for f in failures]
 
 @router.post("/sessions", response_model=SessionMeta)
 async def create_session(
     archive: UploadFile = File(...),
     session_name: str = Form(...),
+    background: bool = Form(False),
 ):
     """
     Create and process a new session from an uploaded document archive.
@@ -70,9 +121,18 @@ async def create_session(
     standalone document. Files are extracted, categorized, chunked, and stored
     in the Qdrant vector database as embeddings.
 
+    With `background=true` the archive is only saved here; processing runs as
+    an ingestion job and the response carries its `jobId`, which can be
+    polled on `/jobs/{job_id}`.
+
+    Uploads over `UPLOAD_MAX_BYTES`, and ZIPs over `ARCHIVE_MAX_MEMBERS` files
+    or `ARCHIVE_MAX_UNCOMPRESSED_BYTES` extracted, are rejected with 413;
+    invalid ZIPs or members with unsafe paths with 400.
+
     Args:
         archive: The uploaded document archive (ZIP or single file).
         session_name: human-readable name for the session.
+        background: Queue processing as a job instead of waiting for it.
 
     Returns:
         A `SessionMeta` object describing the created session, including
@@ -84,41 +144,44 @@ async def create_session(
 
     # Make session-specific temp dir
     session_dir = os.path.join(DATA_FOLDER, session_id)
-    os.makedirs(session_dir, exist_ok=True)
-
-    archive_path = os.path.join(session_dir, archive.filename)
-
-    # Save uploaded archive
-    with open(archive_path, "wb") as buffer:
-        shutil.copyfileobj(archive.file, buffer)
-
-    extracted_files = []
-
-    # If ZIP → extract
-    if archive.filename.lower().endswith(".zip"):
-        with zipfile.ZipFile(archive_path, "r") as zip_ref:
-            zip_ref.extractall(session_dir)
-            extracted_files = [
-                os.path.join(session_dir, f)
-                for f in zip_ref.namelist()
-                if not f.endswith("/")  # skip dirs
-            ]
-    else:
-        # Treat as single doc
-        extracted_files = [archive_path]
-
-    # Categorize & chunk
-    categorized = categorize_files(extracted_files)
-    output = process_chunks(categorized, chunk_size=None)
-    rag_pipeline_setup(session_id, session_name, output, True)
-
-    # Compose session meta
+
+    # Stream the upload to disk in blocks (blocking file I/O stays off the event loop)
+    try:
+        archive_path = await run_in_threadpool(save_upload, archive, session_dir)
+    except UploadRejected as e:
+        discard_dir(session_dir)
+        raise HTTPException(status_code=upload_error(e), detail=str(e))
+
+    if not background:
+        try:
+            failed_files = await run_in_threadpool(
+                ingest_archive,
+                session_id, session_name, archive_path, session_dir, archive.size, createdAt.isoformat(),
+            ) or None
+        except UploadRejected as e:
+            raise HTTPException(status_code=upload_error(e), detail=str(e))
+        meta = session_meta(await run_in_threadpool(get_session_record, session_id))
+        meta.failedFiles = failed_files
+        return meta
+
+    try:
+        job = job_manager.submit(
+            "create_session", session_id, ingest_archive,
+            session_id, session_name, archive_path, session_dir, archive.size, createdAt.isoformat(),
+            cleanup=partial(discard_dir, session_dir),
+        )
+    except JobQueueFull as e:
+        discard_dir(session_dir)
+        raise HTTPException(status_code=503, detail=str(e))
+
+    # Not registered until the job finishes; describe the queued session
     return SessionMeta(
         id=session_id,
-        createdAt=str(createdAt),
+        createdAt=createdAt.isoformat(),
         sessionName=session_name,
-        archiveName=archive.filename,
+        archiveName=os.path.basename(archive_path),
         archiveSize=archive.size,
+        jobId=job.id,
     )
 
 @router.get("/session/{session_id}", response_model=SessionMeta)
@@ -126,9 +189,8 @@ def get_session(session_id: str):
     """
     Retrieve metadata for a specific session.
 
-    Returns minimal session metadata such as ID and creation time. This
-    endpoint can be extended to include additional metadata (like document
-    count or vector stats) as needed.
+    Returns the session's registry record: name, creation and last update
+    time, archive information, chunk count and stored content size.
 
     Args:
         session_id: Unique identifier of the target session.
@@ -139,14 +201,11 @@ def get_session(session_id: str):
     Returns:
         A `SessionMeta` object describing the session.
     """
-    if not session_exists(session_id):
+    record = get_session_record(session_id)
+    if record is None:
         raise HTTPException(status_code=404, detail="Session not found")
 
-    # Just return minimal meta — could expand if needed
-    return SessionMeta(
-        id=session_id,
-        createdAt=datetime.utcnow().isoformat(),
-    )
+    return session_meta(record)
 
 @router.delete("/session/{session_id}", response_model=DeleteSessionResponse)
 def delete_session(session_id: str):
@@ -169,6 +228,7 @@ def delete_session(session_id: str):
         raise HTTPException(status_code=404, detail="Session not found")
 
     remove_data_from_store(session_id)
+    delete_session_record(session_id)
     return DeleteSessionResponse(
         status="success",
         message=f"Session {session_id} deleted"
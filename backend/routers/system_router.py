@@ -0,0 +1,31 @@
+from fastapi import APIRouter
+
+from models.schema import CacheStatsResponse
+from utils.qdrant_setup import query_embedding_cache, retrieval_cache
+from chat_clients.history import summary_cache
+from utils.answer_cache import answer_cache
+from utils.embedding_cache import embedding_cache
+from utils.disk_cache import doc_cache
+
+router = APIRouter()
+
+@router.get("/cache/stats", response_model=CacheStatsResponse)
+def cache_stats():
+    """
+    Report size and hit rates of the backend's caches.
+
+    `query_embeddings`, `retrieval`, `history_summaries` and `answers` are
+    in-process caches (sized with `QUERY_EMBEDDING_CACHE_SIZE`,
+    `RETRIEVAL_CACHE_SIZE`, `HISTORY_SUMMARY_CACHE_SIZE` and
+    `ANSWER_CACHE_SIZE`);
+    `documents` and `embeddings` are the on-disk OCR/conversion and chunk
+    embedding caches. Counters are per process and reset on restart.
+    """
+    return CacheStatsResponse(
+        query_embeddings=query_embedding_cache.stats(),
+        retrieval=retrieval_cache.stats(),
+        history_summaries=summary_cache.stats(),
+        answers=answer_cache.stats(),
+        documents=doc_cache.stats(),
+        embeddings=embedding_cache.stats(),
+    )
@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict, defaultdict
+import numpy as np
+from dotenv import load_dotenv
+
+from utils.disk_cache import content_hash
+
+load_dotenv()
+
+# Minimum cosine similarity between MiniLM question embeddings for a hit
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "2048"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600)))
+
+
+def history_key(messages) -> str:
+    """Hash of the turns before the question; answers are only reused within the same context."""
+    return content_hash(json.dumps([[m.role, m.content] for m in messages]).encode("utf-8"))
+
+
+class AnswerCache:
+    """
+    Previously generated replies per session, matched by question similarity.
+
+    A cached reply is returned only when the new question is close enough
+    to a cached one, was asked after the same prior turns with the same
+    model, retrieval profile and context token budget, and retrieval
+    returned exactly the same chunks (by chunk hash).
+    Entries are tied to the session version (`qdrant_setup.session_version`),
+    so any write to the session invalidates them. LRU with a size cap and TTL.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, threshold: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # entry id -> entry
+        self._by_session = defaultdict(set)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id, None)
+        if entry is not None:
+            ids = self._by_session[entry["session_id"]]
+            ids.discard(entry_id)
+            if not ids:
+                del self._by_session[entry["session_id"]]
+
+    def lookup(self, session_id: str, version: int, model: str, profile: str, token_budget: int, history: str,
+               question_vector, chunk_hashes):
+        """
+        Cached reply for this question, or None: the most similar entry
+        above the threshold whose chunks match, so a closer entry built
+        from other chunks doesn't hide a valid one.
+        """
+        question_vector = self._normalize(question_vector)
+        chunk_hashes = frozenset(chunk_hashes)
+        now = time.monotonic()
+        with self._lock:
+            candidates = []
+            for entry_id in list(self._by_session.get(session_id, ())):
+                entry = self._entries[entry_id]
+                if entry["version"] != version or entry["expires_at"] < now:
+                    self._remove(entry_id)  # session changed since, or expired
+                    continue
+                if (entry["model"], entry["profile"], entry["token_budget"], entry["history"]) != (
+                        model, profile, token_budget, history):
+                    continue
+                similarity = float(np.dot(entry["vector"], question_vector))
+                if similarity >= self.threshold:
+                    candidates.append((similarity, entry_id))
+
+            for _, entry_id in sorted(candidates, reverse=True):
+                entry = self._entries[entry_id]
+                if entry["chunk_hashes"] == chunk_hashes:
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    return entry["reply"]
+            self.misses += 1
+            return None
+
+    def store(self, session_id: str, version: int, model: str, profile: str, token_budget: int, history: str,
+              question: str, question_vector, chunk_hashes, reply: str):
+        if self.maxsize <= 0:
+            return
+        entry_id = content_hash(
+            f"{session_id}\n{model}\n{profile}\n{token_budget}\n{history}\n{question.strip().lower()}".encode("utf-8")
+        )
+        with self._lock:
+            self._remove(entry_id)
+            self._entries[entry_id] = {
+                "id": entry_id,
+                "session_id": session_id,
+                "version": version,
+                "model": model,
+                "profile": profile,
+                "token_budget": token_budget,
+                "history": history,
+                "vector": self._normalize(question_vector),
+                "chunk_hashes": frozenset(chunk_hashes),
+                "reply": reply,
+                "expires_at": time.monotonic() + self.ttl,
+            }
+            self._by_session[session_id].add(entry_id)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+answer_cache = AnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_THRESHOLD)
@@ -1,12 +1,31 @@
 import os
 import platform
-import subprocess
 import hashlib
 from pathlib import Path
 from docx2pdf import convert
 from typing import Union, List, Dict
+from dotenv import load_dotenv
 
 from utils.pdf_ocr import extract_text_from_pdf
+from utils.disk_cache import doc_cache, file_hash
+from utils.libreoffice_pool import libreoffice_pool
+from utils.jobs import report_failure
+from utils.metrics import timed
+from utils.text_splitter import (
+    CHUNK_OVERLAP,
+    CHUNK_SIZE,
+    CHUNK_STRUCTURE,
+    CHUNK_UNIT,
+    file_lines,
+    page_lines,
+    split_delimited,
+    split_text,
+)
+
+load_dotenv()
+
+# Files chunked concurrently (threads of the ingest pipeline's extract stage)
+CHUNK_WORKERS = int(os.getenv("CHUNK_WORKERS", "4"))
 
 # ---------------------- HASH GENERATION ----------------------
 def generate_chunk_hash(filename, filetype, chunk_id, content):
@@ -24,211 +43,114 @@ def build_chunk_metadata(filename, filetype, chunk_id, page_number, content, pre
         "previous_chunk_hash": previous_hash,
     }
 
-# ---------------------- DOCX CHUNKER ----------------------
-def chunk_docx(file_path, chunk_size=None, buffer=8):
-    file_path = Path(file_path)
-    filename = file_path.stem
-    filetype = "docx"
-    temp_pdf_path = file_path.with_suffix(".pdf")
-    system = platform.system()
-
-    if system == 'Windows':
-        # Convert DOCX → PDF
-        convert(str(file_path), str(temp_pdf_path))
-    else:
-        # Ensure LibreOffice is installed in the system
-        temp_dir_path = '../data-source'
-
-        subprocess.run([
-            "libreoffice",
-            "--headless",
-            "--convert-to", "pdf",
-            str(file_path),
-            "--outdir", str(temp_dir_path)
-        ], check=True)
-        temp_pdf_path = Path(f"{temp_dir_path}/{filename}.pdf")
-
-    print(f"[DOCX CHUNKER] Converted {file_path} → {temp_pdf_path}")
-
-
-    with open(temp_pdf_path, "rb") as f:
-        file_bytes = f.read()
-
-    chunks = []
-    chunk_id = 1
-    previous_hash = None
-
-    if chunk_size:
-        print(f"[DOCX CHUNKER] Splitting by {chunk_size} words with {buffer} word overlap")
-        pages = extract_text_from_pdf(file_bytes)
-        full_text = " ".join(pages)
-
-        words = full_text.split()
-        total_words = len(words)
-
-        for i in range(0, total_words, chunk_size):
-            start = i
-            end = min(i + chunk_size + buffer, total_words)
-            chunk_words = words[start:end]
-            chunk_data = " ".join(chunk_words)
-
-            page_number = (i // chunk_size) + 1
-            metadata = build_chunk_metadata(filename, filetype, chunk_id, page_number, chunk_data, previous_hash)
-            chunks.append(metadata)
-            chunk_id += 1
-    else:
-        print(f"[DOCX CHUNKER] Splitting by real PDF pages (OCR extraction)")
-        pages = extract_text_from_pdf(file_bytes)
-
-        for idx, page in enumerate(pages):
-            page_number = idx + 1
-            metadata = build_chunk_metadata(filename, filetype, chunk_id, page_number, page, previous_hash)
-            chunks.append(metadata)
-            chunk_id += 1
-
-    if temp_pdf_path.exists():
-        temp_pdf_path.unlink()
-
-    return chunks
-
-# ---------------------- PDF CHUNKER ----------------------
-def chunk_pdf(file_path, chunk_size=None, buffer=8):
+# ---------------------- DOCX CONVERSION ----------------------
+def convert_docx_to_pdf(file_path):
+    """
+    Convert a DOCX file to PDF bytes.
+    Conversions are cached by DOCX content hash, so re-uploads skip LibreOffice.
+    """
     file_path = Path(file_path)
-    filename = file_path.stem
-    filetype = "pdf"
-
-    with open(file_path, "rb") as f:
-        file_bytes = f.read()
-
-    chunks = []
-    chunk_id = 1
-    previous_hash = None
 
+    docx_key = file_hash(file_path, "docx-pdf")
+
+    cached = doc_cache.get_bytes("docx-pdf", docx_key, ".pdf")
+    if cached is not None:
+        print(f"[DOCX CHUNKER] Cache hit for {file_path}")
+        return cached
+
+    with timed("ingest", "convert"):
+        if platform.system() == 'Windows':
+            # Convert DOCX → PDF next to the source, through Word
+            temp_pdf_path = file_path.with_suffix(".pdf")
+            convert(str(file_path), str(temp_pdf_path))
+            file_bytes = temp_pdf_path.read_bytes()
+            temp_pdf_path.unlink(missing_ok=True)
+        else:
+            # Warm headless LibreOffice workers (see utils.libreoffice_pool)
+            file_bytes = libreoffice_pool.convert(file_path)
+
+    print(f"[DOCX CHUNKER] Converted {file_path} → PDF ({len(file_bytes)} bytes)")
+
+    doc_cache.put_bytes("docx-pdf", docx_key, file_bytes, ".pdf")
+    return file_bytes
+
+# ---------------------- CHUNK BUILDING ----------------------
+def build_chunks(filename, filetype, pieces):
+    """
+    Turn `(page_number, text)` pieces into chunk metadata, lazily.
+    Pieces without a page number are numbered by position.
+    """
+    for chunk_id, (page_number, text) in enumerate(pieces, 1):
+        yield build_chunk_metadata(filename, filetype, chunk_id, page_number or chunk_id, text)
+
+def chunk_structure(filetype):
+    # Headings only mean something in Markdown; other text still breaks at paragraphs
+    if CHUNK_STRUCTURE == "markdown" and filetype != "md":
+        return "paragraph"
+    return CHUNK_STRUCTURE
+
+def splitting_message(chunk_size, buffer):
+    size = chunk_size or CHUNK_SIZE
+    overlap = CHUNK_OVERLAP if buffer is None else buffer
+    return f"Splitting by {size} {CHUNK_UNIT} with {overlap} {CHUNK_UNIT} overlap"
+
+def chunk_pages(filename, filetype, pages, chunk_size=None, buffer=None):
+    """One chunk per extracted page, or `chunk_size` windows across pages (labelled with their first page)."""
+    tag = filetype.upper()
     if chunk_size:
-        print(f"[PDF CHUNKER] Splitting by {chunk_size} words with {buffer} word overlap")
-        pages = extract_text_from_pdf(file_bytes)
-        full_text = " ".join(pages)
-
-        words = full_text.split()
-        total_words = len(words)
-
-        for i in range(0, total_words, chunk_size):
-            start = i
-            end = min(i + chunk_size + buffer, total_words)
-            chunk_words = words[start:end]
-            chunk_data = " ".join(chunk_words)
-
-            page_number = (i // chunk_size) + 1
-            metadata = build_chunk_metadata(filename, filetype, chunk_id, page_number, chunk_data, previous_hash)
-            chunks.append(metadata)
-            chunk_id += 1
+        print(f"[{tag} CHUNKER] {splitting_message(chunk_size, buffer)}")
+        pieces = split_text(page_lines(pages), chunk_size, buffer, structure=chunk_structure(filetype))
     else:
-        print(f"[PDF CHUNKER] Splitting by real PDF pages (OCR extraction)")
-        pages = extract_text_from_pdf(file_bytes)
-
-        for idx, page in enumerate(pages):
-            page_number = idx + 1
-            metadata = build_chunk_metadata(filename, filetype, chunk_id, page_number, page, previous_hash)
-            chunks.append(metadata)
-            chunk_id += 1
-
-    return chunks
-
-# ---------------------- MD CHUNKER ----------------------
-def chunk_md(file_path, delimiter=None, chunk_size=512, buffer=8):
+        print(f"[{tag} CHUNKER] Splitting by real PDF pages (OCR extraction)")
+        pieces = enumerate(pages, 1)
+    yield from build_chunks(filename, filetype, pieces)
+
+def chunk_text_file(file_path, filetype, delimiter=None, chunk_size=None, buffer=None, keep_delimiter=False):
+    """
+    Chunk a UTF-8 text file in one streaming pass: parts between `delimiter`s
+    if given, otherwise `split_text` windows. Only the current chunk's text
+    is held in memory.
+    """
     file_path = Path(file_path)
-    filename = file_path.stem
-    filetype = "md"
-
-    print(f"[MD CHUNKER] Processing {file_path}")
+    tag = filetype.upper()
+    print(f"[{tag} CHUNKER] Processing {file_path}")
 
+    count = 0
     with open(file_path, "r", encoding="utf-8") as f:
-        content = f.read()
-
-    chunks = []
-    chunk_id = 1
-    previous_hash = None
-
-    if delimiter:
-        parts = content.split(delimiter)
-        for idx, part in enumerate(parts):
-            part = part.strip()
-            if part:
-                page_number = idx + 1
-                metadata = build_chunk_metadata(
-                    filename, filetype, chunk_id, page_number, f"{delimiter} {part}", previous_hash
-                )
-                chunks.append(metadata)
-                chunk_id += 1
-    else:
-        words = content.split()
-        total_words = len(words)
-
-        print(f"[MD CHUNKER] Splitting by {chunk_size} words with {buffer} word overlap")
-
-        for i in range(0, total_words, chunk_size):
-            start = i
-            end = min(i + chunk_size + buffer, total_words)
-            chunk_words = words[start:end]
-            chunk_data = " ".join(chunk_words)
-
-            page_number = (i // chunk_size) + 1
-            metadata = build_chunk_metadata(
-                filename, filetype, chunk_id, page_number, chunk_data, previous_hash
+        if delimiter:
+            pieces = (
+                (idx, f"{delimiter} {part}" if keep_delimiter else part)
+                for idx, part in enumerate((part.strip() for part in split_delimited(f, delimiter)), 1)
+                if part
             )
-            chunks.append(metadata)
-            chunk_id += 1
+        else:
+            print(f"[{tag} CHUNKER] {splitting_message(chunk_size, buffer)}")
+            pieces = split_text(file_lines(f), chunk_size, buffer, structure=chunk_structure(filetype))
+        for chunk in build_chunks(file_path.stem, filetype, pieces):
+            count += 1
+            yield chunk
 
-    print(f"[MD CHUNKER] Split into {len(chunks)} chunks")
-    return chunks
+    print(f"[{tag} CHUNKER] Split into {count} chunks")
 
-# ---------------------- TXT CHUNKER ----------------------
-def chunk_txt(file_path, delimiter=None, chunk_size=512, buffer=8):
+# ---------------------- DOCX CHUNKER ----------------------
+def chunk_docx(file_path, chunk_size=None, buffer=None):
     file_path = Path(file_path)
-    filename = file_path.stem
-    filetype = "txt"
-
-    print(f"[TXT CHUNKER] Processing {file_path}")
+    pages = extract_text_from_pdf(convert_docx_to_pdf(file_path), name=file_path.name)
+    yield from chunk_pages(file_path.stem, "docx", pages, chunk_size, buffer)
 
-    with open(file_path, "r", encoding="utf-8") as f:
-        content = f.read()
-
-    chunks = []
-    chunk_id = 1
-    previous_hash = None
-
-    if delimiter:
-        parts = content.split(delimiter)
-        for idx, part in enumerate(parts):
-            part = part.strip()
-            if part:
-                page_number = idx + 1
-                metadata = build_chunk_metadata(
-                    filename, filetype, chunk_id, page_number, part, previous_hash
-                )
-                chunks.append(metadata)
-                chunk_id += 1
-    else:
-        words = content.split()
-        total_words = len(words)
-
-        print(f"[TXT CHUNKER] Splitting by {chunk_size} words with {buffer} word overlap")
-
-        for i in range(0, total_words, chunk_size):
-            start = i
-            end = min(i + chunk_size + buffer, total_words)
-            chunk_words = words[start:end]
-            chunk_data = " ".join(chunk_words)
+# ---------------------- PDF CHUNKER ----------------------
+def chunk_pdf(file_path, chunk_size=None, buffer=None):
+    file_path = Path(file_path)
+    pages = extract_text_from_pdf(file_path)
+    yield from chunk_pages(file_path.stem, "pdf", pages, chunk_size, buffer)
 
-            page_number = (i // chunk_size) + 1
-            metadata = build_chunk_metadata(
-                filename, filetype, chunk_id, page_number, chunk_data, previous_hash
-            )
-            chunks.append(metadata)
-            chunk_id += 1
+# ---------------------- MD CHUNKER ----------------------
+def chunk_md(file_path, delimiter=None, chunk_size=None, buffer=None):
+    yield from chunk_text_file(file_path, "md", delimiter, chunk_size, buffer, keep_delimiter=True)
 
-    print(f"[TXT CHUNKER] Split into {len(chunks)} chunks")
-    return chunks
+# ---------------------- TXT CHUNKER ----------------------
+def chunk_txt(file_path, delimiter=None, chunk_size=None, buffer=None):
+    yield from chunk_text_file(file_path, "txt", delimiter, chunk_size, buffer)
 
 # ---------------------- FILE CATEGORIZATION ----------------------
 def categorize_files(
@@ -264,24 +186,20 @@ def categorize_files(
 
 
 # ---------------------- PROCESS FILES ----------------------
-def process_chunks(categorized, chunk_size=None, delimeter=None, buffer=8):
-    results = []
-
-    for ext, files in categorized.items():
-        for file in files:
-            if ext == "docx":
-                results.extend(chunk_docx(file, chunk_size=chunk_size, buffer=buffer))
-            elif ext == "pdf":
-                results.extend(chunk_pdf(file, chunk_size=chunk_size, buffer=buffer))
-            elif ext == "md":
-                if chunk_size is not None:
-                    results.extend(chunk_md(file, chunk_size=chunk_size, delimeter=delimeter, buffer=buffer))
-                else:
-                    results.extend(chunk_md(file))
-            elif ext == "txt":
-                if chunk_size is not None:
-                    results.extend(chunk_txt(file, chunk_size=chunk_size, delimeter=delimeter, buffer=buffer))
-                else:
-                    results.extend(chunk_txt(file))
-
-    return results
\ No newline at end of file
+def iter_chunks(ext, file, chunk_size=None, delimiter=None, buffer=None):
+    """Chunks of one file, generated as the file is read."""
+    if ext == "docx":
+        return chunk_docx(file, chunk_size=chunk_size, buffer=buffer)
+    elif ext == "pdf":
+        return chunk_pdf(file, chunk_size=chunk_size, buffer=buffer)
+    elif ext == "md":
+        return chunk_md(file, delimiter=delimiter, chunk_size=chunk_size, buffer=buffer)
+    elif ext == "txt":
+        return chunk_txt(file, delimiter=delimiter, chunk_size=chunk_size, buffer=buffer)
+    return iter(())
+
+def record_failure(failures, file, error):
+    print(f"[CHUNKER] Failed to process {file}: {error}")
+    report_failure(str(file), str(error))
+    if failures is not None:
+        failures.append({"file": str(file), "error": str(error)})
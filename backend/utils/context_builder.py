@@ -0,0 +1,205 @@
+import os
+import re
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Token budget for the retrieved context block sent to the LLM
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# tiktoken encoding used to count tokens (o200k_base is the gpt-4o/gpt-5 family)
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "o200k_base")
+# Chunks sharing at least this fraction of their word trigrams with a better one are dropped
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+# Don't bother appending a truncated chunk into less room than this
+CONTEXT_MIN_TAIL_TOKENS = int(os.getenv("CONTEXT_MIN_TAIL_TOKENS", "64"))
+
+CONTEXT_HEADER = "Context Retrieved:"
+NO_CONTEXT = "(No relevant context found.)"
+
+_encoding = None
+_encoding_failed = False
+
+
+# ---------------------- TOKEN COUNTING ----------------------
+def get_encoding():
+    """The tiktoken encoding, or None if it cannot be loaded (e.g. offline without a cached BPE file)."""
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(CONTEXT_TOKENIZER)
+        except Exception as e:
+            _encoding_failed = True
+            print(f"[CONTEXT] Tokenizer {CONTEXT_TOKENIZER} unavailable ({e}), estimating 4 characters per token")
+    return _encoding
+
+def count_tokens(text: str) -> int:
+    encoding = get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut `text` to at most `max_tokens`, backing off to the last sentence (or word) boundary."""
+    if max_tokens <= 0:
+        return ""
+    encoding = get_encoding()
+    if encoding is None:
+        cut = text[:max_tokens * 4]
+    else:
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        cut = encoding.decode(tokens[:max_tokens])
+    if len(cut) >= len(text):
+        return text
+
+    sentence_end = max(cut.rfind(". "), cut.rfind(".\n"), cut.rfind("? "), cut.rfind("! "), cut.rfind("\n\n"))
+    if sentence_end > len(cut) // 2:
+        return cut[:sentence_end + 1].rstrip() + " ..."
+    word_end = cut.rfind(" ")
+    return (cut[:word_end] if word_end > 0 else cut).rstrip() + " ..."
+
+
+# ---------------------- MERGING / DEDUPLICATION ----------------------
+def chunk_position(chunk: dict):
+    """Sequence number of a chunk within its file, from the `<filename>_<filetype>_<n>` chunk id."""
+    try:
+        return int(str(chunk.get("chunk_id", "")).rsplit("_", 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+def join_overlapping(left: str, right: str, max_overlap_words: int = 64) -> str:
+    """Concatenate two consecutive chunks, dropping the words `right` repeats from the end of `left`."""
+    left_words = left.split()
+    right_words = right.split()
+    for size in range(min(max_overlap_words, len(left_words), len(right_words)), 0, -1):
+        if left_words[-size:] == right_words[:size]:
+            return left.rstrip() + " " + " ".join(right_words[size:])
+    separator = "\n" if left.endswith("\n") or right.startswith("\n") else "\n\n"
+    return left.rstrip() + separator + right.lstrip()
+
+def merge_adjacent(chunks):
+    """
+    Merge retrieved chunks that are consecutive in the same file into one
+    passage, removing their overlap. A merged passage keeps the best score
+    of its parts and the page range it spans.
+    """
+    by_file = {}
+    passages = []
+    for chunk in chunks:
+        position = chunk_position(chunk)
+        if position is None:
+            passages.append(_passage([chunk]))
+        else:
+            by_file.setdefault((chunk.get("filename"), chunk.get("filetype")), []).append((position, chunk))
+
+    for entries in by_file.values():
+        entries.sort(key=lambda entry: entry[0])
+        run = [entries[0]]
+        for position, chunk in entries[1:]:
+            if position == run[-1][0]:
+                continue  # same chunk retrieved twice
+            if position == run[-1][0] + 1:
+                run.append((position, chunk))
+            else:
+                passages.append(_passage([c for _, c in run]))
+                run = [(position, chunk)]
+        passages.append(_passage([c for _, c in run]))
+
+    return passages
+
+def _passage(chunks):
+    content = chunks[0].get("page_content", "").strip()
+    for chunk in chunks[1:]:
+        content = join_overlapping(content, chunk.get("page_content", "").strip())
+    pages = [c.get("page_number") for c in chunks if c.get("page_number") is not None]
+    scores = [c["score"] for c in chunks if c.get("score") is not None]
+    return {
+        "filename": chunks[0].get("filename", "Unknown File"),
+        "first_page": min(pages) if pages else None,
+        "last_page": max(pages) if pages else None,
+        "content": content,
+        "score": max(scores) if scores else None,
+        "rank": min(c.get("_rank", 0) for c in chunks),
+        "chunks": chunks,
+    }
+
+def _shingles(text: str, size: int = 3):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def drop_near_duplicates(passages, threshold: float = None):
+    """
+    Keep passages in order, skipping any whose word trigrams are mostly
+    (`threshold`) contained in a passage already kept.
+    """
+    threshold = CONTEXT_DEDUP_THRESHOLD if threshold is None else threshold
+    kept, kept_shingles = [], []
+    for passage in passages:
+        shingles = _shingles(passage["content"])
+        duplicate = any(
+            shingles and other and len(shingles & other) / min(len(shingles), len(other)) >= threshold
+            for other in kept_shingles
+        )
+        if not duplicate:
+            kept.append(passage)
+            kept_shingles.append(shingles)
+    return kept
+
+
+# ---------------------- PACKING ----------------------
+def format_passage(idx: int, passage: dict, content: str = None) -> str:
+    first, last = passage["first_page"], passage["last_page"]
+    if first is None:
+        pages = "Page N/A"
+    elif first == last:
+        pages = f"Page {first}"
+    else:
+        pages = f"Pages {first}-{last}"
+    return f"[{idx}] File: {passage['filename']} ({pages})\n{passage['content'] if content is None else content}\n"
+
+def build_context(retrieved_chunks, token_budget: int = None):
+    """
+    Pack retrieved chunks into a context block of at most `token_budget` tokens.
+
+    Consecutive chunks of a file are merged, near-duplicates dropped, and
+    passages added best score first (retrieval order when there are no
+    scores). The last passage that does not fit is truncated at a sentence
+    boundary if enough room is left. Returns `(context_text, used_chunks)`.
+    """
+    token_budget = CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+    if not retrieved_chunks:
+        return NO_CONTEXT, []
+
+    ranked = [dict(chunk, _rank=rank) for rank, chunk in enumerate(retrieved_chunks)]
+    passages = merge_adjacent(ranked)
+    passages.sort(key=lambda p: (-(p["score"] if p["score"] is not None else float("-inf")), p["rank"]))
+    passages = drop_near_duplicates(passages)
+
+    blocks, used_chunks = [], []
+    remaining = token_budget - count_tokens(CONTEXT_HEADER + "\n")
+    for passage in passages:
+        block = format_passage(len(blocks) + 1, passage)
+        tokens = count_tokens(block + "\n")
+        if tokens > remaining:
+            header_tokens = count_tokens(format_passage(len(blocks) + 1, passage, content="") + "\n")
+            room = remaining - header_tokens
+            if room < CONTEXT_MIN_TAIL_TOKENS:
+                continue  # a smaller passage further down may still fit
+            block = format_passage(len(blocks) + 1, passage, truncate_to_tokens(passage["content"], room))
+            tokens = count_tokens(block + "\n")
+        blocks.append(block)
+        used_chunks.extend({k: v for k, v in c.items() if k != "_rank"} for c in passage["chunks"])
+        remaining -= tokens
+        if remaining < CONTEXT_MIN_TAIL_TOKENS:
+            break
+
+    if not blocks:
+        return NO_CONTEXT, []
+
+    print(f"[CONTEXT] {len(retrieved_chunks)} chunks -> {len(blocks)} passages, "
+          f"{token_budget - remaining}/{token_budget} tokens")
+    return "\n".join([CONTEXT_HEADER] + blocks), used_chunks
@@ -0,0 +1,183 @@
+import os
+import json
+import uuid
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict, defaultdict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DOC_CACHE_DIR = os.getenv("DOC_CACHE_DIR", "../data-source/.cache")
+DOC_CACHE_MAX_BYTES = int(os.getenv("DOC_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+DOC_CACHE_ENABLED = os.getenv("DOC_CACHE_ENABLED", "true").lower() == "true"
+
+
+def content_hash(data: bytes, salt: str = "") -> str:
+    """sha256 of `data`, optionally salted (e.g. with the model that produced a result)."""
+    h = hashlib.sha256(salt.encode("utf-8"))
+    h.update(data)
+    return h.hexdigest()
+
+def file_hash(path, salt: str = "", block_size: int = 1024 * 1024) -> str:
+    """`content_hash` of a file's contents, read in blocks rather than all at once."""
+    h = hashlib.sha256(salt.encode("utf-8"))
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            h.update(block)
+    return h.hexdigest()
+
+
+class DiskCache:
+    """
+    Content-addressed file cache with a total size cap and LRU eviction.
+
+    Entries live at `<root>/<namespace>/<key[:2]>/<key><suffix>`. Writes
+    go through a temp file + rename, so readers never see partial entries.
+
+    Sizes and recency are kept in an in-memory LRU index, built once from
+    a scan of the directory (oldest mtime first) and then updated on every
+    hit, write and eviction, so evicting never walks the tree again. A hit
+    also bumps the file's mtime, so recency survives a restart. Entries
+    written by another process are only counted after a restart.
+    """
+
+    def __init__(self, root, max_bytes: int, enabled: bool = True):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.enabled = enabled and max_bytes > 0
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self._index = None  # path -> size, least recently used first; loaded on first use
+        self._size = 0
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def path(self, namespace: str, key: str, suffix: str = "") -> Path:
+        return self.root / namespace / key[:2] / f"{key}{suffix}"
+
+    # ---------------------- READS ----------------------
+    def get_path(self, namespace: str, key: str, suffix: str = ""):
+        if not self.enabled:
+            return None
+        path = self.path(namespace, key, suffix)
+        try:
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses[namespace] += 1
+                if self._index is not None and path in self._index:
+                    self._size -= self._index.pop(path)  # deleted behind the index's back
+            return None
+        with self._lock:
+            self.hits[namespace] += 1
+            if self._index is not None and path in self._index:
+                self._index.move_to_end(path)
+        return path
+
+    def get_bytes(self, namespace: str, key: str, suffix: str = ""):
+        path = self.get_path(namespace, key, suffix)
+        if path is None:
+            return None
+        try:
+            return path.read_bytes()
+        except OSError:
+            return None  # evicted between utime and read
+
+    def get_text(self, namespace: str, key: str, suffix: str = ".md"):
+        data = self.get_bytes(namespace, key, suffix)
+        return data.decode("utf-8") if data is not None else None
+
+    def get_json(self, namespace: str, key: str, suffix: str = ".json"):
+        data = self.get_bytes(namespace, key, suffix)
+        return json.loads(data) if data is not None else None
+
+    # ---------------------- WRITES ----------------------
+    def put_bytes(self, namespace: str, key: str, data: bytes, suffix: str = ""):
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+        path = self.path(namespace, key, suffix)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+        self._load_index()
+        with self._lock:
+            self._size += len(data) - self._index.pop(path, 0)
+            self._index[path] = len(data)
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def put_text(self, namespace: str, key: str, text: str, suffix: str = ".md"):
+        self.put_bytes(namespace, key, text.encode("utf-8"), suffix)
+
+    def put_json(self, namespace: str, key: str, value, suffix: str = ".json"):
+        self.put_bytes(namespace, key, json.dumps(value).encode("utf-8"), suffix)
+
+    # ---------------------- EVICTION / STATS ----------------------
+    def _entries(self):
+        if not self.root.exists():
+            return []
+        entries = []
+        for path in self.root.rglob("*"):
+            if path.is_file() and not path.name.endswith(".tmp"):
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _load_index(self):
+        """Build the LRU index from one scan of the cache directory, the first time it is needed."""
+        if self._index is not None:
+            return
+        with self._load_lock:
+            if self._index is not None:
+                return
+            entries = sorted(self._entries())
+            with self._lock:
+                self._index = OrderedDict((path, size) for _, size, path in entries)
+                self._size = sum(self._index.values())
+
+    def evict(self):
+        """Delete least recently used entries until the cache is at 90% of its cap."""
+        self._load_index()
+        victims = []
+        with self._lock:
+            target = int(self.max_bytes * 0.9)
+            while self._size > target and self._index:
+                path, size = self._index.popitem(last=False)
+                self._size -= size
+                victims.append(path)
+        removed = 0
+        for path in victims:
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            removed += 1
+        if removed:
+            print(f"[CACHE] Evicted {removed} entries from {self.root}")
+
+    def stats(self) -> dict:
+        if self.enabled:
+            self._load_index()
+        with self._lock:
+            namespaces = set(self.hits) | set(self.misses)
+            return {
+                "enabled": self.enabled,
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "namespaces": {
+                    ns: {"hits": self.hits[ns], "misses": self.misses[ns]}
+                    for ns in sorted(namespaces)
+                },
+            }
+
+
+# Converted PDFs ("docx-pdf") and OCR markdown per document ("ocr-doc") and per page ("ocr-page")
+doc_cache = DiskCache(DOC_CACHE_DIR, DOC_CACHE_MAX_BYTES, enabled=DOC_CACHE_ENABLED)
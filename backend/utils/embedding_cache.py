@@ -0,0 +1,181 @@
+import io
+import os
+import time
+import sqlite3
+import threading
+import numpy as np
+from pathlib import Path
+from collections import defaultdict
+from dotenv import load_dotenv
+
+from utils.disk_cache import content_hash
+
+load_dotenv()
+
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "../data-source/.embedding-cache")
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(4 * 1024 ** 3)))
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+
+# Keys per SQL statement (stays under SQLite's bound-parameter limit)
+_KEYS_PER_QUERY = 500
+# Least recently used entries deleted per eviction step
+_EVICT_STEP = 256
+
+
+class EmbeddingCache:
+    """
+    Chunk embeddings keyed by (model name, text hash), as `.npy` blobs in
+    one SQLite shard file per model (`<root>/emb-<model>.sqlite`).
+
+    A whole embedding round is read and written per model in single
+    statements and transactions, so a million chunks are a few files
+    rather than a file per vector. The total size of the stored vectors is
+    capped across shards; eviction deletes the least recently used entries
+    (by their `last_used` column) until the cache is at 90% of its cap.
+    """
+
+    def __init__(self, root, max_bytes: int, enabled: bool = True):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.enabled = enabled and max_bytes > 0
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self._shards = None  # namespace -> connection; opened on first use
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def namespace(model_name: str) -> str:
+        return "emb-" + model_name.replace("/", "__")
+
+    @staticmethod
+    def key(model_name: str, text: str) -> str:
+        return content_hash(text.encode("utf-8"), model_name)
+
+    # ---------------------- SHARDS ----------------------
+    def _open(self, path: Path):
+        connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS vectors "
+            "(key TEXT PRIMARY KEY, data BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS vectors_last_used ON vectors (last_used)")
+        connection.commit()
+        return connection
+
+    def _load_shards(self):
+        # Called with the lock held: open existing shards and total their size once
+        if self._shards is not None:
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._shards = {}
+        for path in sorted(self.root.glob("emb-*.sqlite")):
+            self._shards[path.stem] = self._open(path)
+        self._size = sum(
+            shard.execute("SELECT COALESCE(SUM(size), 0) FROM vectors").fetchone()[0]
+            for shard in self._shards.values()
+        )
+
+    def _shard(self, namespace: str):
+        self._load_shards()
+        if namespace not in self._shards:
+            self._shards[namespace] = self._open(self.root / f"{namespace}.sqlite")
+        return self._shards[namespace]
+
+    @staticmethod
+    def _select(shard, columns: str, keys):
+        rows = []
+        for start in range(0, len(keys), _KEYS_PER_QUERY):
+            part = keys[start:start + _KEYS_PER_QUERY]
+            rows += shard.execute(
+                f"SELECT {columns} FROM vectors WHERE key IN ({','.join('?' * len(part))})", part,
+            ).fetchall()
+        return rows
+
+    # ---------------------- READS / WRITES ----------------------
+    def get_many(self, model_name: str, texts) -> list:
+        """Cached embedding of each text (None for misses), in order."""
+        if not self.enabled:
+            return [None] * len(texts)
+        namespace = self.namespace(model_name)
+        keys = [self.key(model_name, text) for text in texts]
+        with self._lock:
+            shard = self._shard(namespace)
+            found = dict(self._select(shard, "key, data", list(dict.fromkeys(keys))))
+            if found:
+                with shard:
+                    now = time.time()
+                    shard.executemany("UPDATE vectors SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+            hits = sum(1 for key in keys if key in found)
+            self.hits[namespace] += hits
+            self.misses[namespace] += len(keys) - hits
+        return [np.load(io.BytesIO(found[key])) if key in found else None for key in keys]
+
+    def put_many(self, model_name: str, items):
+        """Store `(text, array)` pairs in one transaction."""
+        if not self.enabled or not items:
+            return
+        namespace = self.namespace(model_name)
+        now = time.time()
+        rows = {}
+        for text, array in items:
+            buffer = io.BytesIO()
+            np.save(buffer, np.asarray(array))
+            data = buffer.getvalue()
+            rows[self.key(model_name, text)] = (data, len(data), now)
+        with self._lock:
+            shard = self._shard(namespace)
+            replaced = sum(size for _, size in self._select(shard, "key, size", list(rows)))
+            with shard:
+                shard.executemany(
+                    "INSERT OR REPLACE INTO vectors (key, data, size, last_used) VALUES (?, ?, ?, ?)",
+                    [(key, *row) for key, row in rows.items()],
+                )
+            self._size += sum(size for _, size, _ in rows.values()) - replaced
+            if self._size > self.max_bytes:
+                self._evict()
+
+    # ---------------------- EVICTION / STATS ----------------------
+    def _evict(self):
+        # Called with the lock held; each step takes the oldest entries of the shard holding the oldest one
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        while self._size > target:
+            oldest = [
+                (shard.execute("SELECT MIN(last_used) FROM vectors").fetchone()[0], namespace)
+                for namespace, shard in self._shards.items()
+            ]
+            oldest = [entry for entry in oldest if entry[0] is not None]
+            if not oldest:
+                self._size = 0
+                break
+            shard = self._shards[min(oldest)[1]]
+            rows = shard.execute(
+                "SELECT key, size FROM vectors ORDER BY last_used LIMIT ?", (_EVICT_STEP,),
+            ).fetchall()
+            with shard:
+                shard.executemany("DELETE FROM vectors WHERE key = ?", [(key,) for key, _ in rows])
+            self._size -= sum(size for _, size in rows)
+            removed += len(rows)
+        if removed:
+            print(f"[CACHE] Evicted {removed} embeddings from {self.root}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            if self.enabled:
+                self._load_shards()
+            namespaces = set(self.hits) | set(self.misses)
+            return {
+                "enabled": self.enabled,
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "namespaces": {
+                    ns: {"hits": self.hits[ns], "misses": self.misses[ns]}
+                    for ns in sorted(namespaces)
+                },
+            }
+
+
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_MAX_BYTES, enabled=EMBEDDING_CACHE_ENABLED)
@@ -0,0 +1,81 @@
+import os
+import math
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Models of this worker process, by vector name (set by `_init_worker`)
+_models = {}
+
+
+def _init_worker(specs, threads):
+    for vector_name, model_class, model_name in specs:
+        _models[vector_name] = model_class(model_name, threads=threads)
+
+
+def _embed(vector_name, texts, batch_size):
+    return list(_models[vector_name].embed(texts, batch_size=batch_size))
+
+
+class EmbeddingPool:
+    """
+    Persistent worker processes, each holding its own copy of the embedding
+    models, loaded once when the pool starts.
+
+    Unlike fastembed's `parallel=`, which starts a fresh process pool (and
+    reloads every model) on each `embed` call, the workers live as long as
+    the app, so even a single round of chunks is spread over all of them.
+    `specs` are `(vector_name, model_class, model_name)` triples.
+    """
+
+    def __init__(self, workers: int, specs, threads: int = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.specs = specs
+        # One onnxruntime thread per worker unless set: the workers already fill the cores
+        self.threads = threads or 1
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                print(f"[EMBED] Starting {self.workers} embedding workers")
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    # Forking a process that already runs onnxruntime and server threads is unsafe
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.specs, self.threads),
+                )
+            return self._executor
+
+    def embed(self, jobs, batch_size: int):
+        """
+        Embed `(vector_name, texts)` jobs, all at once across the workers.
+
+        Each job's texts are split evenly over the workers (in pieces of at
+        most `batch_size`, which fastembed batches internally). Returns one
+        list of embeddings per job, in order.
+        """
+        executor = self._get_executor()
+        submitted = []
+        for vector_name, texts in jobs:
+            size = max(1, min(batch_size, math.ceil(len(texts) / self.workers)))
+            submitted.append([
+                executor.submit(_embed, vector_name, texts[start:start + size], batch_size)
+                for start in range(0, len(texts), size)
+            ])
+        return [[embedding for future in futures for embedding in future.result()] for futures in submitted]
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+                self._executor = None
+
+
+def start_embedding_pool(workers: int, specs, threads: int = None) -> EmbeddingPool:
+    pool = EmbeddingPool(workers, specs, threads)
+    atexit.register(pool.close)
+    return pool
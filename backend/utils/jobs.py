@@ -0,0 +1,220 @@
+import os
+import uuid
+import threading
+import contextvars
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_MAX_QUEUED = int(os.getenv("INGEST_MAX_QUEUED", "32"))
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", "500"))
+
+PROGRESS_FIELDS = ("files_total", "files_done", "files_skipped", "pages_ocr", "pages_text_layer", "chunks_embedded", "chunks_upserted")
+
+# Job currently executing in this thread (None outside of a job)
+_current_job = contextvars.ContextVar("current_job", default=None)
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once cancellation has been requested."""
+
+
+class JobQueueFull(Exception):
+    """Raised by `JobManager.submit` when too many jobs are already waiting."""
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class Job:
+    def __init__(self, kind: str, session_id: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.session_id = session_id
+        self.status = "queued"  # queued | running | succeeded | failed | cancelled
+        self.progress = {field: 0 for field in PROGRESS_FIELDS}
+        self.failures = []
+        self.documents = []
+        self.error = None
+        self.result = None
+        self.created_at = _now()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    def advance(self, field: str, amount: int = 1):
+        with self._lock:
+            self.progress[field] = self.progress.get(field, 0) + amount
+
+    def set_progress(self, field: str, value: int):
+        with self._lock:
+            self.progress[field] = value
+
+    def add_failure(self, file: str, error: str):
+        with self._lock:
+            self.failures.append({"file": file, "error": error})
+
+    def add_document(self, file: str, stats: dict):
+        with self._lock:
+            self.documents.append({"file": file, **stats})
+
+    def request_cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed", "cancelled")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            progress = dict(self.progress)
+            failures = list(self.failures)
+            documents = list(self.documents)
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "session_id": self.session_id,
+            "status": self.status,
+            "progress": progress,
+            "failures": failures,
+            "documents": documents,
+            "error": self.error,
+            "createdAt": self.created_at,
+            "startedAt": self.started_at,
+            "finishedAt": self.finished_at,
+        }
+
+
+class JobManager:
+    """
+    In-process ingestion queue: a bounded thread pool plus a job table.
+
+    No external broker is involved, so tests can create their own
+    `JobManager(max_workers=1)` and submit plain callables to it.
+    """
+
+    def __init__(self, max_workers=INGEST_WORKERS, max_queued=INGEST_MAX_QUEUED, history=INGEST_JOB_HISTORY):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._max_queued = max_queued
+        self._history = history
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, session_id: str, fn, *args, cleanup=None, **kwargs) -> Job:
+        """
+        Queue `fn(*args, **kwargs)` as a job. `cleanup()`, if given, runs once
+        the job ends however it ends, including when it is cancelled before
+        it started (e.g. to remove the files it would have consumed).
+        """
+        with self._lock:
+            queued = sum(1 for j in self._jobs.values() if j.status == "queued")
+            if queued >= self._max_queued:
+                raise JobQueueFull(f"{queued} ingestion jobs already waiting")
+            job = Job(kind, session_id)
+            self._jobs[job.id] = job
+            self._prune()
+
+        self._executor.submit(self._run, job, fn, args, kwargs, cleanup)
+        print(f"[JOBS] Queued {kind} job {job.id} for session {session_id}")
+        return job
+
+    def _run(self, job: Job, fn, args, kwargs, cleanup=None):
+        try:
+            self._execute(job, fn, args, kwargs)
+        finally:
+            if cleanup is not None:
+                try:
+                    cleanup()
+                except Exception as e:
+                    print(f"[JOBS] Cleanup of job {job.id} failed: {e}")
+
+    def _execute(self, job: Job, fn, args, kwargs):
+        if job.cancel_requested:
+            job.status = "cancelled"
+            job.finished_at = _now()
+            return
+
+        token = _current_job.set(job)
+        job.status = "running"
+        job.started_at = _now()
+        try:
+            job.result = fn(*args, **kwargs)
+            job.status = "succeeded"
+        except JobCancelled:
+            job.status = "cancelled"
+            print(f"[JOBS] Job {job.id} cancelled")
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            print(f"[JOBS] Job {job.id} failed: {e}")
+        finally:
+            job.finished_at = _now()
+            _current_job.reset(token)
+
+    def _prune(self):
+        finished = [j for j in self._jobs.values() if j.finished]
+        for job in finished[:max(0, len(finished) - self._history)]:
+            del self._jobs[job.id]
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, session_id: str = None):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [j for j in jobs if session_id is None or j.session_id == session_id]
+
+    def cancel(self, job_id: str):
+        job = self.get(job_id)
+        if job and not job.finished:
+            job.request_cancel()
+        return job
+
+    def shutdown(self, wait: bool = True):
+        for job in self.list():
+            job.request_cancel()
+        self._executor.shutdown(wait=wait)
+
+
+job_manager = JobManager()
+
+# ---------------------- HOOKS FOR INGESTION CODE ----------------------
+# These are no-ops when called outside of a job (e.g. synchronous requests).
+
+def current_job():
+    return _current_job.get()
+
+def report_progress(field: str, amount: int = 1):
+    job = _current_job.get()
+    if job is not None:
+        job.advance(field, amount)
+
+def set_progress(field: str, value: int):
+    job = _current_job.get()
+    if job is not None:
+        job.set_progress(field, value)
+
+def report_failure(file: str, error: str):
+    job = _current_job.get()
+    if job is not None:
+        job.add_failure(file, error)
+
+def report_document(file: str, stats: dict):
+    job = _current_job.get()
+    if job is not None:
+        job.add_document(file, stats)
+
+def check_cancelled():
+    job = _current_job.get()
+    if job is not None and job.cancel_requested:
+        raise JobCancelled(job.id)
@@ -0,0 +1,256 @@
+import os
+import json
+import queue
+import atexit
+import select
+import shutil
+import signal
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LIBREOFFICE_BINARY = os.getenv("LIBREOFFICE_BINARY", "libreoffice")
+# Interpreter with the `uno` module (python3-uno) that runs utils/libreoffice_worker.py
+LIBREOFFICE_PYTHON = os.getenv("LIBREOFFICE_PYTHON", "/usr/bin/python3")
+# Persistent converter processes, i.e. DOCX conversions that can run at once
+LIBREOFFICE_POOL_SIZE = int(os.getenv("LIBREOFFICE_POOL_SIZE", "2"))
+# Seconds one conversion may take before its worker is killed and restarted
+LIBREOFFICE_TIMEOUT = float(os.getenv("LIBREOFFICE_TIMEOUT", "120"))
+LIBREOFFICE_START_TIMEOUT = float(os.getenv("LIBREOFFICE_START_TIMEOUT", "30"))
+LIBREOFFICE_PING_TIMEOUT = float(os.getenv("LIBREOFFICE_PING_TIMEOUT", "10"))
+# Profiles and output dirs of the workers (default: a fresh temp dir)
+LIBREOFFICE_WORK_DIR = os.getenv("LIBREOFFICE_WORK_DIR")
+
+WORKER_SCRIPT = Path(__file__).with_name("libreoffice_worker.py")
+
+
+class ConversionError(RuntimeError):
+    """A document LibreOffice could not convert (or not within the timeout)."""
+
+
+def uno_available() -> bool:
+    """Whether `LIBREOFFICE_PYTHON` can import `uno`, i.e. workers can stay resident."""
+    try:
+        return subprocess.run(
+            [LIBREOFFICE_PYTHON, "-c", "import uno"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=LIBREOFFICE_START_TIMEOUT,
+        ).returncode == 0
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+
+
+class LibreOfficeWorker:
+    """
+    One headless LibreOffice with its own user profile and output directory.
+
+    In "uno" mode the LibreOffice process stays up: a bridge process
+    (`utils/libreoffice_worker.py`, run by `LIBREOFFICE_PYTHON`) owns it and
+    takes conversions as JSON lines over its stdin/stdout pipes, so each
+    DOCX costs a document load instead of a cold start. In "subprocess"
+    mode every conversion is a `--convert-to` run, still on this worker's
+    own (already initialized) profile. Either way workers never contend for
+    a profile or clobber each other's output.
+    """
+
+    def __init__(self, index: int, root: Path, mode: str):
+        self.index = index
+        self.mode = mode
+        self.profile_dir = root / f"profile-{index}"
+        self.out_dir = root / f"out-{index}"
+        self.pipe_name = None
+        self.generation = 0
+        self.process = None
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+
+    def _soffice_args(self):
+        return [
+            LIBREOFFICE_BINARY,
+            f"-env:UserInstallation={self.profile_dir.as_uri()}",
+            "--headless", "--invisible", "--nologo", "--norestore", "--nodefault", "--nolockcheck",
+        ]
+
+    # ---------------------- LIFECYCLE ----------------------
+    def start(self):
+        if self.mode == "subprocess":
+            # Create the profile now rather than during the first conversion
+            try:
+                subprocess.run(self._soffice_args() + ["--terminate_after_init"], timeout=LIBREOFFICE_START_TIMEOUT,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            except subprocess.TimeoutExpired:
+                print(f"[LIBREOFFICE] Worker {self.index} profile setup timed out")
+            return
+
+        # Fresh pipe name per start, so a restart never races the old process's pipe
+        self.generation += 1
+        self.pipe_name = f"optim_rag_lo_{os.getpid()}_{self.index}_{self.generation}"
+        self.process = subprocess.Popen(
+            [
+                LIBREOFFICE_PYTHON, str(WORKER_SCRIPT),
+                "--binary", LIBREOFFICE_BINARY,
+                "--profile", str(self.profile_dir),
+                "--pipe", self.pipe_name,
+                "--start-timeout", str(LIBREOFFICE_START_TIMEOUT),
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            start_new_session=True,  # own process group, so a kill also takes LibreOffice down
+        )
+        ready = self._read_reply(LIBREOFFICE_START_TIMEOUT + 5)
+        if not ready.get("ready"):
+            self.stop()
+            raise ConversionError(f"LibreOffice worker {self.index} failed to start: {ready.get('error')}")
+        print(f"[LIBREOFFICE] Worker {self.index} listening on pipe {self.pipe_name}")
+
+    def stop(self):
+        process, self.process = self.process, None
+        if process is None:
+            return
+        try:
+            process.stdin.close()  # the bridge exits on EOF and shuts LibreOffice down
+            process.wait(timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        process.wait()
+
+    def restart(self):
+        print(f"[LIBREOFFICE] Restarting worker {self.index}")
+        self.stop()
+        self.start()
+
+    def healthy(self) -> bool:
+        """The bridge is running and LibreOffice answers a ping."""
+        if self.mode == "subprocess":
+            return True  # nothing long-lived to check
+        if self.process is None or self.process.poll() is not None:
+            return False
+        try:
+            return self._request({"ping": True}, LIBREOFFICE_PING_TIMEOUT).get("ok", False)
+        except ConversionError:
+            return False
+
+    # ---------------------- BRIDGE PROTOCOL ----------------------
+    def _read_reply(self, timeout: float) -> dict:
+        ready, _, _ = select.select([self.process.stdout], [], [], timeout)
+        line = self.process.stdout.readline() if ready else ""
+        if not line:
+            self.stop()  # hung or crashed; restarted before the next conversion
+            raise ConversionError(f"LibreOffice worker {self.index} crashed or did not answer within {timeout:.0f}s")
+        return json.loads(line)
+
+    def _request(self, message: dict, timeout: float) -> dict:
+        try:
+            self.process.stdin.write(json.dumps(message) + "\n")
+            self.process.stdin.flush()
+        except OSError as e:
+            self.stop()
+            raise ConversionError(f"LibreOffice worker {self.index} is gone: {e}")
+        return self._read_reply(timeout)
+
+    # ---------------------- CONVERSION ----------------------
+    def convert(self, src: Path, timeout: float) -> Path:
+        """Convert `src` to PDF in this worker's output dir and return the PDF's path."""
+        out_path = self.out_dir / f"{src.stem}.pdf"
+        out_path.unlink(missing_ok=True)  # never mistake a stale file for this conversion's output
+
+        if self.mode == "subprocess":
+            try:
+                subprocess.run(
+                    self._soffice_args() + ["--convert-to", "pdf", str(src), "--outdir", str(self.out_dir)],
+                    check=True, timeout=timeout, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                )
+            except subprocess.TimeoutExpired:
+                raise ConversionError(f"Converting {src.name} timed out after {timeout:.0f}s")
+            except subprocess.CalledProcessError as e:
+                raise ConversionError(f"LibreOffice exited with {e.returncode} converting {src.name}")
+        else:
+            if not self.healthy():
+                self.restart()
+            result = self._request({"src": str(src.resolve()), "out": str(out_path.resolve())}, timeout)
+            if not result.get("ok"):
+                raise ConversionError(f"LibreOffice failed converting {src.name}: {result.get('error')}")
+
+        if not out_path.exists():
+            raise ConversionError(f"LibreOffice produced no PDF for {src.name}")
+        return out_path
+
+
+class LibreOfficePool:
+    """
+    Fixed-size pool of `LibreOfficeWorker`s, started on first use.
+
+    `convert` borrows an idle worker (waiting if all are busy). A worker
+    that fails its health check, crashed or timed out is restarted before
+    it converts again.
+    """
+
+    def __init__(self, size: int, work_dir=None, timeout: float = LIBREOFFICE_TIMEOUT):
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.work_dir = work_dir
+        self.mode = None
+        self._root = None
+        self._workers = []
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._workers:
+                return
+            if self.work_dir:
+                self._root = Path(self.work_dir)
+                self._root.mkdir(parents=True, exist_ok=True)
+            else:
+                self._root = Path(tempfile.mkdtemp(prefix="optim-rag-lo-"))
+            self.mode = "uno" if uno_available() else "subprocess"
+            print(f"[LIBREOFFICE] Starting {self.size} {self.mode} workers in {self._root}")
+            workers = []
+            try:
+                for index in range(self.size):
+                    worker = LibreOfficeWorker(index, self._root, self.mode)
+                    workers.append(worker)
+                    worker.start()
+            except Exception:
+                for worker in workers:
+                    worker.stop()
+                raise
+            self._workers = workers
+            for worker in workers:
+                self._idle.put(worker)
+
+    def convert(self, src, timeout: float = None) -> bytes:
+        """Convert the document at `src` to PDF and return the PDF bytes."""
+        self._ensure_started()
+        src = Path(src)
+        worker = self._idle.get()
+        try:
+            out_path = worker.convert(src, timeout or self.timeout)
+            try:
+                return out_path.read_bytes()
+            finally:
+                out_path.unlink(missing_ok=True)
+        finally:
+            self._idle.put(worker)
+
+    def close(self):
+        with self._lock:
+            for worker in self._workers:
+                worker.stop()
+            self._workers = []
+            self._idle = queue.Queue()
+            if self._root is not None and not self.work_dir:
+                shutil.rmtree(self._root, ignore_errors=True)
+            self._root = None
+
+
+libreoffice_pool = LibreOfficePool(LIBREOFFICE_POOL_SIZE, LIBREOFFICE_WORK_DIR)
+atexit.register(libreoffice_pool.close)
@@ -0,0 +1,99 @@
+"""
+Conversion bridge run by `utils.libreoffice_pool`, one per pool worker.
+
+Starts a headless LibreOffice listening on a named pipe and converts
+documents to PDF over UNO, taking one JSON request per line on stdin
+(`{"src": ..., "out": ...}` or `{"ping": true}`) and answering one JSON
+line on stdout. It runs under the interpreter that has the `uno` module
+(usually the system `python3` with `python3-uno`), so it must not import
+anything from this project.
+"""
+import sys
+import json
+import time
+import argparse
+import subprocess
+from pathlib import Path
+
+import uno
+from com.sun.star.beans import PropertyValue
+
+
+def prop(name, value):
+    p = PropertyValue()
+    p.Name = name
+    p.Value = value
+    return p
+
+def reply(**message):
+    sys.stdout.write(json.dumps(message) + "\n")
+    sys.stdout.flush()
+
+def connect(args, soffice):
+    local = uno.getComponentContext()
+    resolver = local.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver", local)
+    deadline = time.monotonic() + args.start_timeout
+    while True:
+        try:
+            ctx = resolver.resolve(f"uno:pipe,name={args.pipe};urp;StarOffice.ComponentContext")
+            return ctx.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", ctx)
+        except Exception:
+            if soffice.poll() is not None or time.monotonic() > deadline:
+                raise
+            time.sleep(0.25)
+
+def convert(desktop, src, out):
+    doc = desktop.loadComponentFromURL(Path(src).resolve().as_uri(), "_blank", 0, (prop("Hidden", True),))
+    if doc is None:
+        raise RuntimeError(f"cannot open {src}")
+    try:
+        doc.storeToURL(Path(out).resolve().as_uri(), (prop("FilterName", "writer_pdf_Export"),))
+    finally:
+        doc.close(True)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--binary", required=True)
+    parser.add_argument("--profile", required=True)
+    parser.add_argument("--pipe", required=True)
+    parser.add_argument("--start-timeout", type=float, default=30)
+    args = parser.parse_args()
+
+    soffice = subprocess.Popen([
+        args.binary,
+        f"-env:UserInstallation={Path(args.profile).resolve().as_uri()}",
+        "--headless", "--invisible", "--nologo", "--norestore", "--nodefault", "--nolockcheck",
+        f"--accept=pipe,name={args.pipe};urp;StarOffice.ComponentContext",
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    try:
+        try:
+            desktop = connect(args, soffice)
+        except Exception as e:
+            reply(ready=False, error=f"LibreOffice did not start: {e}")
+            return
+        reply(ready=True)
+
+        for line in sys.stdin:
+            request = json.loads(line)
+            try:
+                if request.get("ping"):
+                    desktop.getComponents()
+                else:
+                    convert(desktop, request["src"], request["out"])
+                reply(ok=True)
+            except Exception as e:
+                reply(ok=False, error=str(e))
+                if soffice.poll() is not None:
+                    return  # crashed; the pool starts a new worker
+    finally:
+        if soffice.poll() is None:
+            soffice.terminate()
+            try:
+                soffice.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                soffice.kill()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import time
+import contextvars
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Stage durations for both pipelines:
+#   chat   - query_embed, qdrant_query, answer_cache, context, history_summary, llm
+#   ingest - convert, ocr, chunk, embed, upsert
+STAGE_SECONDS = Histogram(
+    "optim_rag_stage_seconds",
+    "Time spent in each stage of the chat and ingestion pipelines",
+    ["pipeline", "stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+
+# PDF pages by how their text was obtained: text_layer, cached (earlier extraction) or ocr
+PDF_PAGES = Counter(
+    "optim_rag_pdf_pages",
+    "PDF pages extracted, by extraction path",
+    ["path"],
+)
+
+# Staged ingestion (utils.pipeline): items through each stage, and items waiting between stages
+PIPELINE_ITEMS = Counter(
+    "optim_rag_pipeline_items",
+    "Items processed by each ingestion pipeline stage (files for extract, chunks otherwise)",
+    ["stage"],
+)
+PIPELINE_QUEUE_DEPTH = Gauge(
+    "optim_rag_pipeline_queue_depth",
+    "Items waiting in an ingestion pipeline queue",
+    ["queue"],
+)
+
+# Stage timings of the HTTP request being served, for the Server-Timing header
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def metrics_exposition():
+    """`(body, content type)` of the Prometheus text exposition of every metric."""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+@contextmanager
+def timed(pipeline: str, stage: str):
+    """Observe the duration of the enclosed block as `stage` of `pipeline`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(pipeline, stage).observe(elapsed)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed * 1000))
+
+
+def start_request_timings():
+    """Collect stage timings for the current request. Returns the (shared, mutable) list."""
+    timings = []
+    _request_timings.set(timings)
+    return timings
+
+
+def server_timing_header(timings) -> str:
+    """Format collected timings as a `Server-Timing` value, summing repeated stages."""
+    totals = {}
+    for stage, ms in timings:
+        totals[stage] = totals.get(stage, 0.0) + ms
+    return ", ".join(f"{stage};dur={ms:.1f}" for stage, ms in totals.items())
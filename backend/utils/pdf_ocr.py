@@ -9,12 +9,38 @@ from PIL import Image
 from mistralai import Mistral
 import pdfplumber
 import asyncio
+import time
+import hashlib
+import threading
+import contextvars
+from pathlib import Path
+from typing import Union
+from concurrent.futures import ThreadPoolExecutor
 
 from utils.qdrant_setup import *
+from utils.jobs import report_progress, report_document, check_cancelled
+from utils.disk_cache import doc_cache, content_hash, file_hash
+from utils.metrics import timed, PDF_PAGES
 
 
 client = Mistral(api_key=os.getenv("MISTRAL_API_KEY"))
 
+OCR_MODEL = os.getenv("OCR_MODEL", "mistral-ocr-latest")
+# Pages per OCR request and number of requests in flight per document
+OCR_PAGES_PER_RANGE = int(os.getenv("OCR_PAGES_PER_RANGE", "8"))
+OCR_CONCURRENCY = int(os.getenv("OCR_CONCURRENCY", "4"))
+OCR_MAX_RETRIES = int(os.getenv("OCR_MAX_RETRIES", "2"))
+OCR_RETRY_BACKOFF = float(os.getenv("OCR_RETRY_BACKOFF", "1.0"))
+
+# Pages whose own text layer is good enough are extracted locally instead of OCR'd
+TEXT_LAYER_ENABLED = os.getenv("TEXT_LAYER_ENABLED", "true").lower() == "true"
+# Fewer characters than this means a scanned (image-only) or near-empty page
+TEXT_LAYER_MIN_CHARS = int(os.getenv("TEXT_LAYER_MIN_CHARS", "50"))
+# Minimum share of letters, digits and whitespace; broken font encodings score low
+TEXT_LAYER_MIN_QUALITY = float(os.getenv("TEXT_LAYER_MIN_QUALITY", "0.7"))
+# Pages mostly covered by images (scans with an OCR layer, slides) go to OCR anyway
+TEXT_LAYER_MAX_IMAGE_COVERAGE = float(os.getenv("TEXT_LAYER_MAX_IMAGE_COVERAGE", "0.8"))
+
 def encode_pdf(pdf_bytes: bytes):
     """Encode PDF bytes to a base64 string."""
     try:
@@ -39,43 +65,243 @@ def convert_to_pdf(file_bytes: bytes, filename: str):
     else:
         raise ValueError(f"Unsupported file type: {extension}")
     
-def process_page(idx, ocr_response=None):
-    try:
-        if ocr_response and hasattr(ocr_response, 'pages') and idx < len(ocr_response.pages):
-            return ocr_response.pages[idx].markdown
+def split_page_ranges(total_pages: int, pages_per_range: int):
+    """Split `total_pages` into consecutive (start, end) ranges, end exclusive."""
+    pages_per_range = max(1, pages_per_range)
+    return [
+        (start, min(start + pages_per_range, total_pages))
+        for start in range(0, total_pages, pages_per_range)
+    ]
+
+def extract_page_range(doc, start: int, end: int) -> bytes:
+    """Copy pages [start, end) of an open pymupdf document into a standalone PDF."""
+    with pymupdf.open() as part:
+        part.insert_pdf(doc, from_page=start, to_page=end - 1)
+        return part.tobytes()
+
+def ocr_pdf_bytes(pdf_bytes: bytes, include_image_base64: bool = False):
+    """Send one PDF (or page range) through Mistral OCR."""
+    encoded = encode_pdf(pdf_bytes)
+    return client.ocr.process(
+        model=OCR_MODEL,
+        document={
+            "type": "document_url",
+            "document_url": f"data:application/pdf;base64,{encoded}"
+        },
+        include_image_base64=include_image_base64
+    )
+
+def ocr_page_range(range_bytes: bytes, start: int, end: int, include_image_base64: bool = False):
+    """
+    OCR pages [start, end), retrying this range alone on failure.
+    Returns one markdown string per page, None for pages missing from the response.
+    """
+    attempt = 0
+    while True:
+        try:
+            response = ocr_pdf_bytes(range_bytes, include_image_base64)
+            break
+        except Exception as e:
+            attempt += 1
+            if attempt > OCR_MAX_RETRIES:
+                raise
+            delay = OCR_RETRY_BACKOFF * (2 ** (attempt - 1))
+            print(f"[OCR] Pages {start + 1}-{end} failed ({e}), retry {attempt}/{OCR_MAX_RETRIES} in {delay:.1f}s")
+            time.sleep(delay)
+
+    report_progress("pages_ocr", end - start)
+    pages = getattr(response, "pages", None) or []
+    return [pages[idx].markdown if idx < len(pages) else None for idx in range(end - start)]
+
+class OCRError(RuntimeError):
+    """Pages of a document that could not be extracted; `pages` holds their 1-based numbers."""
+
+    def __init__(self, name: str, pages: list, errors: list):
+        self.pages = pages
+        detail = "; ".join(dict.fromkeys(str(e) for e in errors)) or "missing from OCR response"
+        super().__init__(f"OCR failed for {len(pages)} page(s) of {name} ({format_pages(pages)}): {detail}")
+
+def format_pages(pages: list) -> str:
+    """1-based page numbers as compact ranges, e.g. "1-8, 12"."""
+    ranges = missing_page_ranges([page - 1 for page in pages], len(pages) or 1)
+    return ", ".join(f"{start + 1}-{end}" if end - start > 1 else str(end) for start, end in ranges)
+
+def page_cache_key(doc, idx: int) -> str:
+    """Content hash of a single page: its content streams, images and form XObjects."""
+    page = doc[idx]
+    h = hashlib.sha256(OCR_MODEL.encode("utf-8"))
+    h.update(repr(tuple(page.rect)).encode("utf-8"))
+    h.update(page.read_contents() or b"")
+    xrefs = [img[0] for img in page.get_images(full=True)] + [xobj[0] for xobj in page.get_xobjects()]
+    for xref in xrefs:
+        h.update(doc.xref_stream_raw(xref) or b"")
+    return h.hexdigest()
+
+def image_coverage(page) -> float:
+    """Share of the page area covered by images (overlaps counted twice, capped at 1)."""
+    page_area = abs(page.rect) or 1.0
+    covered = sum(abs(pymupdf.Rect(info["bbox"]) & page.rect) for info in page.get_image_info())
+    return min(1.0, covered / page_area)
+
+def text_layer_page(page):
+    """
+    The page's text from its own text layer, or None when it needs OCR:
+    too little text (scanned or image-only), mostly unreadable characters
+    (broken font encoding), or mostly covered by images.
+    """
+    text = page.get_text("text").strip()
+    if len(text) < TEXT_LAYER_MIN_CHARS:
+        return None
+    readable = sum(1 for ch in text if ch.isalnum() or ch.isspace())
+    if readable / len(text) < TEXT_LAYER_MIN_QUALITY:
+        return None
+    if image_coverage(page) > TEXT_LAYER_MAX_IMAGE_COVERAGE:
+        return None
+    return text
+
+def text_layer_settings() -> str:
+    """Part of the document cache key, so changing thresholds re-extracts documents."""
+    if not TEXT_LAYER_ENABLED:
+        return ""
+    return f"text-layer:{TEXT_LAYER_MIN_CHARS}:{TEXT_LAYER_MIN_QUALITY}:{TEXT_LAYER_MAX_IMAGE_COVERAGE}"
+
+def missing_page_ranges(missing: list, pages_per_range: int):
+    """Group sorted page indexes into contiguous (start, end) ranges of at most `pages_per_range`."""
+    ranges = []
+    for idx in missing:
+        if ranges and ranges[-1][1] == idx and ranges[-1][1] - ranges[-1][0] < pages_per_range:
+            ranges[-1] = (ranges[-1][0], idx + 1)
         else:
-            return f"Error: Page {idx + 1} not available in OCR response"
-    except Exception as e:
-        return f"Error processing page {idx + 1}: {e}"
+            ranges.append((idx, idx + 1))
+    return ranges
 
-def extract_text_from_pdf(pdf_bytes: bytes):
-    try:
-        with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
-            total_pages = len(pdf.pages)
-    except Exception:
-        with pymupdf.open(stream=pdf_bytes, filetype="pdf") as doc:
-            total_pages = len(doc)
+def record_page_stats(name: str, stats: dict):
+    """Log how a document's pages were extracted and report it to metrics and the running job."""
+    stats = {"pages": 0, "text_layer": 0, "cached": 0, "ocr": 0, "failed": 0, **stats}
+    print(f"[OCR] {name}: {stats['pages']} pages, {stats['text_layer']} from text layer, "
+          f"{stats['cached']} cached, {stats['ocr']} OCR'd ({stats['failed']} failed)")
+    for path in ("text_layer", "cached", "ocr"):
+        if stats[path]:
+            PDF_PAGES.labels(path).inc(stats[path])
+    report_progress("pages_text_layer", stats["text_layer"])
+    report_document(name, stats)
 
-    pdf_bytes = encode_pdf(pdf_bytes)
+@timed("ingest", "ocr")
+def extract_text_from_pdf(pdf: Union[bytes, str, Path], include_image_base64: bool = False,
+                          pages_per_range: int = None, concurrency: int = None, name: str = None):
+    """
+    OCR a PDF (bytes, or a file path) and return one markdown string per page, in page order.
 
-    try:
-        response = client.ocr.process(
-            model="mistral-ocr-latest",
-            document={
-                "type": "document_url",
-                "document_url": f"data:application/pdf;base64,{pdf_bytes}"
-            },
-            include_image_base64=True
-        )
-    except Exception as e:
-        return [f"Error during OCR processing: {e}"]
+    With `TEXT_LAYER_ENABLED`, pages with a usable text layer (see
+    `text_layer_page`) are extracted locally as plain text and only the
+    rest go to OCR. How many pages took each path is logged and reported
+    on the running job per document (`name`, default the file name).
 
-    page_numbers = list(range(total_pages))
+    Given a path, the file is hashed in blocks and opened by pymupdf in
+    place, so the whole document is never held in memory; only the page
+    ranges being OCR'd are.
+
+    Results are cached on disk by content hash, per document and per page,
+    so only pages never seen before are sent to OCR. Those are grouped into
+    ranges of `pages_per_range` pages and OCR'd concurrently, at most
+    `concurrency` at a time; only that many range PDFs are held in memory
+    at once. A range that keeps failing after `OCR_MAX_RETRIES` retries
+    (or pages missing from the OCR response) fail the whole document with
+    `OCRError` once every range has finished, so no error text is ever
+    indexed as page content; pages that did succeed stay cached, so a
+    retry only OCRs the failed ones.
+    """
+    pages_per_range = pages_per_range or OCR_PAGES_PER_RANGE
+    concurrency = concurrency or OCR_CONCURRENCY
+
+    from_file = not isinstance(pdf, (bytes, bytearray))
+    name = name or (Path(pdf).name if from_file else "document")
+    salt = OCR_MODEL + text_layer_settings()
+    doc_key = file_hash(pdf, salt) if from_file else content_hash(pdf, salt)
+    cached = doc_cache.get_json("ocr-doc", doc_key)
+    if cached is not None:
+        print(f"[OCR] Cache hit for document {doc_key[:12]} ({len(cached)} pages)")
+        record_page_stats(name, {"pages": len(cached), "cached": len(cached)})
+        return cached
+
+    doc = pymupdf.open(pdf, filetype="pdf") if from_file else pymupdf.open(stream=pdf, filetype="pdf")
+
+    with doc:
+        total_pages = len(doc)
+        if total_pages == 0:
+            record_page_stats(name, {"pages": 0})
+            return []
+
+        stats = {"pages": total_pages, "text_layer": 0, "cached": 0, "ocr": 0, "failed": 0}
+        extracted_text = [None] * total_pages
+        page_keys = {}
+        for idx in range(total_pages):
+            if TEXT_LAYER_ENABLED:
+                extracted_text[idx] = text_layer_page(doc[idx])
+                if extracted_text[idx] is not None:
+                    stats["text_layer"] += 1
+                    continue
+            page_keys[idx] = page_cache_key(doc, idx)
+            extracted_text[idx] = doc_cache.get_text("ocr-page", page_keys[idx])
+            if extracted_text[idx] is not None:
+                stats["cached"] += 1
+
+        missing = [idx for idx, text in enumerate(extracted_text) if text is None]
+        ranges = missing_page_ranges(missing, pages_per_range)
+        stats["ocr"] = len(missing)
+        failed_pages, errors = [], []
+
+        if ranges:
+            print(f"[OCR] {len(missing)}/{total_pages} pages to OCR in {len(ranges)} ranges, "
+                  f"concurrency {concurrency}")
+        # Bounds both in-flight requests and range PDFs kept in memory
+        slots = threading.BoundedSemaphore(concurrency)
+
+        def run_range(range_bytes, start, end):
+            try:
+                return ocr_page_range(range_bytes, start, end, include_image_base64)
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="ocr") as pool:
+            futures = {}
+            for start, end in ranges:
+                check_cancelled()
+                slots.acquire()
+                try:
+                    if (start, end) == (0, total_pages) and not from_file:
+                        range_bytes = pdf  # whole document, no need to split
+                    else:
+                        range_bytes = extract_page_range(doc, start, end)
+                except Exception:
+                    slots.release()
+                    raise
+                ctx = contextvars.copy_context()
+                futures[pool.submit(ctx.run, run_range, range_bytes, start, end)] = (start, end)
+
+            for future, (start, end) in futures.items():
+                try:
+                    pages = future.result()
+                except Exception as e:
+                    print(f"[OCR] Pages {start + 1}-{end} failed permanently: {e}")
+                    failed_pages.extend(range(start + 1, end + 1))
+                    errors.append(e)
+                    continue
+
+                for idx, text in enumerate(pages, start=start):
+                    if text is None:
+                        print(f"[OCR] Page {idx + 1} not available in OCR response")
+                        failed_pages.append(idx + 1)
+                    else:
+                        extracted_text[idx] = text
+                        doc_cache.put_text("ocr-page", page_keys[idx], text)
+
+    stats["failed"] = len(failed_pages)
+    record_page_stats(name, stats)
+    if failed_pages:
+        raise OCRError(name, sorted(failed_pages), errors)
+    doc_cache.put_json("ocr-doc", doc_key, extracted_text)
 
-    extracted_text = []
-    for idx in page_numbers:
-        extracted_text.append(process_page(idx, ocr_response=response))
-        
     return extracted_text
 
 def create_chunks(directory_path: str):
@@ -0,0 +1,413 @@
+import os
+import time
+import queue
+import threading
+import contextvars
+from datetime import datetime
+from dotenv import load_dotenv
+
+from utils.chunking import iter_chunks, record_failure, CHUNK_WORKERS
+from utils.disk_cache import file_hash
+from utils.jobs import report_progress, set_progress, check_cancelled, JobCancelled
+from utils.metrics import PIPELINE_ITEMS, PIPELINE_QUEUE_DEPTH, STAGE_SECONDS
+from utils.qdrant_setup import (
+    EMBED_ROUND_SIZE,
+    PointIdAllocator,
+    build_points,
+    bump_session_version,
+    content_size,
+    delete_points,
+    file_filter,
+    iter_points,
+    overwrite_payloads,
+    write_points,
+)
+from utils.session_registry import get_session_files
+from utils.uploads import discard_file
+
+load_dotenv()
+
+# Workers per stage: extract (OCR/convert + chunk, I/O bound), embed (fastembed
+# already uses every core, so one is usually right) and upsert (network bound)
+PIPELINE_EXTRACT_WORKERS = int(os.getenv("PIPELINE_EXTRACT_WORKERS", str(CHUNK_WORKERS)))
+PIPELINE_EMBED_WORKERS = int(os.getenv("PIPELINE_EMBED_WORKERS", "1"))
+PIPELINE_UPSERT_WORKERS = int(os.getenv("PIPELINE_UPSERT_WORKERS", "2"))
+# Items waiting between two stages; a full queue blocks the stage before it
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))
+
+_DONE = object()  # end-of-stream marker, one per downstream worker
+
+
+class _PipelineAborted(Exception):
+    """Raised in stage workers once another worker has failed."""
+
+
+class StageStats:
+    """Items processed and time spent working (not waiting on queues) by one stage."""
+
+    def __init__(self, name: str, unit: str):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, items: int, seconds: float):
+        with self._lock:
+            self.items += items
+            self.busy_seconds += seconds
+        PIPELINE_ITEMS.labels(self.name).inc(items)
+
+    def summary(self, wall_seconds: float) -> dict:
+        return {
+            "items": self.items,
+            "unit": self.unit,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "per_second": round(self.items / wall_seconds, 2) if wall_seconds else 0.0,
+        }
+
+
+class IngestPipeline:
+    """
+    Staged ingestion of categorized files into a session:
+
+        files -> extract -> [chunks] -> embed -> [points] -> upsert
+
+    Each stage runs on its own threads, connected by bounded queues, so file
+    N+1 is OCR'd while file N's chunks are embedded and earlier points are
+    written. A full queue blocks the stage feeding it (backpressure), so at
+    most about `queue_size` items per queue are held in memory instead of
+    the whole archive's chunks.
+
+    Files are chunked lazily and their chunks queued in slices of
+    `embed_round_size` (one embedding round). A file that fails to extract
+    is recorded in `failures` (chunks queued before the error are kept); an
+    embedding or upsert error, or cancellation, stops every stage, removes
+    the points already written (see `_rollback`) and is re-raised by `run`.
+
+    Every file's content hash is returned under `files` for the session
+    registry. With `incremental`, a file whose hash matches the registry
+    is skipped, and a changed file's chunks are diffed against its stored
+    points (see `_diff`) so only new or changed chunks are embedded.
+    """
+
+    def __init__(self, session_id: str, session_name: str, extract_workers: int = None,
+                 embed_workers: int = None, upsert_workers: int = None, queue_size: int = None,
+                 embed_round_size: int = None, failures=None, cleanup: bool = False,
+                 incremental: bool = False):
+        self.session_id = session_id
+        self.session_name = session_name
+        self.extract_workers = max(1, extract_workers or PIPELINE_EXTRACT_WORKERS)
+        self.embed_workers = max(1, embed_workers or PIPELINE_EMBED_WORKERS)
+        self.upsert_workers = max(1, upsert_workers or PIPELINE_UPSERT_WORKERS)
+        queue_size = max(1, queue_size or PIPELINE_QUEUE_SIZE)
+        self.embed_round_size = embed_round_size or EMBED_ROUND_SIZE
+        self.failures = failures
+        self.cleanup = cleanup
+        self.incremental = incremental
+        self.known_files = {}
+
+        self._files = queue.Queue()
+        self._chunks = queue.Queue(maxsize=queue_size)
+        self._points = queue.Queue(maxsize=queue_size)
+        self._abort = threading.Event()
+        self._error = None
+        self._lock = threading.Lock()
+        self._new_id = None
+        self.chunks_delta = 0
+        self.bytes_delta = 0
+        self.files = {}
+        self.skipped_files = []
+        self._payload_updates = []
+        self._stale_ids = []
+        self._created_ids = []
+        self.stats = {
+            "extract": StageStats("extract", "files"),
+            "embed": StageStats("embed", "chunks"),
+            "upsert": StageStats("upsert", "chunks"),
+        }
+
+    # ---------------------- QUEUES ----------------------
+    def _put(self, q, name: str, item) -> float:
+        """Put `item` on `q`, waiting while it is full. Returns the seconds spent waiting."""
+        start = time.perf_counter()
+        while not self._abort.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                PIPELINE_QUEUE_DEPTH.labels(name).set(q.qsize())
+                return time.perf_counter() - start
+            except queue.Full:
+                continue
+        raise _PipelineAborted()
+
+    def _get(self, q, name: str):
+        while not self._abort.is_set():
+            try:
+                item = q.get(timeout=0.1)
+                PIPELINE_QUEUE_DEPTH.labels(name).set(q.qsize())
+                return item
+            except queue.Empty:
+                continue
+        raise _PipelineAborted()
+
+    def _fail(self, error: BaseException):
+        with self._lock:
+            if self._error is None:
+                self._error = error
+        self._abort.set()
+
+    # ---------------------- STAGES ----------------------
+    def _extract(self):
+        while not self._abort.is_set():
+            try:
+                ext, file = self._files.get_nowait()
+            except queue.Empty:
+                return
+            start = time.perf_counter()
+            waited = 0.0
+            try:
+                check_cancelled()
+                digest = file_hash(file)
+                if self.known_files.get(file.name) == digest:
+                    print(f"[PIPELINE] {file.name} unchanged, skipping")
+                    with self._lock:
+                        self.skipped_files.append(file.name)
+                    report_progress("files_skipped")
+                else:
+                    chunks = iter_chunks(ext, file)
+                    if self.incremental:
+                        chunks = self._diff(ext, file, list(chunks))
+                    # Chunks move on in embedding-sized slices while the file is
+                    # still being read, so a large file is never held whole
+                    batch = []
+                    for chunk in chunks:
+                        batch.append(chunk)
+                        if len(batch) >= self.embed_round_size:
+                            waited += self._put(self._chunks, "chunks", batch)
+                            batch = []
+                    if batch:
+                        waited += self._put(self._chunks, "chunks", batch)
+                    with self._lock:
+                        self.files[file.name] = digest
+            except (JobCancelled, _PipelineAborted):
+                raise
+            except Exception as e:
+                # Chunks already handed on before the error are still stored
+                record_failure(self.failures, file, e)
+            finally:
+                if self.cleanup:
+                    discard_file(file)
+            busy = time.perf_counter() - start - waited
+            STAGE_SECONDS.labels("ingest", "chunk").observe(busy)
+            self.stats["extract"].add(1, busy)
+            report_progress("files_done")
+
+    def _diff(self, ext, file, chunks):
+        """
+        Match a changed file's chunks against the points already stored for
+        it. A chunk whose `chunk_hash` is stored keeps that point; failing
+        that, one whose text is stored (an edit earlier in the file shifted
+        its `chunk_id`, and so its hash) keeps that point with its payload
+        rewritten. Vectors of kept points are reused. Returns the chunks
+        left to embed; points nothing matched are deleted once the run
+        succeeds.
+        """
+        existing = list(iter_points(file_filter(self.session_id, file.stem, ext)))
+        by_hash = {}
+        for point in existing:
+            by_hash.setdefault(point.payload.get("chunk_hash"), []).append(point)
+
+        updates = []
+        def keep(point, chunk):
+            payload = {**point.payload, "session_name": self.session_name, **chunk}
+            if payload != point.payload:
+                updates.append((point.id, payload))
+
+        unmatched = []
+        for chunk in chunks:
+            candidates = by_hash.get(chunk.get("chunk_hash"))
+            if candidates:
+                keep(candidates.pop(), chunk)
+            else:
+                unmatched.append(chunk)
+
+        by_text = {}
+        for candidates in by_hash.values():
+            for point in candidates:
+                by_text.setdefault(point.payload.get("page_content", ""), []).append(point)
+        fresh = []
+        for chunk in unmatched:
+            candidates = by_text.get(chunk.get("page_content", ""))
+            if candidates:
+                keep(candidates.pop(), chunk)
+            else:
+                fresh.append(chunk)
+
+        stale = [point for candidates in by_text.values() for point in candidates]
+        print(f"[PIPELINE] {file.name}: {len(chunks) - len(fresh)} chunks kept ({len(updates)} re-labelled), "
+              f"{len(fresh)} new or changed, {len(stale)} removed")
+        with self._lock:
+            self._payload_updates.extend(updates)
+            self._stale_ids.extend(point.id for point in stale)
+            self.chunks_delta -= len(stale)
+            self.bytes_delta -= sum(content_size(point.payload) for point in stale)
+        return fresh
+
+    def _payloads(self, chunks):
+        pending = []
+        for chunk in chunks:
+            text = chunk.get("page_content", "")
+            chunk.setdefault("source_type", "upload")
+            chunk.setdefault("uploaded_at", datetime.utcnow().isoformat())
+            payload = {"group_id": self.session_id, "session_name": self.session_name, **chunk}
+            pending.append((self._new_id(), text, payload))
+        with self._lock:
+            self._created_ids.extend(point_id for point_id, _, _ in pending)
+            self.chunks_delta += len(pending)
+            self.bytes_delta += sum(len(text.encode("utf-8")) for _, text, _ in pending)
+        return pending
+
+    def _embed(self):
+        # Chunks of small files are pooled so fastembed still sees full batches
+        buffered = []
+        while True:
+            item = self._get(self._chunks, "chunks")
+            if item is not _DONE:
+                buffered.extend(item)
+            while len(buffered) >= self.embed_round_size or (item is _DONE and buffered):
+                batch, buffered = buffered[:self.embed_round_size], buffered[self.embed_round_size:]
+                check_cancelled()
+                start = time.perf_counter()
+                points = build_points(self._payloads(batch))
+                self.stats["embed"].add(len(points), time.perf_counter() - start)
+                self._put(self._points, "points", points)
+            if item is _DONE:
+                return
+
+    def _upsert(self):
+        while True:
+            points = self._get(self._points, "points")
+            if points is _DONE:
+                return
+            start = time.perf_counter()
+            write_points(points)
+            self.stats["upsert"].add(len(points), time.perf_counter() - start)
+
+    def _worker(self, stage, on_exit=None):
+        try:
+            stage()
+        except _PipelineAborted:
+            pass
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            if on_exit is not None:
+                on_exit()
+
+    def _start(self, name: str, count: int, stage, downstream=None, downstream_name: str = None,
+               downstream_workers: int = 0):
+        remaining = [count]
+        lock = threading.Lock()
+
+        def on_exit():
+            # The last worker of a stage tells every downstream worker to finish
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last and downstream is not None:
+                for _ in range(downstream_workers):
+                    try:
+                        self._put(downstream, downstream_name, _DONE)
+                    except _PipelineAborted:
+                        return
+
+        threads = []
+        for idx in range(count):
+            # Carry the current job into each thread for progress/cancel hooks
+            ctx = contextvars.copy_context()
+            thread = threading.Thread(
+                target=ctx.run, args=(self._worker, stage, on_exit),
+                name=f"ingest-{name}-{idx}", daemon=True,
+            )
+            thread.start()
+            threads.append(thread)
+        return threads
+
+    def _rollback(self):
+        """
+        Delete the points a failed run already wrote. Its summary never
+        reaches the session registry, and every point it wrote has a new
+        id (stale points are only removed on success), so this restores
+        the session as it was.
+        """
+        try:
+            delete_points(self._created_ids)
+        except Exception as e:
+            print(f"[PIPELINE] Could not remove {len(self._created_ids)} points of the failed run: {e}")
+
+    # ---------------------- RUN ----------------------
+    def run(self, categorized) -> dict:
+        """
+        Ingest every categorized file. Returns a `rag_pipeline_setup`-style
+        summary plus per-stage throughput under `stages`.
+        """
+        tasks = [(ext, file) for ext, files in categorized.items() for file in files]
+        set_progress("files_total", len(tasks))
+        for task in tasks:
+            self._files.put(task)
+        self._new_id = PointIdAllocator.for_session(self.session_id)
+        if self.incremental:
+            self.known_files = get_session_files(self.session_id)
+
+        started = time.perf_counter()
+        print(f"[PIPELINE] {len(tasks)} files: {self.extract_workers} extract, "
+              f"{self.embed_workers} embed, {self.upsert_workers} upsert workers")
+        threads = (
+            self._start("extract", self.extract_workers, self._extract, self._chunks, "chunks", self.embed_workers)
+            + self._start("embed", self.embed_workers, self._embed, self._points, "points", self.upsert_workers)
+            + self._start("upsert", self.upsert_workers, self._upsert)
+        )
+        try:
+            for thread in threads:
+                thread.join()
+            if self._error is None:
+                # Old points go only once their replacements are stored
+                overwrite_payloads(self._payload_updates)
+                delete_points(self._stale_ids)
+            else:
+                self._rollback()
+        finally:
+            # Whatever was written is visible now, even if a stage failed
+            bump_session_version(self.session_id)
+
+        if self.cleanup:
+            # Files never picked up because the pipeline stopped early
+            while not self._files.empty():
+                discard_file(self._files.get_nowait()[1])
+        if self._error is not None:
+            raise self._error
+
+        wall = time.perf_counter() - started
+        stages = {name: stats.summary(wall) for name, stats in self.stats.items()}
+        print(f"[PIPELINE] Done in {wall:.1f}s: " + ", ".join(
+            f"{name} {s['items']} {s['unit']} ({s['per_second']}/s, busy {s['busy_seconds']}s)"
+            for name, s in stages.items()
+        ))
+        return {
+            "upserted": self.stats["upsert"].items,
+            "deleted": len(self._stale_ids),
+            "relabelled": len(self._payload_updates),
+            "chunks_delta": self.chunks_delta,
+            "bytes_delta": self.bytes_delta,
+            "files": self.files,
+            "skipped_files": self.skipped_files,
+            "stages": stages,
+        }
+
+
+def ingest_pipeline(session_id: str, session_name: str, categorized, failures=None, cleanup: bool = False,
+                    incremental: bool = False, **options):
+    """Run an `IngestPipeline` over `categorized` files; see its docstring for `options`."""
+    return IngestPipeline(
+        session_id, session_name, failures=failures, cleanup=cleanup, incremental=incremental, **options,
+    ).run(categorized)
@@ -1,22 +1,84 @@
 import os
 import uuid
+import asyncio
+import threading
+import numpy as np
+from collections import defaultdict
 from datetime import datetime
 from dotenv import load_dotenv
 
-from qdrant_client import QdrantClient, models
+from qdrant_client import AsyncQdrantClient, QdrantClient, models
 from fastembed import TextEmbedding, LateInteractionTextEmbedding, SparseTextEmbedding 
 
+from utils.jobs import report_progress, check_cancelled
+from utils.embedding_cache import embedding_cache
+from utils.embedding_pool import start_embedding_pool
+from utils.ttl_cache import TTLCache
+from utils.metrics import timed
+
 load_dotenv()
 
-client = QdrantClient(url=os.getenv("QDRANT_URL"), timeout=500)
+QDRANT_URL = os.getenv("QDRANT_URL")
+# ":memory:" runs Qdrant's local in-process mode (benchmarks, offline development)
+# Request-path searches use `async_client`; ingestion and admin code, which
+# run in worker threads, use the blocking `client`.
+if QDRANT_URL == ":memory:":
+    client = QdrantClient(location=QDRANT_URL)
+    # A second in-memory client would be a separate, empty store: async
+    # callers run the blocking client in a thread instead
+    async_client = None
+else:
+    client = QdrantClient(url=QDRANT_URL, timeout=500)
+    async_client = AsyncQdrantClient(url=QDRANT_URL, timeout=500)
 collection_name = os.getenv("COLLECTION_NAME")
 dense_model_name = os.getenv("DENSE_EMBEDDING_MODEL")
 bm25_model_name = os.getenv("BM25_EMBEDDING_MODEL")
 late_interaction_model_name = os.getenv("LATE_INTERACTION_EMBEDDING_MODEL")
 
-dense_embedding_model = TextEmbedding(os.getenv("DENSE_EMBEDDING_MODEL"))
-bm25_embedding_model = SparseTextEmbedding(os.getenv("BM25_EMBEDDING_MODEL"))
-late_interaction_embedding_model = LateInteractionTextEmbedding(os.getenv("LATE_INTERACTION_EMBEDDING_MODEL"))
+# Local embedding throughput knobs:
+#   EMBED_BATCH_SIZE - texts per fastembed batch
+#   EMBED_PARALLEL   - persistent embedding worker processes (utils/embedding_pool.py);
+#                      0 = all cores, unset = embed in-process
+#   EMBED_THREADS    - onnxruntime threads per model instance; unset = onnxruntime default
+#                      in-process, 1 per embedding worker
+#   UPSERT_BATCH_SIZE - points per Qdrant upsert request
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+EMBED_PARALLEL = int(os.getenv("EMBED_PARALLEL")) if os.getenv("EMBED_PARALLEL") else None
+EMBED_THREADS = int(os.getenv("EMBED_THREADS")) if os.getenv("EMBED_THREADS") else None
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "20"))
+# Points fetched per scroll request when paging through a collection
+SCROLL_PAGE_SIZE = int(os.getenv("SCROLL_PAGE_SIZE", "256"))
+
+dense_embedding_model = TextEmbedding(os.getenv("DENSE_EMBEDDING_MODEL"), threads=EMBED_THREADS)
+bm25_embedding_model = SparseTextEmbedding(os.getenv("BM25_EMBEDDING_MODEL"), threads=EMBED_THREADS)
+late_interaction_embedding_model = LateInteractionTextEmbedding(os.getenv("LATE_INTERACTION_EMBEDDING_MODEL"), threads=EMBED_THREADS)
+
+# group_id is the tenant key: Qdrant co-locates each session's points and
+# builds HNSW links per tenant (payload_m) rather than across the collection.
+TENANT_HNSW_CONFIG = models.HnswConfigDiff(payload_m=16, m=0)
+
+PAYLOAD_INDEXES = {
+    "group_id": models.KeywordIndexParams(type=models.KeywordIndexType.KEYWORD, is_tenant=True),
+    "chunk_hash": models.KeywordIndexParams(type=models.KeywordIndexType.KEYWORD),
+    "filename": models.KeywordIndexParams(type=models.KeywordIndexType.KEYWORD),
+}
+
+def ensure_payload_indexes():
+    """Create any missing payload index from `PAYLOAD_INDEXES`. Returns the fields created."""
+    existing = client.get_collection(collection_name=collection_name).payload_schema or {}
+    created = []
+    for field_name, field_schema in PAYLOAD_INDEXES.items():
+        if field_name in existing:
+            continue
+        print(f"[QDRANT] Creating payload index on {field_name}")
+        client.create_payload_index(
+            collection_name=collection_name,
+            field_name=field_name,
+            field_schema=field_schema,
+            wait=True,
+        )
+        created.append(field_name)
+    return created
 
 if not client.collection_exists(collection_name=collection_name):
     client.create_collection(
@@ -25,6 +87,8 @@ if not client.collection_exists(collection_name=collection_name):
         "all-MiniLM-L6-v2": models.VectorParams(
             size=384,
             distance=models.Distance.COSINE,
+            # Every query is filtered by group_id: build per-session graphs instead of a global one
+            hnsw_config=TENANT_HNSW_CONFIG,
         ),
         "colbertv2.0": models.VectorParams(
             size=128,
@@ -39,54 +103,180 @@ if not client.collection_exists(collection_name=collection_name):
         "bm25": models.SparseVectorParams(modifier=models.Modifier.IDF)
     })
 
-def session_exists(session_id: str) -> bool:
-    results = client.scroll(
-        collection_name=collection_name,
-        scroll_filter=models.Filter(
-            must=[
-                models.FieldCondition(
-                    key="group_id",
-                    match=models.MatchValue(value=session_id)
-                )
-            ]
-        ),
-        limit=1
+ensure_payload_indexes()
+
+def session_filter(session_id: str) -> models.Filter:
+    return models.Filter(
+        must=[
+            models.FieldCondition(
+                key="group_id",
+                match=models.MatchValue(value=session_id)
+            )
+        ]
     )
-    return len(results[0]) > 0
 
-def retrieve_from_store(question: str, session_id:str, n_points: int = 10) -> str:
+def file_filter(session_id: str, filename: str, filetype: str) -> models.Filter:
+    """Chunks of one source file (`filename` is the file's stem, as in chunk payloads)."""
+    return models.Filter(
+        must=[
+            models.FieldCondition(key="group_id", match=models.MatchValue(value=session_id)),
+            models.FieldCondition(key="filename", match=models.MatchValue(value=filename)),
+            models.FieldCondition(key="filetype", match=models.MatchValue(value=filetype)),
+        ]
+    )
+
+def iter_points(scroll_filter=None, page_size=None, with_payload=True, with_vectors=False):
+    """
+    Yield every point matching `scroll_filter`, one scroll page at a time.
+    Follows `next_page_offset` to the end, so memory stays at one page.
+    """
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name,
+            scroll_filter=scroll_filter,
+            limit=page_size or SCROLL_PAGE_SIZE,
+            offset=offset,
+            with_payload=with_payload,
+            with_vectors=with_vectors,
+        )
+        yield from points
+        if offset is None:
+            break
+
+# ---------------------- QUERY-SIDE CACHES ----------------------
+# Query embeddings keyed by (model, text); retrieval results keyed by
+# (session, session version, question, n_points). Writes to a session bump
+# its version, so stale results are never served from this process.
+query_embedding_cache = TTLCache(
+    int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024")),
+    float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "3600")),
+)
+retrieval_cache = TTLCache(
+    int(os.getenv("RETRIEVAL_CACHE_SIZE", "512")),
+    float(os.getenv("RETRIEVAL_CACHE_TTL", "300")),
+)
+
+_session_versions = defaultdict(int)
+_session_versions_lock = threading.Lock()
+
+def session_version(session_id: str) -> int:
+    with _session_versions_lock:
+        return _session_versions[session_id]
+
+def bump_session_version(session_id: str):
+    with _session_versions_lock:
+        _session_versions[session_id] += 1
+
+def _sparse_query_vector(embedding):
+    return models.SparseVector(indices=embedding.indices.tolist(), values=embedding.values.tolist())
+
+QUERY_EMBEDDERS = {
+    "all-MiniLM-L6-v2": (dense_model_name, dense_embedding_model, lambda e: e.tolist()),
+    "bm25": (bm25_model_name, bm25_embedding_model, _sparse_query_vector),
+    "colbertv2.0": (late_interaction_model_name, late_interaction_embedding_model, lambda e: e.tolist()),
+}
+
+def embed_query(vector_name: str, text: str):
+    """Query vector for one of the collection's named vectors, served from cache when possible."""
+    model_name, model, to_vector = QUERY_EMBEDDERS[vector_name]
+    key = (model_name, text)
+    vector = query_embedding_cache.get(key)
+    if vector is None:
+        with timed("chat", "query_embed"):
+            vector = to_vector(next(iter(model.query_embed(text))))
+        query_embedding_cache.set(key, vector)
+    return vector
+
+# Retrieval profiles, cheapest first:
+#   fast    - dense HNSW search only
+#   hybrid  - dense + BM25 prefetch fused server-side with RRF
+#   precise - dense + BM25 prefetch reranked with ColBERT MaxSim
+RETRIEVAL_PROFILES = ("fast", "hybrid", "precise")
+
+def _check_profile(profile: str):
+    if profile not in RETRIEVAL_PROFILES:
+        raise ValueError(f"Unknown retrieval profile: {profile}")
+
+def retrieval_request(question: str, session_id: str, n_points: int = 10, profile: str = "precise",
+                      prefetch_multiplier: int = 2, hnsw_ef: int = None) -> dict:
+    """`query_points` arguments for a retrieval profile. Embeds the question (CPU-bound)."""
+    # hnsw_ef only applies to the dense (HNSW) search; None keeps the collection default
+    search_params = models.SearchParams(hnsw_ef=hnsw_ef) if hnsw_ef else None
+    dense_vector = embed_query("all-MiniLM-L6-v2", question)
+
+    if profile == "fast":
+        return dict(
+            collection_name=collection_name,
+            query=dense_vector,
+            query_filter=session_filter(session_id),
+            using="all-MiniLM-L6-v2",
+            search_params=search_params,
+            with_payload=True,
+            limit=n_points,
+        )
+
     prefetch = [
         models.Prefetch(
-            query=models.Document(text=question, model=dense_model_name),
+            query=dense_vector,
             using="all-MiniLM-L6-v2",
-            limit=2*n_points,
+            params=search_params,
+            limit=prefetch_multiplier*n_points,
         ),
         models.Prefetch(
-            query=models.Document(text=question, model=bm25_model_name),
+            query=embed_query("bm25", question),
             using="bm25",
-            limit=2*n_points,
+            limit=prefetch_multiplier*n_points,
         ),
     ]
-    results = client.query_points(
+    if profile == "hybrid":
+        return dict(
             collection_name=collection_name,
             prefetch=prefetch,
-            query=models.Document(text=question, model=late_interaction_model_name),
-            query_filter=models.Filter(
-            must=[
-                models.FieldCondition(
-                    key="group_id",
-                    match=models.MatchValue(
-                        value=session_id,
-                    ),
-                )
-            ]
-        ),
-            using="colbertv2.0",
+            query=models.FusionQuery(fusion=models.Fusion.RRF),
+            query_filter=session_filter(session_id),
             with_payload=True,
             limit=n_points,
+        )
+    return dict(
+        collection_name=collection_name,
+        prefetch=prefetch,
+        query=embed_query("colbertv2.0", question),
+        query_filter=session_filter(session_id),
+        using="colbertv2.0",
+        with_payload=True,
+        limit=n_points,
     )
 
-    return [result.payload for result in results.points]
+def _cache_results(cache_key, results):
+    # Score of the final stage (cosine, RRF or MaxSim), for ranking the context
+    payloads = [{**result.payload, "score": result.score} for result in results.points]
+    retrieval_cache.set(cache_key, payloads)
+    return [dict(payload) for payload in payloads]
+
+async def aretrieve_from_store(question: str, session_id: str, n_points: int = 10, profile: str = "precise",
+                               prefetch_multiplier: int = 2, hnsw_ef: int = None):
+    """
+    Payloads (plus `score`) of the `n_points` chunks of a session most
+    relevant to `question`, cached per session version. Question embedding
+    runs in a worker thread and the search goes through `AsyncQdrantClient`,
+    so the event loop is never blocked.
+    """
+    _check_profile(profile)
+    cache_key = (session_id, session_version(session_id), question, n_points, profile, prefetch_multiplier, hnsw_ef)
+    cached = retrieval_cache.get(cache_key)
+    if cached is not None:
+        return [dict(payload) for payload in cached]
+
+    request = await asyncio.to_thread(
+        retrieval_request, question, session_id, n_points, profile, prefetch_multiplier, hnsw_ef,
+    )
+    with timed("chat", "qdrant_query"):
+        if async_client is not None:
+            results = await async_client.query_points(**request)
+        else:
+            results = await asyncio.to_thread(client.query_points, **request)
+    return _cache_results(cache_key, results)
 
 def remove_data_from_store(session_id:str) -> str:
     client.delete(
@@ -104,40 +294,306 @@ def remove_data_from_store(session_id:str) -> str:
             )
         )
     )
+    # Only after the delete, so no retrieval can cache the deleted points under the new version
+    bump_session_version(session_id)
+
+# ---------------------- DOCUMENT EMBEDDING ----------------------
+# (vector name, model name, model, raw embedding -> cacheable array, cached array -> Qdrant vector)
+def _sparse_to_array(embedding):
+    return np.vstack([embedding.indices, embedding.values]).astype(np.float64)
+
+def _array_to_sparse(array):
+    return models.SparseVector(indices=array[0].astype(np.int64).tolist(), values=array[1].tolist())
+
+EMBEDDERS = [
+    ("all-MiniLM-L6-v2", dense_model_name, dense_embedding_model, np.asarray, lambda a: a.tolist()),
+    ("bm25", bm25_model_name, bm25_embedding_model, _sparse_to_array, _array_to_sparse),
+    ("colbertv2.0", late_interaction_model_name, late_interaction_embedding_model, np.asarray, lambda a: a.tolist()),
+]
+
+embedding_pool = None
+if EMBED_PARALLEL is not None:
+    embedding_pool = start_embedding_pool(
+        EMBED_PARALLEL,
+        [(vector_name, type(model), model_name) for vector_name, model_name, model, _, _ in EMBEDDERS],
+        EMBED_THREADS,
+    )
+
+# Texts embedded per round before their points are upserted: a full batch for every embedding worker
+EMBED_ROUND_SIZE = EMBED_BATCH_SIZE * (embedding_pool.workers if embedding_pool else 1)
+
+def embed_documents(texts, batch_size=None):
+    """
+    Dense, BM25 and ColBERT vectors for each text, as `{vector_name: vector}`.
+
+    Vectors are looked up in the on-disk embedding cache by (model, text hash);
+    only the misses are embedded, by the local fastembed models or, with
+    EMBED_PARALLEL, by the embedding worker pool, and cached. `batch_size`
+    is passed to fastembed (default EMBED_BATCH_SIZE).
+    """
+    batch_size = batch_size or EMBED_BATCH_SIZE
+    vectors = [{} for _ in texts]
+
+    misses = []
+    for vector_name, model_name, model, to_array, to_vector in EMBEDDERS:
+        missing = {}  # text -> positions, so duplicate texts are embedded once
+        for i, (text, cached) in enumerate(zip(texts, embedding_cache.get_many(model_name, texts))):
+            if cached is None:
+                missing.setdefault(text, []).append(i)
+            else:
+                vectors[i][vector_name] = to_vector(cached)
+        misses.append(missing)
 
-def rag_pipeline_setup(session_id, session_name, documents, is_new=False, batch_size=20):
+    with timed("ingest", "embed"):
+        if embedding_pool is not None:
+            # All three models' misses are queued at once so every worker stays busy
+            results = embedding_pool.embed(
+                [(vector_name, list(missing)) for (vector_name, *_), missing in zip(EMBEDDERS, misses)],
+                batch_size,
+            )
+        else:
+            results = [
+                model.embed(list(missing), batch_size=batch_size) if missing else []
+                for (_, _, model, _, _), missing in zip(EMBEDDERS, misses)
+            ]
+
+        for (vector_name, model_name, _, to_array, to_vector), missing, embeddings in zip(EMBEDDERS, misses, results):
+            arrays = [(text, to_array(embedding)) for text, embedding in zip(missing, embeddings)]
+            embedding_cache.put_many(model_name, arrays)
+            for text, array in arrays:
+                for i in missing[text]:
+                    vectors[i][vector_name] = to_vector(array)
+
+            hits = len(texts) - sum(len(positions) for positions in missing.values())
+            print(f"[EMBED] {vector_name}: {hits} cached, {len(missing)} embedded")
+
+    report_progress("chunks_embedded", len(texts))
+    return vectors
+
+def build_points(pending, embed_batch_size=None):
+    """Embed `(point_id, text, payload)` tuples into `PointStruct`s."""
+    vectors = embed_documents([text for _, text, _ in pending], embed_batch_size)
+    return [
+        models.PointStruct(id=point_id, vector=vector, payload=payload)
+        for (point_id, _, payload), vector in zip(pending, vectors)
+    ]
+
+def write_points(points, batch_size=None):
+    """Upsert ready-made points in requests of `batch_size`."""
+    batch_size = batch_size or UPSERT_BATCH_SIZE
+    for offset in range(0, len(points), batch_size):
+        check_cancelled()
+        batch = points[offset:offset + batch_size]
+        print(f"[UPSERT] Writing batch of {len(batch)} chunks to DB")
+        with timed("ingest", "upsert"):
+            client.upsert(collection_name=collection_name, points=batch)
+        report_progress("chunks_upserted", len(batch))
+
+def overwrite_payloads(updates, batch_size=None):
+    """Replace the payload of existing points, given `(point_id, payload)` pairs; vectors are kept."""
+    batch_size = batch_size or UPSERT_BATCH_SIZE
+    for offset in range(0, len(updates), batch_size):
+        batch = updates[offset:offset + batch_size]
+        print(f"[UPSERT] Rewriting payload of {len(batch)} chunks")
+        client.batch_update_points(
+            collection_name=collection_name,
+            update_operations=[
+                models.OverwritePayloadOperation(overwrite_payload=models.SetPayload(payload=payload, points=[point_id]))
+                for point_id, payload in batch
+            ],
+        )
+
+def delete_points(point_ids):
+    if point_ids:
+        print(f"[DELETE] Removing {len(point_ids)} chunks from DB")
+        client.delete(collection_name=collection_name, points_selector=models.PointIdsList(points=list(point_ids)))
+
+def upsert_points(pending, batch_size=None, embed_batch_size=None):
+    """
+    Embed and upsert `(point_id, text, payload)` tuples with precomputed vectors.
+
+    Texts are embedded EMBED_ROUND_SIZE at a time (a fastembed batch of
+    `embed_batch_size` per embedding worker), then written in upsert
+    requests of `batch_size` points.
+    """
+    for start in range(0, len(pending), EMBED_ROUND_SIZE):
+        check_cancelled()
+        points = build_points(pending[start:start + EMBED_ROUND_SIZE], embed_batch_size)
+        write_points(points, batch_size)
+
+class PointIdAllocator:
+    """
+    New point ids for a session: numbering continues after the session's
+    numeric ids if it has any, otherwise ids are uuids. Thread-safe.
+    """
+
+    def __init__(self, existing_ids):
+        numeric = []
+        for point_id in existing_ids:
+            try:
+                numeric.append(int(point_id))
+            except Exception:
+                pass  # non-numeric id (e.g., uuid)
+        self._next = max(numeric) + 1 if numeric else None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_session(cls, session_id: str):
+        return cls(point.id for point in iter_points(session_filter(session_id), with_payload=False))
+
+    def __call__(self):
+        if self._next is None:
+            return uuid.uuid4().hex
+        with self._lock:
+            point_id = self._next
+            self._next += 1
+            return point_id
+
+def content_size(payload) -> int:
+    return len((payload or {}).get("page_content", "").encode("utf-8"))
+
+def normalize_point_id(point_id):
+    """A point id as Qdrant returns it (int, or dashed uuid string); None if it is not a valid id."""
+    if isinstance(point_id, int):
+        return point_id if point_id >= 0 else None
+    try:
+        return int(point_id)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return str(uuid.UUID(str(point_id)))
+    except ValueError:
+        return None
+
+def apply_chunk_delta(session_id, session_name, chunks, batch_size=None, embed_batch_size=None):
+    """
+    Apply only the chunks that changed, touching only the points they name.
+
+    "modified" and "deleted" chunks are resolved by `point_id` with one
+    `retrieve`, or, without one, by `originalHash`, else `previous_hash`
+    (modified) / `chunk_hash` (deleted), with one lookup on the indexed
+    `chunk_hash`. "new" chunks get
+    fresh uuid ids, so the session's existing ids are never scanned.
+    Returns a `rag_pipeline_setup`-style summary and one result per chunk.
+    """
+    results = []
+    pending = []
+    deleted_ids = []
+    chunks_delta = 0
+    bytes_delta = 0
+
+    def target_hash(chunk):
+        # originalHash is the hash the editor loaded; previous_hash only the one before the last edit
+        if chunk.get("originalHash"):
+            return chunk["originalHash"]
+        return chunk.get("previous_hash") if chunk.get("status") == "modified" else chunk.get("chunk_hash")
+
+    # --- 1. Resolve the points that edits and deletions refer to ---
+    targets = [chunk for chunk in chunks if chunk.get("status") in ("modified", "deleted")]
+    ids = set()
+    for chunk in targets:
+        point_id = normalize_point_id(chunk.get("point_id"))
+        if point_id is not None:
+            # Ask for uuids as sent: a local Qdrant keeps them in the form they were written in
+            ids.add(point_id if isinstance(point_id, int) else chunk["point_id"])
+    hashes = {target_hash(c) for c in targets if c.get("point_id") is None} - {None}
+
+    by_id = {}
+    if ids:
+        for point in client.retrieve(collection_name=collection_name, ids=list(ids), with_payload=True):
+            if (point.payload or {}).get("group_id") == session_id:
+                by_id[normalize_point_id(point.id)] = point
+    by_hash = {}
+    if hashes:
+        hash_filter = models.Filter(must=[
+            models.FieldCondition(key="group_id", match=models.MatchValue(value=session_id)),
+            models.FieldCondition(key="chunk_hash", match=models.MatchAny(any=list(hashes))),
+        ])
+        for point in iter_points(hash_filter):
+            by_hash.setdefault(point.payload.get("chunk_hash"), point)
+
+    # --- 2. Turn each chunk into an upsert, a deletion or nothing ---
+    new_id = PointIdAllocator([])
+    removed = set()
+    for chunk in chunks:
+        status = chunk.get("status")
+        fields = {k: v for k, v in chunk.items() if k != "point_id"}
+        text = chunk.get("page_content", "")
+        result = {"chunk_id": chunk.get("chunk_id"), "chunk_hash": chunk.get("chunk_hash"), "point_id": None}
+
+        if status == "unchanged":
+            results.append({**result, "result": "unchanged", "point_id": chunk.get("point_id")})
+            continue
+
+        if status == "new":
+            point_id = new_id()
+            fields.setdefault("source_type", "upload")
+            fields.setdefault("uploaded_at", datetime.utcnow().isoformat())
+            pending.append((point_id, text, {"group_id": session_id, "session_name": session_name, **fields}))
+            chunks_delta += 1
+            bytes_delta += len(text.encode("utf-8"))
+            results.append({**result, "result": "created", "point_id": point_id})
+            continue
+
+        if chunk.get("point_id") is not None:
+            point = by_id.get(normalize_point_id(chunk["point_id"]))
+            missing = f"No point {chunk['point_id']} in this session"
+        else:
+            point = by_hash.get(target_hash(chunk))
+            missing = f"No chunk with hash {target_hash(chunk)} in this session"
+        if point is None or point.id in removed:
+            results.append({**result, "result": "not_found", "detail": missing})
+            continue
+
+        if status == "deleted":
+            removed.add(point.id)
+            deleted_ids.append(point.id)
+            chunks_delta -= 1
+            bytes_delta -= content_size(point.payload)
+            results.append({**result, "result": "deleted", "point_id": point.id})
+        else:
+            payload = {**point.payload, **fields, "group_id": session_id,
+                       "session_name": session_name or point.payload.get("session_name")}
+            pending.append((point.id, text, payload))
+            bytes_delta += len(text.encode("utf-8")) - content_size(point.payload)
+            results.append({**result, "result": "updated", "point_id": point.id})
+
+    # --- 3. Embed and write the edits, then drop the deletions ---
+    if pending:
+        print(f"[PATCH] Embedding and writing {len(pending)} chunks to DB")
+        upsert_points(pending, batch_size, embed_batch_size)
+    delete_points(deleted_ids)
+    bump_session_version(session_id)
+
+    summary = {
+        "upserted": len(pending),
+        "deleted": len(deleted_ids),
+        "chunks_delta": chunks_delta,
+        "bytes_delta": bytes_delta,
+    }
+    return summary, results
+
+def rag_pipeline_setup(session_id, session_name, documents, is_new=False, batch_size=None,
+                       embed_batch_size=None):
+    """
+    Apply chunk changes to a session and embed/upsert what changed.
+
+    Returns a summary with the number of points upserted and deleted and
+    the resulting change in chunk count and content bytes, which callers
+    feed into the session registry.
+    """
     points_to_upsert = []
     deleted_hashes = []
+    chunks_delta = 0
+    bytes_delta = 0
 
     # --- 1. Fetch existing chunks for this session ---
-    existing_chunks, _ = client.scroll(
-        collection_name=collection_name,
-        scroll_filter={"must": [{"key": "group_id", "match": {"value": session_id}}]},
-        limit=10_000
-    )
+    existing_chunks = list(iter_points(session_filter(session_id)))
 
     # Map by chunk_hash for fast lookup
     existing_map = {chunk.payload.get("chunk_hash"): chunk for chunk in existing_chunks}
 
-    # Collect numeric ids if available so we can continue numbering
-    existing_int_ids = []
-    for c in existing_chunks:
-        try:
-            existing_int_ids.append(int(c.id))
-        except Exception:
-            pass  # non-numeric id (e.g., uuid)
-
-    use_numeric_ids = len(existing_int_ids) > 0
-    next_numeric_id = max(existing_int_ids) + 1 if use_numeric_ids else None
-
-    def gen_new_id():
-        nonlocal next_numeric_id
-        if use_numeric_ids:
-            nid = next_numeric_id
-            next_numeric_id += 1
-            return nid
-        else:
-            return uuid.uuid4().hex
+    gen_new_id = PointIdAllocator(chunk.id for chunk in existing_chunks)
 
     # --- 2. Iterate over incoming documents ---
     for chunk in documents:
@@ -146,19 +602,25 @@ def rag_pipeline_setup(session_id, session_name, documents, is_new=False, batch_
         previous_hash = chunk.get("previous_hash")
         status = chunk.get("status")
 
+        old_size = 0
         if is_new:
             point_id = gen_new_id()
+            chunks_delta += 1
             chunk.setdefault("source_type", "upload")
             chunk.setdefault("uploaded_at", datetime.utcnow().isoformat())
             print(f"[NEW-UPLOAD] Appending chunk {chunk_hash} as id={point_id}")
         else:
             if status == "deleted":
                 deleted_hashes.append(chunk_hash)
+                if chunk_hash in existing_map:
+                    chunks_delta -= 1
+                    bytes_delta -= content_size(existing_map[chunk_hash].payload)
                 continue  # nothing to upsert for deleted chunks
 
             elif status == "modified":
                 old_point = existing_map[previous_hash]
                 point_id = old_point.id
+                old_size = content_size(old_point.payload)
                 print(f"[UPDATE] Replacing chunk {previous_hash} -> {chunk_hash} using id {point_id}")
 
             elif status == "unchanged":
@@ -167,46 +629,43 @@ def rag_pipeline_setup(session_id, session_name, documents, is_new=False, batch_
                 if metadata_changed:
                     print(f"[DRIFT] Metadata/content changed for {chunk_hash}, id={existing_map[chunk_hash].id}")
                     point_id = existing_map[chunk_hash].id
+                    old_size = content_size(existing_payload)
                 else:
                     continue  # unchanged -> skip
 
             elif status == "new":
                 point_id = gen_new_id()
+                chunks_delta += 1
                 print(f"[NEW] Inserting new chunk {chunk_hash} as id={point_id}")
 
-        # Build point
-        point = models.PointStruct(
-            id=point_id,
-            vector={
-                "all-MiniLM-L6-v2": models.Document(text=text, model=dense_model_name),
-                "bm25": models.Document(text=text, model=bm25_model_name),
-                "colbertv2.0": models.Document(text=text, model=late_interaction_model_name),
-            },
-            payload={"group_id": session_id, "session_name": session_name, **chunk},
-        )
-        points_to_upsert.append(point)
-
-        # --- 3. Batch upsert if we hit batch size ---
-        if len(points_to_upsert) >= batch_size:
-            print(f"[UPSERT] Writing batch of {len(points_to_upsert)} chunks to DB")
-            client.upsert(collection_name=collection_name, points=points_to_upsert)
-            points_to_upsert.clear()
+        bytes_delta += len(text.encode("utf-8")) - old_size
+        points_to_upsert.append((point_id, text, {"group_id": session_id, "session_name": session_name, **chunk}))
 
-    # --- 4. Final upsert for remaining points ---
+    # --- 3 & 4. Embed in large batches, upsert ready-made vectors ---
     if points_to_upsert:
-        print(f"[UPSERT] Writing final batch of {len(points_to_upsert)} chunks to DB")
-        client.upsert(collection_name=collection_name, points=points_to_upsert)
+        print(f"[UPSERT] Embedding and writing {len(points_to_upsert)} chunks to DB")
+        upsert_points(points_to_upsert, batch_size, embed_batch_size)
     else:
         print("[UPSERT] Nothing new to write")
 
-    # --- 5. Delete requested chunks ---
+    # --- 5. Delete requested chunks (scoped to this session) ---
     if deleted_hashes:
-        should_conditions = [
-            models.FieldCondition(key="chunk_hash", match=models.MatchValue(value=h))
-            for h in deleted_hashes
-        ]
         print(f"[DELETE] Removing {len(deleted_hashes)} chunks from DB (by payload chunk_hash)")
         client.delete(
             collection_name=collection_name,
-            points_selector=models.FilterSelector(filter=models.Filter(should=should_conditions)),
+            points_selector=models.FilterSelector(filter=models.Filter(
+                must=[
+                    models.FieldCondition(key="group_id", match=models.MatchValue(value=session_id)),
+                    models.FieldCondition(key="chunk_hash", match=models.MatchAny(any=deleted_hashes)),
+                ]
+            )),
         )
+
+    bump_session_version(session_id)
+
+    return {
+        "upserted": len(points_to_upsert),
+        "deleted": len(deleted_hashes),
+        "chunks_delta": chunks_delta,
+        "bytes_delta": bytes_delta,
+    }
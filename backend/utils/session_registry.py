@@ -0,0 +1,181 @@
+import os
+import uuid
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+from qdrant_client import models
+
+from utils.qdrant_setup import client, collection_name, iter_points
+
+load_dotenv()
+
+# One payload-only point per session, so list/exists/get never touch chunk data
+registry_collection = os.getenv("SESSION_REGISTRY_COLLECTION", f"{collection_name}_sessions")
+
+# Serialises read-modify-write of a session's counters within this process
+_session_locks = defaultdict(threading.Lock)
+_session_locks_guard = threading.Lock()
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+def _point_id(session_id: str) -> str:
+    # Session ids are client-supplied strings; map them onto valid Qdrant ids
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"optim-rag-session:{session_id}"))
+
+def _session_lock(session_id: str) -> threading.Lock:
+    with _session_locks_guard:
+        return _session_locks[session_id]
+
+def _write_record(record: dict):
+    client.upsert(
+        collection_name=registry_collection,
+        points=[models.PointStruct(id=_point_id(record["session_id"]), vector={}, payload=record)],
+        wait=True,
+    )
+
+
+# ---------------------- READS ----------------------
+def get_session_record(session_id: str):
+    points = client.retrieve(
+        collection_name=registry_collection,
+        ids=[_point_id(session_id)],
+        with_payload=True,
+    )
+    return points[0].payload if points else None
+
+def get_session_files(session_id: str) -> dict:
+    """Content hash of every source file ingested into the session, by file name."""
+    return (get_session_record(session_id) or {}).get("files") or {}
+
+def session_exists(session_id: str) -> bool:
+    return get_session_record(session_id) is not None
+
+def list_session_records():
+    records = []
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=registry_collection,
+            limit=256,
+            offset=offset,
+            with_payload=True,
+        )
+        records.extend(point.payload for point in points)
+        if offset is None:
+            break
+    return sorted(records, key=lambda r: r.get("createdAt") or "")
+
+
+# ---------------------- WRITES ----------------------
+def register_session(session_id: str, session_name: str, archive_name=None, archive_size=None,
+                     created_at=None, chunk_count=0, byte_size=0, files=None):
+    """
+    Create (or overwrite) the registry record of a session.
+    `files` maps each ingested source file name to its content hash.
+    """
+    now = _now()
+    with _session_lock(session_id):
+        _write_record({
+            "session_id": session_id,
+            "session_name": session_name,
+            "archiveName": archive_name,
+            "archiveSize": archive_size,
+            "createdAt": created_at or now,
+            "updatedAt": now,
+            "chunk_count": chunk_count,
+            "byte_size": byte_size,
+            "files": files or {},
+        })
+
+def apply_ingest_delta(session_id: str, session_name: str, summary: dict):
+    """
+    Fold a `rag_pipeline_setup` / `ingest_pipeline` summary into the session's
+    counters and file hashes. Called only after the chunk writes succeeded,
+    so the record never runs ahead of the data.
+    """
+    with _session_lock(session_id):
+        record = get_session_record(session_id) or {
+            "session_id": session_id,
+            "archiveName": None,
+            "archiveSize": None,
+            "createdAt": _now(),
+            "chunk_count": 0,
+            "byte_size": 0,
+        }
+        record["session_name"] = session_name or record.get("session_name")
+        record["chunk_count"] = max(0, record.get("chunk_count", 0) + summary.get("chunks_delta", 0))
+        record["byte_size"] = max(0, record.get("byte_size", 0) + summary.get("bytes_delta", 0))
+        if summary.get("files"):
+            record["files"] = {**(record.get("files") or {}), **summary["files"]}
+        record["updatedAt"] = _now()
+        _write_record(record)
+
+def delete_session_record(session_id: str):
+    with _session_lock(session_id):
+        client.delete(
+            collection_name=registry_collection,
+            points_selector=models.PointIdsList(points=[_point_id(session_id)]),
+            wait=True,
+        )
+
+
+# ---------------------- SETUP / BACKFILL ----------------------
+def backfill_registry() -> int:
+    """
+    Rebuild registry records from the chunk collection.
+
+    Scans every chunk once, recomputing chunk counts and byte sizes per
+    `group_id`. Existing records keep their creation time and archive info.
+    Safe to re-run. Returns the number of sessions written.
+    """
+    stats = {}
+    for point in iter_points(with_payload=["group_id", "session_name", "page_content", "uploaded_at",
+                                           "createdAt", "archiveName", "archiveSize"]):
+        payload = point.payload or {}
+        sid = payload.get("group_id")
+        if not sid:
+            continue
+        entry = stats.setdefault(sid, {
+            "session_name": payload.get("session_name"),
+            "createdAt": payload.get("createdAt") or payload.get("uploaded_at"),
+            "archiveName": payload.get("archiveName"),
+            "archiveSize": payload.get("archiveSize"),
+            "chunk_count": 0,
+            "byte_size": 0,
+        })
+        entry["chunk_count"] += 1
+        entry["byte_size"] += len(payload.get("page_content", "").encode("utf-8"))
+        uploaded_at = payload.get("uploaded_at")
+        if uploaded_at and (entry["createdAt"] is None or uploaded_at < entry["createdAt"]):
+            entry["createdAt"] = uploaded_at
+
+    for sid, entry in stats.items():
+        existing = get_session_record(sid) or {}
+        register_session(
+            sid,
+            entry["session_name"] or existing.get("session_name"),
+            archive_name=existing.get("archiveName") or entry["archiveName"],
+            archive_size=existing.get("archiveSize") or entry["archiveSize"],
+            created_at=existing.get("createdAt") or entry["createdAt"],
+            chunk_count=entry["chunk_count"],
+            byte_size=entry["byte_size"],
+            files=existing.get("files"),
+        )
+        print(f"[REGISTRY] {sid}: {entry['chunk_count']} chunks, {entry['byte_size']} bytes")
+
+    return len(stats)
+
+def ensure_registry_collection():
+    if client.collection_exists(collection_name=registry_collection):
+        return
+    client.create_collection(collection_name=registry_collection, vectors_config={})
+    # First start after upgrading: index the sessions that already exist
+    if client.count(collection_name=collection_name, exact=False).count > 0:
+        print(f"[REGISTRY] Created {registry_collection}, backfilling from {collection_name}")
+        backfill_registry()
+
+ensure_registry_collection()
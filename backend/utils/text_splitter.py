@@ -0,0 +1,190 @@
+import os
+import re
+from functools import lru_cache
+from dotenv import load_dotenv
+
+from utils.context_builder import count_tokens
+
+load_dotenv()
+
+# Default chunk length and overlap (repeated at the start of the next chunk), in CHUNK_UNIT
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "512"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "8"))
+# "words", or "tokens" counted with CONTEXT_TOKENIZER (the chat context budget's tokenizer)
+CHUNK_UNIT = os.getenv("CHUNK_UNIT", "words")
+# Where chunks prefer to end: "none" (exactly every CHUNK_SIZE units), "paragraph"
+# (at blank lines) or "markdown" (at blank lines, and each heading starts a new chunk)
+CHUNK_STRUCTURE = os.getenv("CHUNK_STRUCTURE", "none")
+# Characters read at a time when splitting on a delimiter
+SPLIT_BLOCK_CHARS = int(os.getenv("SPLIT_BLOCK_CHARS", str(1024 * 1024)))
+
+UNITS = ("words", "tokens")
+STRUCTURES = ("none", "paragraph", "markdown")
+
+HEADING = re.compile(r"#{1,6}(\s|$)")
+FENCES = ("```", "~~~")
+
+
+@lru_cache(maxsize=65536)
+def word_tokens(word: str) -> int:
+    # Leading space: mid-text words are encoded together with the space before them
+    return count_tokens(" " + word)
+
+
+class _Window:
+    """The chunk being built: words with their weight, source label and leading separator."""
+
+    def __init__(self):
+        self.words, self.weights, self.labels, self.seps = [], [], [], []
+        self.total = 0
+        self.fresh_from = 0  # words before this index were already sent as the previous chunk's overlap
+        self.boundary = 0    # start of the current paragraph
+
+    def extend(self, words, weights, label, sep):
+        self.words.extend(words)
+        self.weights.extend(weights)
+        self.labels.extend([label] * len(words))
+        self.seps.append(sep)
+        self.seps.extend([" "] * (len(words) - 1))
+        self.total += sum(weights)
+
+    def has_fresh(self) -> bool:
+        return len(self.words) > self.fresh_from
+
+    def _take(self, end: int, keep_from: int):
+        """Return words[:end] as `(label, text)`, keeping words[keep_from:] in the window."""
+        words, seps = self.words[:end], self.seps[:end]
+        if seps[1:].count(" ") == len(seps) - 1:
+            text = " ".join(words)
+        else:
+            text = words[0] + "".join(sep + word for sep, word in zip(seps[1:], words[1:]))
+        label = self.labels[0]
+        self.words, self.weights = self.words[keep_from:], self.weights[keep_from:]
+        self.labels, self.seps = self.labels[keep_from:], self.seps[keep_from:]
+        self.total = sum(self.weights)
+        return label, text
+
+    def cut(self, overlap: int, min_fill: int):
+        """
+        Take a chunk off the front: up to the current paragraph if that still
+        fills `min_fill` units, otherwise everything. The last `overlap` units
+        of the chunk stay in the window to start the next one.
+        """
+        end = len(self.words)
+        if self.boundary > self.fresh_from and sum(self.weights[:self.boundary]) >= min_fill:
+            end = self.boundary
+
+        keep_from, tail_weight = end, 0
+        while keep_from > 0 and tail_weight + self.weights[keep_from - 1] <= overlap:
+            keep_from -= 1
+            tail_weight += self.weights[keep_from]
+
+        chunk = self._take(end, keep_from)
+        self.fresh_from = self.boundary = end - keep_from
+        return chunk
+
+    def drain(self):
+        chunk = self._take(len(self.words), len(self.words))
+        self.fresh_from = self.boundary = 0
+        return chunk
+
+
+def split_text(lines, chunk_size: int = None, overlap: int = None, unit: str = None, structure: str = None):
+    """
+    Pack `(label, line)` pairs into chunks in a single pass, holding only the
+    chunk being built in memory.
+
+    Each chunk is about `chunk_size` units plus the first `overlap` units of
+    the next chunk. With the default "none" structure this is the classic
+    fixed word window (`words[i:i + chunk_size + overlap]` every `chunk_size`
+    words); "paragraph" and "markdown" end a chunk at the last paragraph
+    break that fits instead (if that leaves the chunk at least half full),
+    and "markdown" also starts a new chunk, without overlap, at each heading
+    outside code fences. A paragraph longer than a chunk is cut mid-paragraph.
+
+    Yields `(label, text)` per chunk, `label` being that of the line the
+    chunk's first word came from (e.g. its page number).
+    """
+    size = chunk_size or CHUNK_SIZE
+    overlap = CHUNK_OVERLAP if overlap is None else overlap
+    unit = unit or CHUNK_UNIT
+    structure = structure or CHUNK_STRUCTURE
+    if unit not in UNITS:
+        raise ValueError(f"Unknown chunk unit {unit!r}, expected one of {UNITS}")
+    if structure not in STRUCTURES:
+        raise ValueError(f"Unknown chunk structure {structure!r}, expected one of {STRUCTURES}")
+
+    limit = size + overlap
+    structured = structure != "none"
+    window = _Window()
+    in_fence = False
+    new_paragraph = False
+
+    for label, line in lines:
+        stripped = line.strip()
+        if structured:
+            if stripped.startswith(FENCES):
+                in_fence = not in_fence
+            elif not in_fence and not stripped:
+                window.boundary = len(window.words)
+                new_paragraph = True
+                continue
+            elif not in_fence and structure == "markdown" and HEADING.match(stripped):
+                if window.has_fresh():
+                    yield window.drain()
+                new_paragraph = False
+
+        words = stripped.split()
+        if not words:
+            continue
+        weights = [word_tokens(word) for word in words] if unit == "tokens" else [1] * len(words)
+        sep = "\n\n" if new_paragraph else "\n" if structured else " "
+        new_paragraph = False
+
+        # Add the line's words in runs that fit, cutting chunks in between
+        start = 0
+        while start < len(words):
+            room = limit - window.total
+            if unit == "words":
+                end = min(len(words), start + max(room, 0))
+            else:
+                end = start
+                while end < len(words) and weights[end] <= room:
+                    room -= weights[end]
+                    end += 1
+            if end == start:
+                if window.has_fresh():
+                    yield window.cut(overlap, size // 2)
+                    continue
+                end = start + 1  # a single word over the limit still needs a chunk
+            window.extend(words[start:end], weights[start:end], label, sep if start == 0 else " ")
+            start = end
+
+    if window.has_fresh():
+        yield window.drain()
+
+def split_delimited(stream, delimiter: str, block_chars: int = None):
+    """
+    Yield the parts of a text stream between `delimiter`s, like
+    `stream.read().split(delimiter)` but reading `block_chars` at a time.
+    """
+    block_chars = block_chars or SPLIT_BLOCK_CHARS
+    pending = ""
+    while block := stream.read(block_chars):
+        pending += block
+        parts = pending.split(delimiter)
+        pending = parts.pop()  # may continue in the next block
+        yield from parts
+    yield pending
+
+def file_lines(stream):
+    """`(None, line)` pairs of a text file, read line by line."""
+    for line in stream:
+        yield None, line
+
+def page_lines(pages):
+    """`(page_number, line)` pairs of extracted pages; each page ends a paragraph."""
+    for page_number, page in enumerate(pages, 1):
+        for line in page.splitlines():
+            yield page_number, line
+        yield page_number, ""
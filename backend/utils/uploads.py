@@ -0,0 +1,128 @@
+import os
+import shutil
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import List
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Largest single upload accepted, in bytes
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(2 * 1024 ** 3)))
+# Zip-bomb limits: members per archive and total bytes once extracted
+ARCHIVE_MAX_MEMBERS = int(os.getenv("ARCHIVE_MAX_MEMBERS", "10000"))
+ARCHIVE_MAX_UNCOMPRESSED_BYTES = int(os.getenv("ARCHIVE_MAX_UNCOMPRESSED_BYTES", str(4 * 1024 ** 3)))
+# Uploads and archive members are copied in blocks of this size, never read whole
+COPY_BUFFER_SIZE = int(os.getenv("COPY_BUFFER_SIZE", str(1024 * 1024)))
+
+
+class UploadRejected(ValueError):
+    """An upload or archive that is malformed or unsafe to extract."""
+
+class UploadTooLarge(UploadRejected):
+    """An upload or archive over one of the size/count limits."""
+
+
+def safe_filename(filename: str) -> str:
+    """Client-supplied file name reduced to its last path component."""
+    name = os.path.basename((filename or "").replace("\\", "/")).strip()
+    if name in ("", ".", ".."):
+        raise UploadRejected(f"Invalid file name: {filename!r}")
+    return name
+
+def copy_limited(src, dst, limit: int, what: str) -> int:
+    """Copy file object `src` to `dst` block by block, failing once more than `limit` bytes were read."""
+    written = 0
+    while True:
+        block = src.read(COPY_BUFFER_SIZE)
+        if not block:
+            return written
+        written += len(block)
+        if written > limit:
+            raise UploadTooLarge(f"{what} exceeds the {limit} byte limit")
+        dst.write(block)
+
+def save_upload(upload, dest_dir, max_bytes: int = None) -> str:
+    """
+    Stream an `UploadFile` into `dest_dir` under its sanitized name.
+    A partial file is removed if the upload is too large or the copy fails.
+    """
+    max_bytes = UPLOAD_MAX_BYTES if max_bytes is None else max_bytes
+    os.makedirs(dest_dir, exist_ok=True)
+    path = os.path.join(dest_dir, safe_filename(upload.filename))
+    try:
+        with open(path, "wb") as buffer:
+            copy_limited(upload.file, buffer, max_bytes, upload.filename)
+    except BaseException:
+        discard_file(path)
+        raise
+    return path
+
+def upload_error(e: UploadRejected):
+    """HTTP status for a rejected upload: 413 for limits, 400 otherwise."""
+    return 413 if isinstance(e, UploadTooLarge) else 400
+
+
+# ---------------------- ARCHIVES ----------------------
+def member_path(dest_dir: Path, name: str) -> Path:
+    """Destination of archive member `name`, refusing anything that would land outside `dest_dir`."""
+    parts = PurePosixPath(name.replace("\\", "/")).parts
+    if not parts or parts[0] == "/" or ":" in parts[0] or ".." in parts:
+        raise UploadRejected(f"Unsafe path in archive: {name!r}")
+    target = dest_dir.joinpath(*parts).resolve()
+    if not target.is_relative_to(dest_dir):
+        raise UploadRejected(f"Unsafe path in archive: {name!r}")
+    return target
+
+def extract_archive(archive_path, dest_dir, max_members: int = None, max_bytes: int = None) -> List[str]:
+    """
+    Extract a ZIP into `dest_dir` one member at a time and return the file paths.
+
+    Member count and declared sizes are checked before anything is written;
+    the bytes actually inflated are counted as well, so an archive lying
+    about its sizes is stopped at `max_bytes` too. Members with absolute
+    paths or `..` components are rejected.
+    """
+    max_members = ARCHIVE_MAX_MEMBERS if max_members is None else max_members
+    max_bytes = ARCHIVE_MAX_UNCOMPRESSED_BYTES if max_bytes is None else max_bytes
+    dest_dir = Path(dest_dir).resolve()
+
+    try:
+        archive = zipfile.ZipFile(archive_path, "r")
+    except zipfile.BadZipFile as e:
+        raise UploadRejected(f"Invalid ZIP archive: {e}")
+
+    with archive:
+        members = [info for info in archive.infolist() if not info.is_dir()]
+        if len(members) > max_members:
+            raise UploadTooLarge(f"Archive has {len(members)} files, the limit is {max_members}")
+        declared = sum(info.file_size for info in members)
+        if declared > max_bytes:
+            raise UploadTooLarge(f"Archive expands to {declared} bytes, the limit is {max_bytes}")
+
+        extracted = []
+        remaining = max_bytes
+        for info in members:
+            target = member_path(dest_dir, info.filename)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                with archive.open(info) as src, open(target, "wb") as dst:
+                    extracted.append(str(target))
+                    remaining -= copy_limited(src, dst, remaining, "Extracted archive")
+            except (zipfile.BadZipFile, NotImplementedError, RuntimeError) as e:
+                # Corrupt member, unsupported compression or encryption
+                raise UploadRejected(f"Cannot extract {info.filename!r}: {e}")
+
+    print(f"[UPLOAD] Extracted {len(extracted)} files ({max_bytes - remaining} bytes) from {archive_path}")
+    return extracted
+
+
+# ---------------------- CLEANUP ----------------------
+def discard_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def discard_dir(path):
+    shutil.rmtree(path, ignore_errors=True)
@@ -86,6 +86,7 @@ export default function ChunkEditor() {
           page_content: apiChunk.page_content,
           status: "unchanged" as const,
           originalHash: apiChunk.chunk_hash,
+          point_id: apiChunk.point_id,
         })
       );
 
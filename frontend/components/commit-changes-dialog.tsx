@@ -12,7 +12,7 @@ import {
   DialogTrigger,
 } from "@/components/ui/dialog"
 import { Loader2, Upload } from "lucide-react"
-import { updateChunks, uploadFiles } from "@/lib/api"
+import { patchChunks, uploadFiles } from "@/lib/api"
 import type { Chunk, UploadedFile } from "@/types/chunk"
 import { useToast } from "@/hooks/use-toast"
 
@@ -47,7 +47,10 @@ export function CommitChangesDialog({ chunks, onCommitSuccess, sessionId, sessio
         }
       }
 
-      await updateChunks(sessionId, sessionName, chunks)
+      const changedChunks = chunks.filter((chunk) => chunk.status !== "unchanged")
+      if (changedChunks.length > 0) {
+        await patchChunks(sessionId, sessionName, changedChunks)
+      }
 
       toast({
         title: "Changes Committed Successfully",
@@ -23,6 +23,17 @@ export async function updateChunks(sessionId: string, sessionName:string, docume
   return res.json()
 }
 
+// --- 2b. Apply only changed chunks (new / modified / deleted) ---
+export async function patchChunks(sessionId: string, sessionName: string, chunks: Chunk[]) {
+  const res = await fetch(`${API_URL}/chunks/${sessionId}`, {
+    method: "PATCH",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ session_name: sessionName, chunks }),
+  })
+  if (!res.ok) throw new Error("Failed to update chunks")
+  return res.json()
+}
+
 // --- 3. Delete a session ---
 export async function deleteSession(sessionId: string) {
   const res = await fetch(`${API_URL}/session/${sessionId}`, {
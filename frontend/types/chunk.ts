@@ -9,6 +9,7 @@ export interface Chunk {
   status: "unchanged" | "modified" | "new" | "deleted"
   lastEdited?: string
   originalHash?: string
+  point_id?: number | string | null
 }
 
 export type ChunkStatus = "unchanged" | "modified" | "new" | "deleted"